@@ -0,0 +1,34 @@
+"""
+Benchmarks of the prediction of the inference backends on the CPU, with the small
+Keras network of stand_in.create_keras_model and its ONNX export in place of the
+DSen2 networks. benchmarks/calibrate_throughput.py measures the backends with the
+cost of the real networks for the planner.
+"""
+import os
+
+from context import backends, convert_models, patches, stand_in
+from harness import benchmark, random_bands
+
+
+def _predict(backend, size, tmp_dir):
+    model_filename = os.path.join(tmp_dir, "bench_20m.h5")
+    if not os.path.isfile(model_filename):
+        stand_in.create_keras_model("20m", model_filename)
+    if backend == "onnx" and not os.path.isfile(
+        backends.onnx_model_path(model_filename)
+    ):
+        convert_models.export_onnx(model_filename)
+    d10, d20 = random_bands(size, 4), random_bands(size // 2, 6, 1)
+    test = list(patches.get_test_patches(d10, d20, patch_size=128, border=8))
+    model = backends.get_backend(backend).load_model(model_filename)
+    return lambda: model.predict(test)
+
+
+@benchmark("backends")
+def keras_predict(size, tmp_dir):
+    return _predict("keras", size, tmp_dir)
+
+
+@benchmark("backends")
+def onnx_predict(size, tmp_dir):
+    return _predict("onnx", size, tmp_dir)
@@ -0,0 +1,80 @@
+"""
+Benchmarks of reading the input bands and writing the output image.
+"""
+import os
+
+import rasterio
+from rasterio.transform import from_origin
+
+from context import inference, synthetic_product, Superresolution
+from harness import benchmark, random_bands, stand_in_models
+
+
+def _profile(size, count):
+    return {
+        "driver": "GTiff",
+        "dtype": "uint16",
+        "width": size,
+        "height": size,
+        "count": count,
+        "crs": "EPSG:32633",
+        "transform": from_origin(399960, 5900040, 10.0, 10.0),
+        "tiled": True,
+        "blockxsize": 512,
+        "blockysize": 512,
+    }
+
+
+@benchmark("inference")
+def data_final(size, tmp_dir):
+    path = os.path.join(tmp_dir, f"input_{size}.tif")
+    data = random_bands(size, 4)
+    with rasterio.open(path, "w", **_profile(size, 4)) as d_s:
+        d_s.write(data.transpose((2, 0, 1)))
+    return lambda: Superresolution.data_final(
+        path, [0, 1, 2, 3], 0, 0, size - 1, size - 1, 1, 1
+    )
+
+
+@benchmark("inference")
+def save_result(size, tmp_dir):
+    bands = ["B5", "B6", "B7", "B8A", "B11", "B12", "B1", "B9"]
+    output = random_bands(size, len(bands))
+    descriptions = {band: f"{band} (500 nm)" for band in bands}
+    path = os.path.join(tmp_dir, f"output_{size}.tif")
+    return lambda: inference.save_result(
+        output, bands, descriptions, _profile(size, len(bands)), path
+    )
+
+
+@benchmark("inference")
+def start_preview(size, tmp_dir):
+    """
+    The whole block on a synthetic product, without the networks.
+    """
+    image_id = f"product_{size}"
+    synthetic_product.create_product(tmp_dir, image_id, size=size)
+    process = inference.SuperresolutionProcess(
+        {"preview": True, "clip_to_aoi": False},
+        input_dir=tmp_dir,
+        output_dir=tmp_dir + "/",
+    )
+    return lambda: process.start(image_id, f"{image_id}_superresolution.tif")
+
+
+@benchmark("inference")
+def start_stand_in(size, tmp_dir):
+    """
+    The whole block on a synthetic product with the stand-ins of the networks.
+    """
+    image_id = f"product_{size}"
+    synthetic_product.create_product(tmp_dir, image_id, size=size)
+    process = inference.SuperresolutionProcess(
+        {"clip_to_aoi": False}, input_dir=tmp_dir, output_dir=tmp_dir + "/"
+    )
+
+    def run():
+        with stand_in_models():
+            process.start(image_id, f"{image_id}_superresolution.tif")
+
+    return run
@@ -0,0 +1,43 @@
+"""
+Benchmarks of the patching, upsampling and recomposition in patches.py.
+"""
+import numpy as np
+
+from context import patches
+from harness import benchmark, random_bands
+
+
+@benchmark("patches")
+def get_patches(size, _):
+    d10 = random_bands(size, 4)
+    along = size // 2 // 56
+    return lambda: patches.get_patches(d10, 128, 8, along, along, pad=8)
+
+
+@benchmark("patches")
+def get_test_patches(size, _):
+    d10, d20 = random_bands(size, 4), random_bands(size // 2, 6, 1)
+    return lambda: patches.get_test_patches(d10, d20, patch_size=128, border=8)
+
+
+@benchmark("patches")
+def get_test_patches60(size, _):
+    d10, d20 = random_bands(size, 4), random_bands(size // 2, 6, 1)
+    d60 = random_bands(size // 6, 2, 2)
+    return lambda: patches.get_test_patches60(d10, d20, d60, patch_size=192, border=12)
+
+
+@benchmark("patches")
+def interp_patches(size, _):
+    along = size // 2 // 56
+    p20 = patches.get_patches(random_bands(size // 2, 6, 1), 64, 4, along, along, pad=4)
+    shape = (p20.shape[0], 4, 128, 128)
+    return lambda: patches.interp_patches(p20, shape)
+
+
+@benchmark("patches")
+def recompose_images(size, _):
+    n_patches = (size // 2 // 56 + 1) ** 2
+    prediction = np.random.RandomState(0).rand(n_patches, 6, 128, 128)
+    prediction = prediction.astype(np.float32)
+    return lambda: patches.recompose_images(prediction, border=8, size=(size, size))
@@ -0,0 +1,38 @@
+"""
+Benchmarks of the batching, the prediction loop and both networks in supres.py.
+The networks are replaced by their stand-ins, see stand_in.py, so only the
+overhead around the inference is timed.
+"""
+from context import patches, supres, stand_in
+from harness import benchmark, random_bands, stand_in_models
+
+
+def _test_patches(size):
+    d10, d20 = random_bands(size, 4), random_bands(size // 2, 6, 1)
+    return list(patches.get_test_patches(d10, d20, patch_size=128, border=8))
+
+
+@benchmark("supres")
+def batch_generator(size, _):
+    test = _test_patches(size)
+    return lambda: list(supres.BatchGenerator(test))
+
+
+@benchmark("supres")
+def predict(size, _):
+    test = _test_patches(size)
+    # pylint: disable=protected-access
+    return lambda: supres._predict(test, stand_in.stand_in_path("20m"))
+
+
+@benchmark("supres")
+def run_models(size, _):
+    d10, d20 = random_bands(size, 4), random_bands(size // 2, 6, 1)
+    d60 = random_bands(size // 6, 2, 2)
+    output = random_bands(size, 8)
+
+    def run():
+        with stand_in_models():
+            supres.run_models(d10, d20, d60, "MSIL1C", output, slice(0, 6), slice(6, 8))
+
+    return run
@@ -0,0 +1,142 @@
+"""
+Measures the throughput of the inference backends on the CPU and saves it as the
+calibration of the planner, src/throughput.json, see planner.load_throughput.
+
+The 20m and the 60m network are timed on random patches of their own patch size,
+with the DSen2 models of the block if their weights exist, otherwise with networks
+of the same architecture and random weights, see stand_in.create_keras_model. The
+cost does not depend on the weights. Run it on the machine type the block runs
+on, and again after a change of the models, the backends or the base image.
+
+Usage:
+    python benchmarks/calibrate_throughput.py --patches 16 --repeat 3
+"""
+import argparse
+import json
+import os
+import platform
+import tempfile
+from typing import Dict, List
+
+import numpy as np
+
+from context import backends, convert_models, planner, quantization, stand_in, supres
+from harness import measure, random_bands
+
+
+def random_patches(network: str, n_patches: int) -> List[np.ndarray]:
+    """
+    Returns `n_patches` random inputs of the "20m" or "60m" network in the units of
+    the network, see supres._predict.
+    """
+    size = planner.NETWORKS[network]["patch_size"]
+    return [
+        np.ascontiguousarray(
+            random_bands(size, n_patches * channels, seed)
+            .reshape(size, size, n_patches, channels)
+            .transpose((2, 3, 0, 1)),
+            dtype=np.float32,
+        )
+        / supres.SCALE
+        for seed, channels in enumerate(stand_in.INPUT_CHANNELS[network])
+    ]
+
+
+def prepare_models(model_filename: str, patches: List[np.ndarray]):
+    """
+    Exports the ONNX model and quantizes it for the onnx_int8 backend, unless they
+    exist. The quantization on random patches is only good for the timing.
+    """
+    if not os.path.isfile(backends.onnx_model_path(model_filename)):
+        convert_models.export_onnx(model_filename)
+    if not os.path.isfile(backends.quantized_model_path(model_filename)):
+        quantization.quantize_model(model_filename, patches)
+
+
+def calibrate(
+    network: str, model_filename: str, names: List[str], n_patches: int, repeat: int
+) -> Dict[str, float]:
+    """
+    Returns the input pixels per second of each of the inference backends `names`
+    on `n_patches` patches of the network, by the fastest of `repeat` runs.
+    """
+    patches = random_patches(network, n_patches)
+    pixels = n_patches * planner.NETWORKS[network]["patch_size"] ** 2
+    throughput = {}
+    for name in names:
+        model = backends.get_backend(name).load_model(model_filename)
+        result = measure(lambda: model.predict(patches), repeat)
+        throughput[name] = round(pixels / result["min_seconds"])
+        print(f"{network} {name}: {throughput[name]:.0f} input px/s")
+    return throughput
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Calibrate the throughput of the inference backends for the "
+        "planner.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "-n", "--patches", type=int, default=16, help="Patches per timed run."
+    )
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=3, help="Timed runs per backend."
+    )
+    parser.add_argument(
+        "-m",
+        "--models",
+        type=str,
+        nargs=2,
+        default=list(supres.model_filenames("MSIL1C")),
+        help="hdf5 model files of the 20m and the 60m network, DSen2 networks with "
+        "random weights if they are missing.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default=planner.CALIBRATION_PATH,
+        help="Path of the JSON calibration.",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    ARGS = parse_args()
+    MODELS, THROUGHPUT = {}, {}
+    with tempfile.TemporaryDirectory() as TMP_DIR:
+        for NETWORK, MODEL_FILENAME in zip(("20m", "60m"), ARGS.models):
+            MODELS[NETWORK] = os.path.basename(MODEL_FILENAME)
+            if not os.path.isfile(MODEL_FILENAME):
+                MODEL_FILENAME = stand_in.create_keras_model(
+                    NETWORK,
+                    os.path.join(TMP_DIR, f"dsen2_{NETWORK}.h5"),
+                    resblocks=stand_in.RESBLOCKS,
+                )
+                MODELS[NETWORK] = (
+                    f"DSen2 {NETWORK} architecture, "
+                    f"{stand_in.RESBLOCKS} residual blocks"
+                )
+            prepare_models(MODEL_FILENAME, random_patches(NETWORK, ARGS.patches))
+            THROUGHPUT[NETWORK] = calibrate(
+                NETWORK,
+                MODEL_FILENAME,
+                list(backends.BACKENDS),
+                ARGS.patches,
+                ARGS.repeat,
+            )
+    CALIBRATION = {
+        "models": MODELS,
+        "patch_size": {
+            network: planner.NETWORKS[network]["patch_size"] for network in MODELS
+        },
+        "patches": ARGS.patches,
+        "machine": {
+            "processor": platform.processor() or platform.machine(),
+            "cpus": os.cpu_count(),
+        },
+        "throughput": THROUGHPUT,
+    }
+    with open(ARGS.output, "w") as f_p:
+        f_p.write(json.dumps(CALIBRATION, indent=2) + "\n")
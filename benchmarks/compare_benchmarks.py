@@ -0,0 +1,192 @@
+"""
+Compares benchmark results to a stored baseline and fails if a benchmark got
+slower or uses more memory than its tolerance allows.
+
+Usage:
+    python benchmarks/compare_benchmarks.py --baseline benchmarks/baseline.json
+    python benchmarks/compare_benchmarks.py --results results.json
+    python benchmarks/compare_benchmarks.py --update
+
+Without --results the benchmarks of the baseline are run first. With --update the
+results replace the baseline instead.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+from typing import Dict, List, Tuple
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Allowed ratio of the current to the baseline time and memory, and differences
+# below which a change is noise
+DEFAULT_TOLERANCE = {
+    "time": 1.5,
+    "memory": 1.1,
+    "noise_seconds": 0.01,
+    "noise_mb": 1.0,
+}
+
+
+def load_json(path: str) -> Dict:
+    with open(path) as f_p:
+        return json.load(f_p)
+
+
+def tolerance(name: str, tolerances: Dict) -> Dict:
+    """
+    Returns the tolerance of a benchmark: the defaults updated with the entry of
+    the longest prefix of `name` in `tolerances`, e.g. "patches" or
+    "patches.interp_patches[tile]".
+    """
+    result = dict(DEFAULT_TOLERANCE)
+    for prefix in sorted(tolerances, key=len):
+        if name.startswith(prefix):
+            result.update(tolerances[prefix])
+    return result
+
+
+def compare(baseline: Dict, current: Dict, tolerances: Dict) -> Tuple[List, bool]:
+    """
+    Compares the benchmarks of two result files, see harness.run_benchmarks.
+    The time is compared by the fastest run, which is least affected by other
+    load on the machine.
+
+    Returns:
+        A row per benchmark (name, baseline and current time and memory, status)
+        and whether any benchmark regressed or is missing.
+    """
+    rows = []
+    failed = False
+    old, new = baseline["benchmarks"], current["benchmarks"]
+    for name in sorted(set(old) | set(new)):
+        if name not in new:
+            rows.append((name, old[name], None, "missing"))
+            failed = True
+            continue
+        if name not in old:
+            rows.append((name, None, new[name], "new"))
+            continue
+        limits = tolerance(name, tolerances)
+        problems = []
+        before, after = old[name]["min_seconds"], new[name]["min_seconds"]
+        if after > before * limits["time"] and after - before > limits["noise_seconds"]:
+            problems.append("slower")
+        before, after = old[name]["peak_memory_mb"], new[name]["peak_memory_mb"]
+        if after > before * limits["memory"] and after - before > limits["noise_mb"]:
+            problems.append("more memory")
+        failed = failed or bool(problems)
+        rows.append((name, old[name], new[name], ", ".join(problems) or "ok"))
+    return rows, failed
+
+
+def _ratio(before: float, after: float) -> str:
+    return f"{after / before:.2f}x" if before else "-"
+
+
+def format_report(rows: List) -> str:
+    """
+    Formats the rows of compare as a table.
+    """
+    header = ("benchmark", "time", "change", "memory MB", "change", "status")
+    lines = []
+    for name, old, new, status in rows:
+        if old is None or new is None:
+            result = old or new
+            lines.append(
+                (
+                    name,
+                    f"{result['min_seconds']:.4f}s",
+                    "",
+                    f"{result['peak_memory_mb']:.1f}",
+                    "",
+                    status,
+                )
+            )
+            continue
+        lines.append(
+            (
+                name,
+                f"{old['min_seconds']:.4f}s -> {new['min_seconds']:.4f}s",
+                _ratio(old["min_seconds"], new["min_seconds"]),
+                f"{old['peak_memory_mb']:.1f} -> {new['peak_memory_mb']:.1f}",
+                _ratio(old["peak_memory_mb"], new["peak_memory_mb"]),
+                status,
+            )
+        )
+    widths = [max(len(line[i]) for line in [header] + lines) for i in range(6)]
+    return "\n".join(
+        "  ".join(cell.ljust(width) for cell, width in zip(line, widths)).rstrip()
+        for line in [header] + lines
+    )
+
+
+def run_baseline_benchmarks(baseline: Dict, repeat: int) -> Dict:
+    """
+    Runs the benchmarks and sizes of the baseline.
+    """
+    # pylint: disable=import-outside-toplevel,unused-import
+    sys.path.insert(0, BENCHMARKS_DIR)
+    import run_benchmarks
+    from harness import SIZES, run_benchmarks as run
+
+    names = [name.split("[")[0] for name in baseline["benchmarks"]]
+    sizes = {name.split("[")[1].rstrip("]") for name in baseline["benchmarks"]}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        return run([s for s in SIZES if s in sizes], tmp_dir, repeat, names)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Compare benchmark results to a baseline.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--baseline",
+        type=str,
+        default=os.path.join(BENCHMARKS_DIR, "baseline.json"),
+        help="Path of the baseline results.",
+    )
+    parser.add_argument(
+        "--results",
+        type=str,
+        help="Path of the results of run_benchmarks.py, run now if not given.",
+    )
+    parser.add_argument(
+        "--tolerances",
+        type=str,
+        default=os.path.join(BENCHMARKS_DIR, "tolerances.json"),
+        help="Path of the tolerances per benchmark prefix.",
+    )
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=5, help="Timed runs per benchmark."
+    )
+    parser.add_argument(
+        "--update", action="store_true", help="Replace the baseline by the results."
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    ARGS = parse_args()
+    BASELINE = load_json(ARGS.baseline)
+    if ARGS.results:
+        CURRENT = load_json(ARGS.results)
+    else:
+        CURRENT = run_baseline_benchmarks(BASELINE, ARGS.repeat)
+    if ARGS.update:
+        with open(ARGS.baseline, "w") as F_P:
+            F_P.write(json.dumps(CURRENT, indent=2, sort_keys=True))
+        sys.exit(0)
+    if BASELINE.get("machine") != CURRENT.get("machine"):
+        print(
+            "Warning: the baseline was measured on another machine, "
+            f"{BASELINE.get('machine')} vs {CURRENT.get('machine')}"
+        )
+    TOLERANCES = load_json(ARGS.tolerances) if os.path.exists(ARGS.tolerances) else {}
+    ROWS, FAILED = compare(BASELINE, CURRENT, TOLERANCES)
+    print(format_report(ROWS))
+    if FAILED:
+        print("Performance regression against the baseline")
+    sys.exit(int(FAILED))
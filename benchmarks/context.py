@@ -0,0 +1,20 @@
+"""
+This module makes the block modules importable in the benchmarks.
+"""
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src/")))
+
+
+# pylint: disable=unused-import,wrong-import-position
+import patches
+import supres
+import inference
+import synthetic_product
+import stand_in
+from s2_tiles_supres import Superresolution
+import backends
+import convert_models
+import planner
+import quantization
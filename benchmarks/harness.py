@@ -0,0 +1,136 @@
+"""
+Registry and measurement of the benchmarks. A benchmark is a setup function that
+takes the image size in 10m pixels and a temporary directory, prepares its inputs
+and returns the function that is timed.
+"""
+import json
+import os
+from contextlib import contextmanager
+from unittest import mock
+import platform
+import statistics
+import time
+import tracemalloc
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+MB = 1024 ** 2
+
+# Side lengths in 10m pixels, multiples of 6 so that the 60m bands fit, from a
+# small AOI up to a full tile
+SIZES = {"tiny": 216, "small": 504, "medium": 2016, "large": 5490, "tile": 10980}
+
+
+class Benchmark(NamedTuple):
+    suite: str
+    name: str
+    setup: Callable[[int, str], Callable[[], object]]
+
+
+BENCHMARKS: List[Benchmark] = []
+
+
+def benchmark(suite: str):
+    """
+    Registers a setup function as the benchmark `<suite>.<function name>`.
+    """
+
+    def register(setup):
+        BENCHMARKS.append(Benchmark(suite, setup.__name__, setup))
+        return setup
+
+    return register
+
+
+@contextmanager
+def stand_in_models(sleep_ms: float = 0):
+    """
+    Replaces the networks by their stand-ins, see stand_in.py.
+    """
+    with mock.patch.dict(os.environ, {"DSEN2_STAND_IN": f"{sleep_ms:g}"}):
+        yield
+
+
+def random_bands(size: int, n_bands: int, seed: int = 0) -> np.ndarray:
+    """
+    Returns a channels last uint16 image with reflectance-like values.
+    """
+    return (
+        np.random.RandomState(seed)
+        .randint(0, 10000, (size, size, n_bands))
+        .astype(np.uint16)
+    )
+
+
+def measure(run: Callable[[], object], repeat: int) -> Dict:
+    """
+    Runs `run` once with tracemalloc for the peak memory, which also warms it up,
+    and `repeat` times for the wall time. tracemalloc traces the numpy buffers
+    but not the memory that native libraries such as TensorFlow allocate.
+    """
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return {
+        "seconds": statistics.median(times),
+        "min_seconds": min(times),
+        "repeat": repeat,
+        "peak_memory_mb": peak / MB,
+    }
+
+
+def run_benchmarks(
+    sizes: Sequence[str],
+    tmp_dir: str,
+    repeat: int = 3,
+    selected: Optional[Sequence[str]] = None,
+) -> Dict:
+    """
+    Runs the registered benchmarks, or those whose name starts with one of
+    `selected`, for every size.
+
+    Returns:
+        The results keyed by `<suite>.<name>[<size>]`, with the time, throughput
+        in megapixels (10m) per second and peak memory, and the machine.
+    """
+    results = {}
+    for size_name in sizes:
+        size = SIZES[size_name]
+        for bench in BENCHMARKS:
+            name = f"{bench.suite}.{bench.name}"
+            if selected and not any(name.startswith(s) for s in selected):
+                continue
+            run = bench.setup(size, tmp_dir)
+            result = measure(run, repeat)
+            del run
+            result["size"] = size
+            result["megapixels_per_second"] = size ** 2 / result["seconds"] / 1e6
+            results[f"{name}[{size_name}]"] = result
+            print(
+                f"{name}[{size_name}]: {result['seconds']:.3f}s, "
+                f"{result['megapixels_per_second']:.2f} MP/s, "
+                f"{result['peak_memory_mb']:.0f} MB"
+            )
+    return {
+        "machine": {
+            "processor": platform.processor() or platform.machine(),
+            "cpus": os.cpu_count(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+        },
+        "benchmarks": results,
+    }
+
+
+def save_results(results: Dict, path: str):
+    with open(path, "w") as f_p:
+        f_p.write(json.dumps(results, indent=2, sort_keys=True))
@@ -0,0 +1,56 @@
+"""
+Runs the benchmarks of the hot paths on the CPU and saves the results as JSON.
+
+Usage:
+    python benchmarks/run_benchmarks.py --sizes small medium --output results.json
+"""
+import argparse
+import tempfile
+
+# pylint: disable=unused-import
+import bench_patches
+import bench_supres
+import bench_inference
+import bench_backends
+from harness import SIZES, run_benchmarks, save_results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the patching, upsampling, recomposition, I/O and "
+        "inference backends.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "-s",
+        "--sizes",
+        nargs="+",
+        choices=list(SIZES),
+        default=["small", "medium"],
+        help="Image sizes, tile is a full 10980 x 10980 px tile.",
+    )
+    parser.add_argument(
+        "-b",
+        "--benchmarks",
+        nargs="*",
+        help="Only run the benchmarks whose name starts with one of these, "
+        "e.g. patches or supres.predict.",
+    )
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=3, help="Timed runs per benchmark."
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default="benchmark_results.json",
+        help="Path of the JSON results.",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    ARGS = parse_args()
+    with tempfile.TemporaryDirectory() as TMP_DIR:
+        RESULTS = run_benchmarks(ARGS.sizes, TMP_DIR, ARGS.repeat, ARGS.benchmarks)
+    save_results(RESULTS, ARGS.output)
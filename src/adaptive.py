@@ -0,0 +1,220 @@
+"""
+This module runs the networks only on the patches with detail in their 10m bands,
+selected with the adaptive_threshold parameter. DSen2 adds a residual learned from
+the 10m bands to the bilinearly upsampled 20m and 60m bands. On open water, desert
+or uniform fields the 10m bands have little detail and the residual is close to 0,
+so the upsampled bands of these patches are used as they are.
+
+The detail of a patch is the mean absolute difference between neighbouring pixels
+of its 10m bands, in the units of the network inputs, i.e. the reflectance divided
+by supres.SCALE. Where a predicted patch meets a skipped one, the residual of the
+predicted patch fades out over TRANSITION pixels, so there is no seam.
+
+Usage, to measure the skipped patches and the error against the full inference:
+    python src/adaptive.py --input-dir /tmp/input --image-id synthetic \
+        --thresholds 0.005 0.01 0.02
+"""
+import argparse
+import json
+import os
+import tempfile
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import rasterio
+
+from profiling import stage
+
+# Width in 10m pixels of the transition from a predicted to a skipped patch
+TRANSITION = 16
+# Patches scored at once, which bounds the memory of the differences
+SCORE_CHUNK = 64
+
+
+def detail_scores(p10: np.ndarray, scale: float = 1) -> np.ndarray:
+    """
+    Returns the mean absolute difference between horizontally and vertically
+    neighbouring pixels of each of the (patches, bands, height, width) 10m
+    patches, divided by `scale`.
+    """
+    scores = np.empty(p10.shape[0], dtype=np.float32)
+    for start in range(0, p10.shape[0], SCORE_CHUNK):
+        chunk = np.asarray(p10[start : start + SCORE_CHUNK], np.float32) / scale
+        scores[start : start + SCORE_CHUNK] = np.abs(np.diff(chunk, axis=2)).mean(
+            axis=(1, 2, 3)
+        ) + np.abs(np.diff(chunk, axis=3)).mean(axis=(1, 2, 3))
+    return scores
+
+
+def predict_adaptive(
+    test: List[np.ndarray],
+    predict: Callable,
+    threshold: float,
+    scales: Optional[Sequence[float]] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Predicts the patches whose 10m detail reaches the threshold and takes the
+    upsampled bands, the last input of the network, for the others. Both are
+    written into one output array, the upsampled bands are converted in chunks of
+    the skipped patches only.
+
+    Args:
+        test: The inputs of the network, see supres._predict.
+        predict: Predicts a list of inputs like `test`.
+        scales: The divisors of the inputs, see supres._predict.
+
+    Returns:
+        The prediction of all patches in the units of the prediction, and which
+        patches were predicted.
+    """
+    with stage("score", patches=test[0].shape[0]):
+        predicted = detail_scores(test[0], scales[0] if scales else 1) >= threshold
+    prediction = np.empty(test[-1].shape, dtype=np.float32)
+    skipped = np.flatnonzero(~predicted)
+    with stage("skip", patches=skipped.size):
+        for start in range(0, skipped.size, SCORE_CHUNK):
+            chunk = skipped[start : start + SCORE_CHUNK]
+            prediction[chunk] = test[-1][chunk]
+            if scales:
+                prediction[chunk] /= scales[-1]
+    if skipped.size < predicted.size:
+        prediction[predicted] = predict([inputs[predicted] for inputs in test])
+    return prediction, predicted
+
+
+def _box_mean(image: np.ndarray, radius: int) -> np.ndarray:
+    """
+    Returns the mean of a 2D image over squares of 2 * radius + 1 pixels, with the
+    image repeated at its edges.
+    """
+    size = 2 * radius + 1
+    for axis in (0, 1):
+        padding = [(0, 0), (0, 0)]
+        padding[axis] = (radius + 1, radius)
+        cumsum = np.cumsum(np.pad(image, padding, mode="edge"), axis=axis)
+        length = image.shape[axis]
+        image = (
+            np.take(cumsum, np.arange(size, size + length), axis=axis)
+            - np.take(cumsum, np.arange(length), axis=axis)
+        ) / size
+    return image
+
+
+def fade_residual(
+    images: np.ndarray,
+    interp: np.ndarray,
+    predicted: np.ndarray,
+    transition: int = TRANSITION,
+) -> np.ndarray:
+    """
+    Fades out the residual of the predicted `images` over the upsampled bands
+    `interp` within `transition` pixels of the skipped pixels, in place. The
+    images are channels last, `predicted` is 1 where they were predicted and 0
+    where they were skipped.
+    """
+    weight = np.clip(2 * _box_mean(predicted, transition) - 1, 0, 1) * predicted
+    images -= interp
+    images *= weight[:, :, np.newaxis]
+    images += interp
+    return images
+
+
+def adaptive_report(report: Dict) -> Dict:
+    """
+    Returns the patches and the skipped share per network of a profile report,
+    see profiling.StageProfile.report.
+    """
+    networks = {}
+    for name, record in report["stages"].items():
+        network, _, stage_name = name.rpartition("/")
+        if stage_name == "score":
+            skipped = report["stages"].get(f"{network}/skip" if network else "skip")
+            skipped = skipped["patches"] if skipped else 0
+            networks[network or "all"] = {
+                "patches": record["patches"],
+                "skipped": skipped,
+                "skipped_fraction": skipped / max(record["patches"], 1),
+            }
+    return networks
+
+
+def evaluate(
+    input_dir: str,
+    image_id: str,
+    thresholds: Sequence[float],
+    params: Optional[Dict] = None,
+    output_dir: Optional[str] = None,
+) -> List[Dict]:
+    """
+    Super-resolves a product with the full inference and with each adaptive
+    threshold, and returns the skipped patches and the error of the output bands
+    against the full inference in DN at every threshold.
+    """
+    # The inference imports this module
+    # pylint: disable=import-outside-toplevel
+    from inference import SuperresolutionProcess
+
+    output_dir = output_dir or tempfile.mkdtemp()
+    params = {"clip_to_aoi": False, **(params or {})}
+
+    def run(threshold):
+        filename = f"adaptive_{threshold}.tif"
+        SuperresolutionProcess(
+            {**params, "adaptive_threshold": threshold},
+            input_dir=input_dir,
+            output_dir=output_dir + "/",
+        ).start(image_id, filename)
+        path = os.path.join(output_dir, filename)
+        with rasterio.open(path) as d_s:
+            bands = d_s.read().astype(np.float32)
+            descriptions = d_s.descriptions
+        with open(path + ".properties.json") as f_p:
+            report = json.load(f_p)["superresolution_profile"]
+        return bands, descriptions, report
+
+    full, descriptions, _ = run(None)
+    valid = full.any(axis=0)
+    results = []
+    for threshold in thresholds:
+        bands, _, report = run(threshold)
+        error = (bands - full)[:, valid]
+        results.append(
+            {
+                "threshold": threshold,
+                "skipped": adaptive_report(report),
+                "rmse": dict(
+                    zip(descriptions, np.sqrt((error ** 2).mean(axis=1)).tolist())
+                ),
+                "max_abs_error": dict(
+                    zip(descriptions, np.abs(error).max(axis=1).tolist())
+                ),
+            }
+        )
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Measure the skipped patches and the error of the adaptive "
+        "inference against the full inference.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("-i", "--input-dir", type=str, default="/tmp/input/")
+    parser.add_argument("--image-id", type=str, default="synthetic")
+    parser.add_argument(
+        "-t", "--thresholds", type=float, nargs="+", default=[0.005, 0.01, 0.02]
+    )
+    parser.add_argument("--params", type=str, default="{}", help="Block params.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    ARGS = parse_args()
+    print(
+        json.dumps(
+            evaluate(
+                ARGS.input_dir, ARGS.image_id, ARGS.thresholds, json.loads(ARGS.params)
+            ),
+            indent=2,
+        )
+    )
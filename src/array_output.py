@@ -0,0 +1,89 @@
+"""
+This module writes the output as an array for machine learning pipelines instead
+of a GeoTIFF, selected with the output_format parameter: a chunked, compressed Zarr
+store ("zarr") or a NumPy .npy file that can be memory-mapped ("npy").
+
+Both hold the uint16 bands channels last, i.e. with the shape (height, width,
+bands) of the array the networks write into. The georeferencing, the band names
+and their descriptions are stored in the attributes of the Zarr store or in a JSON
+sidecar next to the .npy file, see georeferencing.
+"""
+import json
+import os
+from typing import Dict, List
+
+import numpy as np
+
+# File extension of the output per output format
+OUTPUT_FORMATS = {"gtiff": ".tif", "zarr": ".zarr", "npy": ".npy"}
+# Sidecar of a .npy output with its georeferencing
+GEOREFERENCING_SUFFIX = ".json"
+# Height and width of the chunks of a Zarr store, every chunk has all bands
+CHUNK_SIZE = 512
+
+
+def is_array_output(filename: str) -> bool:
+    return os.path.splitext(filename.rstrip("/"))[1] in (".zarr", ".npy")
+
+
+def georeferencing(profile: Dict, bands: List[str], descriptions: Dict) -> Dict:
+    """
+    Returns the georeferencing of an output with the rasterio profile `profile`
+    and the band names and descriptions, which can be serialised to JSON. The
+    transform is the affine transform (a, b, c, d, e, f) of rasterio.
+    """
+    return {
+        "crs": profile["crs"].to_wkt(),
+        "epsg": profile["crs"].to_epsg(),
+        "transform": list(profile["transform"])[:6],
+        "height": profile["height"],
+        "width": profile["width"],
+        "dims": ["y", "x", "band"],
+        "dtype": "uint16",
+        "nodata": 0,
+        "bands": list(bands),
+        "descriptions": ["SR " + descriptions[band] for band in bands],
+    }
+
+
+def create_array(filename: str, profile: Dict, bands: List[str], descriptions: Dict):
+    """
+    Creates an output array filled with 0 and returns it for writing, a memory map
+    for a .npy file or a Zarr array.
+    """
+    shape = (profile["height"], profile["width"], len(bands))
+    attributes = georeferencing(profile, bands, descriptions)
+    if filename.endswith(".npy"):
+        array = np.lib.format.open_memmap(
+            filename, mode="w+", dtype=np.uint16, shape=shape
+        )
+        with open(filename + GEOREFERENCING_SUFFIX, "w") as f_p:
+            f_p.write(json.dumps(attributes, indent=2))
+        return array
+
+    # pylint: disable=import-outside-toplevel
+    import zarr
+
+    array = zarr.open(
+        filename,
+        mode="w",
+        shape=shape,
+        chunks=(CHUNK_SIZE, CHUNK_SIZE, len(bands)),
+        dtype=np.uint16,
+        fill_value=0,
+    )
+    array.attrs.update(attributes)
+    return array
+
+
+def open_array(filename: str, mode: str = "r"):
+    """
+    Opens an output array created with create_array.
+    """
+    if filename.endswith(".npy"):
+        return np.load(filename, mmap_mode=mode)
+
+    # pylint: disable=import-outside-toplevel
+    import zarr
+
+    return zarr.open(filename, mode=mode)
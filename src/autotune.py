@@ -0,0 +1,95 @@
+"""
+This module picks the window size for large-window inference from the available
+memory and the throughput measured on the scene itself.
+"""
+import os
+import time
+from typing import Sequence
+
+import numpy as np
+from blockutils.logging import get_logger
+
+from patches import interp_patches
+from backends import get_backend
+import supres
+
+LOGGER = get_logger(__name__)
+
+WINDOW_CANDIDATES = (128, 256, 512, 1024, 1536, 2048)
+# DSen2 keeps 128 feature maps per pixel, a few of them are alive at once
+FEATURES = 128
+LIVE_TENSORS = 4
+# Share of the available memory one window may use during prediction
+MEMORY_FRACTION = 0.25
+
+
+def available_memory() -> int:
+    """
+    Returns the memory available to new allocations in bytes.
+    """
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+
+
+def window_memory(window_size: int) -> int:
+    """
+    Estimates the memory in bytes that predicting one window of `window_size`
+    10m pixels takes.
+    """
+    return window_size ** 2 * FEATURES * LIVE_TENSORS * 4
+
+
+def _sample_window(d10: np.ndarray, d20: np.ndarray, window_size: int):
+    """
+    Cuts one scaled model input of `window_size` 10m pixels from the scene center.
+    """
+    i_0 = (d10.shape[0] - window_size) // 4 * 2
+    j_0 = (d10.shape[1] - window_size) // 4 * 2
+    p10 = d10[i_0 : i_0 + window_size, j_0 : j_0 + window_size]
+    p20 = d20[i_0 // 2 : (i_0 + window_size) // 2, j_0 // 2 : (j_0 + window_size) // 2]
+    p10 = np.rollaxis(p10, 2)[np.newaxis].astype(np.float32)
+    p20 = interp_patches(np.rollaxis(p20, 2)[np.newaxis], p10.shape)
+    return [p10 / supres.SCALE, p20 / supres.SCALE]
+
+
+def tune_window_size(
+    d10: np.ndarray,
+    d20: np.ndarray,
+    image_level: str,
+    backend: str = "keras",
+    candidates: Sequence[int] = WINDOW_CANDIDATES,
+) -> int:
+    """
+    Measures the throughput of the 20m network on one window of each candidate
+    size that fits into memory and returns the fastest, counted in 10m pixels of
+    output per second without the discarded border.
+    """
+    budget = available_memory() * MEMORY_FRACTION
+    feasible = [
+        w for w in candidates if w <= min(d10.shape[:2]) and window_memory(w) <= budget
+    ]
+    if not feasible:
+        LOGGER.info("No window size fits into memory, using the default patches.")
+        return candidates[0]
+
+    model = get_backend(backend).load_model(supres.model_filenames(image_level)[0])
+
+    border = 8
+    best, best_rate = feasible[0], 0.0
+    for window_size in feasible:
+        inputs = _sample_window(d10, d20, window_size)
+        model.predict(inputs, batch_size=1)  # warm up
+        start = time.perf_counter()
+        model.predict(inputs, batch_size=1)
+        rate = (window_size - 2 * border) ** 2 / (time.perf_counter() - start)
+        LOGGER.info(f"Window size {window_size}: {rate:.0f} px/s")
+        if rate > best_rate:
+            best, best_rate = window_size, rate
+    LOGGER.info(f"Selected window size {best}")
+    return best
@@ -0,0 +1,261 @@
+"""
+This module contains the inference backends that run the DSen2 networks.
+"""
+import abc
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from blockutils.logging import get_logger
+from blockutils.exceptions import UP42Error, SupportedErrors
+
+from stand_in import is_stand_in, load_stand_in
+
+LOGGER = get_logger(__name__)
+
+# TensorFlow is only imported once a model is actually needed, see get_strategy
+_STRATEGY = None
+_STRATEGY_LOCK = threading.Lock()
+# Loaded models by backend and model file, only kept in a long-lived process,
+# see keep_models_loaded
+_MODELS: Optional[Dict[Tuple[str, str], object]] = None
+_MODELS_LOCK = threading.Lock()
+
+
+def get_strategy():
+    """
+    Imports TensorFlow and creates the distribution strategy on first use.
+    The time spent on both is logged to make startup regressions visible.
+    """
+    # pylint: disable=global-statement,import-outside-toplevel
+    global _STRATEGY
+    with _STRATEGY_LOCK:
+        if _STRATEGY is None:
+            start = time.perf_counter()
+            import tensorflow as tf
+
+            LOGGER.info(f"Importing TensorFlow took {time.perf_counter() - start:.2f}s")
+            start = time.perf_counter()
+            _STRATEGY = tf.distribute.MirroredStrategy()
+            LOGGER.info(
+                f"Creating the distribution strategy took "
+                f"{time.perf_counter() - start:.2f}s"
+            )
+    return _STRATEGY
+
+
+def keep_models_loaded():
+    """
+    Keeps every model that is loaded from now on in memory and returns it again
+    on the next load, e.g. in the inference service.
+    """
+    # pylint: disable=global-statement
+    global _MODELS
+    with _MODELS_LOCK:
+        if _MODELS is None:
+            _MODELS = {}
+
+
+def loaded_models() -> List[Tuple[str, str]]:
+    """
+    Returns the backends and model files of the models kept in memory.
+    """
+    with _MODELS_LOCK:
+        return sorted(_MODELS or {})
+
+
+def saved_model_path(model_filename: str) -> str:
+    """
+    Returns the path of the precompiled SavedModel artifact that convert_models.py
+    creates for a hdf5 model file.
+    """
+    return os.path.splitext(model_filename)[0] + "_savedmodel"
+
+
+def onnx_model_path(model_filename: str) -> str:
+    """
+    Returns the path of the ONNX model that convert_models.py exports for a hdf5
+    model file.
+    """
+    return os.path.splitext(model_filename)[0] + ".onnx"
+
+
+def quantized_model_path(model_filename: str) -> str:
+    """
+    Returns the path of the int8 quantized ONNX model that quantization.py creates
+    for a hdf5 model file.
+    """
+    return os.path.splitext(model_filename)[0] + "_int8.onnx"
+
+
+class SavedModelPredictor:
+    """
+    Runs a precompiled SavedModel artifact with the predict interface of a Keras
+    model. Loading it does not rebuild the Keras graph from the hdf5 file.
+    """
+
+    def __init__(self, path: str, batch_size: int = 32):
+        # pylint: disable=import-outside-toplevel
+        import tensorflow as tf
+
+        # The loaded object owns the variables, keep a reference to it
+        self.loaded = tf.saved_model.load(path)
+        self.batch_size = batch_size
+
+    def predict(self, inputs, batch_size: int = None):
+        batch_size = batch_size or self.batch_size
+        predictions = []
+        for start in range(0, inputs[0].shape[0], batch_size):
+            batch = [d[start : start + batch_size] for d in inputs]
+            predictions.append(self.loaded.predict(batch).numpy())
+        return np.concatenate(predictions, axis=0)
+
+
+class OnnxPredictor:
+    """
+    Runs an ONNX model with ONNX Runtime on the CPU with the predict interface of
+    a Keras model.
+    """
+
+    def __init__(self, path: str, batch_size: int = 32):
+        # pylint: disable=import-outside-toplevel
+        import onnxruntime
+
+        self.session = onnxruntime.InferenceSession(
+            path, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.batch_size = batch_size
+
+    def predict(self, inputs, batch_size: int = None):
+        batch_size = batch_size or self.batch_size
+        predictions = []
+        for start in range(0, inputs[0].shape[0], batch_size):
+            feed = {
+                name: np.asarray(d[start : start + batch_size], np.float32)
+                for name, d in zip(self.input_names, inputs)
+            }
+            predictions.append(self.session.run(None, feed)[0])
+        return np.concatenate(predictions, axis=0)
+
+
+class InferenceBackend(abc.ABC):
+    """
+    Interface of the engines that run the DSen2 networks. `load_model` returns an
+    object whose `predict(inputs, batch_size)` method takes the list of
+    channels-first input arrays of a batch and returns the channels-first
+    prediction, computed `batch_size` patches at a time.
+    """
+
+    name = ""
+
+    def load_model(self, model_filename: str):
+        """
+        Loads the model of a hdf5 model file, or the stand-in that a stand-in
+        model path selects, see stand_in.py. Once keep_models_loaded was called,
+        a model is loaded only once.
+        """
+        if is_stand_in(model_filename):
+            LOGGER.info(f"Using the stand-in model {model_filename}")
+            return load_stand_in(model_filename)
+        if _MODELS is None:
+            return self._load_model(model_filename)
+        with _MODELS_LOCK:
+            key = (self.name, model_filename)
+            if key not in _MODELS:
+                _MODELS[key] = self._load_model(model_filename)
+            return _MODELS[key]
+
+    @abc.abstractmethod
+    def _load_model(self, model_filename: str):
+        """
+        Loads the model of a hdf5 model file with this backend, or its artifact
+        derived from the file, and returns it.
+        """
+
+
+class KerasBackend(InferenceBackend):
+    """
+    Runs the models with TensorFlow. On a single device it prefers the
+    precompiled SavedModel artifact, which does not distribute the batches. With
+    several GPUs, or without the artifact, it loads the hdf5 file under the
+    MirroredStrategy, whose predict splits every batch across the devices.
+    """
+
+    name = "keras"
+
+    def _load_model(self, model_filename: str):
+        # pylint: disable=import-outside-toplevel
+        strategy = get_strategy()
+        artifact = saved_model_path(model_filename)
+        if os.path.isdir(artifact) and strategy.num_replicas_in_sync == 1:
+            LOGGER.info(f"Loading precompiled model {artifact}")
+            return SavedModelPredictor(artifact)
+
+        from tensorflow import keras
+
+        if os.path.isdir(artifact):
+            LOGGER.info(
+                f"Loading {model_filename} instead of the precompiled model to "
+                f"distribute it across {strategy.num_replicas_in_sync} devices"
+            )
+        else:
+            LOGGER.info(f"No precompiled model found, loading {model_filename}")
+        with strategy.scope():
+            return keras.models.load_model(model_filename)
+
+
+class OnnxBackend(InferenceBackend):
+    """
+    Runs the models exported by convert_models.py with ONNX Runtime on the CPU,
+    without importing TensorFlow.
+    """
+
+    name = "onnx"
+    converter = "convert_models.py"
+
+    @staticmethod
+    def model_path(model_filename: str) -> str:
+        return onnx_model_path(model_filename)
+
+    def _load_model(self, model_filename: str):
+        path = self.model_path(model_filename)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(
+                f"No ONNX model found at {path}, run {self.converter} first."
+            )
+        LOGGER.info(f"Loading ONNX model {path}")
+        return OnnxPredictor(path)
+
+
+class OnnxInt8Backend(OnnxBackend):
+    """
+    Runs the int8 quantized models created by quantization.py with ONNX Runtime on
+    the CPU. Trades a small reflectance error for throughput.
+    """
+
+    name = "onnx_int8"
+    converter = "quantization.py"
+
+    @staticmethod
+    def model_path(model_filename: str) -> str:
+        return quantized_model_path(model_filename)
+
+
+BACKENDS = {
+    backend.name: backend for backend in [KerasBackend, OnnxBackend, OnnxInt8Backend]
+}
+
+
+def get_backend(name: str) -> InferenceBackend:
+    """
+    Returns the inference backend registered under the given name.
+    """
+    if name not in BACKENDS:
+        raise UP42Error(
+            SupportedErrors.INPUT_PARAMETERS_ERROR,
+            f"Unknown inference_backend {name}, use one of {sorted(BACKENDS)}.",
+        )
+    return BACKENDS[name]()
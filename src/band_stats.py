@@ -0,0 +1,108 @@
+"""
+This module accumulates the statistics and histograms of the uint16 output bands
+while they are written, so they don't need to be read again. They are stored as
+the GDAL band metadata of the output image and as the "raster:bands" property of
+the STAC raster extension on its feature.
+"""
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+# Buckets of the histograms between the minimum and the maximum of a band
+HISTOGRAM_BUCKETS = 256
+# Sentinel-2 marks pixels without data with 0
+NODATA = 0
+
+
+class BandStatistics:
+    """
+    Counts every uint16 value per band, which gives the exact minimum, maximum,
+    mean and standard deviation and histograms of any resolution in one pass.
+    """
+
+    def __init__(self, n_bands: int, nodata: Optional[int] = NODATA):
+        self.counts = np.zeros((n_bands, 2 ** 16), np.int64)
+        self.nodata = nodata
+
+    def add(self, data: np.ndarray, band: Optional[int] = None):
+        """
+        Adds the pixels of a channels last array of all bands, or of one 2D band.
+        """
+        if band is not None:
+            self.counts[band] += np.bincount(data.ravel(), minlength=2 ** 16)
+            return
+        for b_i in range(data.shape[2]):
+            self.add(data[:, :, b_i], b_i)
+
+    def add_nodata(self, count: int):
+        """
+        Adds pixels without data to all bands.
+        """
+        if self.nodata is not None:
+            self.counts[:, self.nodata] += count
+
+    def band(self, index: int) -> Dict:
+        """
+        Returns the statistics and the histogram of a band in the form of the STAC
+        raster extension, without them if the band has no valid pixel.
+        """
+        counts = self.counts[index].copy()
+        total = counts.sum()
+        if self.nodata is not None:
+            counts[self.nodata] = 0
+        valid = counts.sum()
+        statistics = {"valid_percent": 100.0 * valid / total if total else 0.0}
+        if not valid:
+            return {"statistics": statistics}
+        values = np.flatnonzero(counts)
+        minimum, maximum = int(values[0]), int(values[-1])
+        mean = float(np.dot(counts[values], values) / valid)
+        variance = float(np.dot(counts[values], (values - mean) ** 2) / valid)
+        statistics.update(
+            minimum=minimum, maximum=maximum, mean=mean, stddev=variance ** 0.5
+        )
+        # Buckets of equal width covering the values from minimum to maximum
+        width = maximum + 1 - minimum
+        buckets = np.bincount(
+            (values - minimum) * HISTOGRAM_BUCKETS // width,
+            weights=counts[values],
+            minlength=HISTOGRAM_BUCKETS,
+        ).astype(np.int64)
+        return {
+            "statistics": statistics,
+            "histogram": {
+                "count": HISTOGRAM_BUCKETS,
+                "min": float(minimum),
+                "max": float(maximum + 1),
+                "buckets": buckets.tolist(),
+            },
+        }
+
+    def gdal_metadata(self, index: int) -> Dict[str, str]:
+        """
+        Returns the statistics of a band as the GDAL band metadata items that
+        gdalinfo and QGIS read.
+        """
+        band = self.band(index)
+        metadata = {
+            "STATISTICS_VALID_PERCENT": str(band["statistics"]["valid_percent"])
+        }
+        if "histogram" in band:
+            metadata.update(
+                {
+                    f"STATISTICS_{key.upper()}": str(band["statistics"][key])
+                    for key in ("minimum", "maximum", "mean", "stddev")
+                }
+            )
+            metadata["STATISTICS_APPROXIMATE"] = "NO"
+            metadata["HISTOGRAM"] = ",".join(map(str, band["histogram"]["buckets"]))
+        return metadata
+
+    def properties(self, names: Sequence[str]) -> List[Dict]:
+        """
+        Returns the "raster:bands" property of the bands with the given names.
+        """
+        return [
+            {"name": name, "nodata": self.nodata, "data_type": "uint16", **self.band(i)}
+            for i, name in enumerate(names)
+        ]
@@ -0,0 +1,118 @@
+"""
+This module converts the DSen2 hdf5 weights into precompiled SavedModel artifacts
+and ONNX models. It runs at build time, see the Dockerfile, so that the block does
+not have to parse the hdf5 files and rebuild the Keras graphs for every scene.
+
+Usage:
+    python src/convert_models.py [--weights ./weights/] [--formats savedmodel onnx]
+"""
+import argparse
+import glob
+import os
+
+from blockutils.logging import get_logger
+
+from supres import MDL_PATH
+from backends import saved_model_path, onnx_model_path
+
+LOGGER = get_logger(__name__)
+
+
+def convert_model(model_filename: str, output_path: str = None) -> str:
+    """
+    Converts a Keras hdf5 model into a SavedModel that exposes a traced `predict`
+    function taking the list of model inputs.
+
+    Args:
+        model_filename: Path to the hdf5 model file.
+        output_path: Path of the SavedModel directory, defaults to saved_model_path.
+
+    Returns:
+        The path of the written SavedModel.
+    """
+    # pylint: disable=import-outside-toplevel
+    import tensorflow as tf
+    from tensorflow import keras
+
+    if output_path is None:
+        output_path = saved_model_path(model_filename)
+
+    model = keras.models.load_model(model_filename, compile=False)
+    input_signature = [[tf.TensorSpec(i.shape, i.dtype) for i in model.inputs]]
+
+    module = tf.Module()
+    module.model = model
+    module.predict = tf.function(
+        lambda inputs: model(inputs, training=False), input_signature=input_signature
+    )
+    tf.saved_model.save(module, output_path)
+    LOGGER.info(f"Converted {model_filename} to {output_path}")
+    return output_path
+
+
+def export_onnx(model_filename: str, output_path: str = None) -> str:
+    """
+    Exports a Keras hdf5 model to ONNX for the ONNX Runtime backend.
+
+    Args:
+        model_filename: Path to the hdf5 model file.
+        output_path: Path of the ONNX file, defaults to onnx_model_path.
+
+    Returns:
+        The path of the written ONNX model.
+    """
+    # pylint: disable=import-outside-toplevel
+    import tensorflow as tf
+    from tensorflow import keras
+    import tf2onnx
+
+    if output_path is None:
+        output_path = onnx_model_path(model_filename)
+
+    model = keras.models.load_model(model_filename, compile=False)
+    input_signature = [
+        tf.TensorSpec(i.shape, i.dtype, name=f"input_{k}")
+        for k, i in enumerate(model.inputs)
+    ]
+    function = tf.function(
+        lambda *inputs: model(list(inputs), training=False),
+        input_signature=input_signature,
+    )
+    tf2onnx.convert.from_function(
+        function, input_signature=input_signature, opset=13, output_path=output_path
+    )
+    LOGGER.info(f"Exported {model_filename} to {output_path}")
+    return output_path
+
+
+CONVERTERS = {"savedmodel": convert_model, "onnx": export_onnx}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Convert the DSen2 hdf5 weights into SavedModel and ONNX models.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "-w",
+        "--weights",
+        type=str,
+        default=MDL_PATH,
+        help="Folder with the hdf5 model files.",
+    )
+    parser.add_argument(
+        "-f",
+        "--formats",
+        nargs="+",
+        choices=sorted(CONVERTERS),
+        default=sorted(CONVERTERS),
+        help="Formats to convert the models to.",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    ARGS = parse_args()
+    for model_file in sorted(glob.glob(os.path.join(ARGS.weights, "*.hdf5"))):
+        for model_format in ARGS.formats:
+            CONVERTERS[model_format](model_file)
@@ -1,16 +1,47 @@
 import sys
 import os
 import gc
+import json
+from datetime import datetime
+from typing import Dict
 
 import numpy as np
 import rasterio
+from rasterio.warp import transform_bounds
+from rasterio.windows import Window
 
 from blockutils.logging import get_logger
 from blockutils.common import load_params
 from blockutils.exceptions import UP42Error, SupportedErrors, catch_exceptions
 
-from s2_tiles_supres import Superresolution
-from supres import dsen2_20, dsen2_60
+from s2_tiles_supres import Superresolution, OUTPUT_PARAMETERS
+from adaptive import adaptive_report
+from backends import keep_models_loaded
+from array_output import create_array, is_array_output, open_array
+from band_stats import BandStatistics
+from mosaic import (
+    assign_windows,
+    grow_window,
+    intersection,
+    mosaic_aoi,
+    mosaic_grid,
+    mosaic_report,
+    tile_window,
+)
+from profiling import current_profile, peak_memory_mb, process_uptime, stage
+from windows import (
+    CHECKPOINT_SUFFIX,
+    DEFAULT_WINDOW_SIZE,
+    HALO,
+    MIN_WINDOW,
+    Checkpoint,
+    SceneWindow,
+    WindowCache,
+    fingerprint,
+    mirror_halo,
+    scene_windows,
+    window_context,
+)
 
 LOGGER = get_logger(__name__)
 
@@ -22,10 +53,13 @@ def save_result(
     valid_desc,
     output_profile,
     image_name,
-):
+) -> BandStatistics:
     """
     This method saves the feature collection meta data and the
     image with high resolution for desired bands to the provided location.
+    The statistics of the bands are computed while they are written and stored
+    as their GDAL metadata. Outputs with the extension .zarr or .npy are written
+    as arrays instead, see array_output.py.
 
     Args:
         model_output: The high resolution image.
@@ -34,12 +68,92 @@ def save_result(
         output_profile: The georeferencing for the output image.
         output_features: The meta data for the output image.
         image_name: The name of the output image.
+
+    Returns:
+        The statistics of the output bands.
     """
+    statistics = BandStatistics(len(output_bands))
+    if is_array_output(image_name):
+        array = create_array(image_name, output_profile, output_bands, valid_desc)
+        array[:] = model_output
+        statistics.add(model_output)
+        return statistics
 
     with rasterio.open(image_name, "w", **output_profile) as d_s:
         for b_i, b_n in enumerate(output_bands):
-            d_s.write(model_output[:, :, b_i], indexes=b_i + 1)
+            band = model_output[:, :, b_i]
+            d_s.write(band, indexes=b_i + 1)
             d_s.set_band_description(b_i + 1, "SR " + valid_desc[b_n])
+            statistics.add(band, b_i)
+            d_s.update_tags(b_i + 1, **statistics.gdal_metadata(b_i))
+    return statistics
+
+
+def create_result(output_bands, valid_desc, output_profile, image_name):
+    """
+    Creates the output image without pixels, see save_result, to write it window
+    by window with write_result_window.
+    """
+    if is_array_output(image_name):
+        create_array(image_name, output_profile, output_bands, valid_desc)
+        return
+    with rasterio.open(image_name, "w", **output_profile) as d_s:
+        for b_i, b_n in enumerate(output_bands):
+            d_s.set_band_description(b_i + 1, "SR " + valid_desc[b_n])
+
+
+def read_result_window(image_name, row_off, col_off, height, width):
+    """
+    Reads a window of an output image as a channels last array.
+    """
+    if is_array_output(image_name):
+        return np.array(
+            open_array(image_name)[
+                row_off : row_off + height, col_off : col_off + width
+            ]
+        )
+    with rasterio.open(image_name) as d_s:
+        return np.rollaxis(
+            d_s.read(window=Window(col_off, row_off, width, height)), 0, 3
+        )
+
+
+def write_result_window(model_output, row_off, col_off, image_name, band_off=0):
+    """
+    Writes the channels last `model_output` to a window of the output image, to
+    its bands from `band_off` on. The image is closed afterwards, so the window is
+    on disk when this returns.
+    """
+    if is_array_output(image_name):
+        array = open_array(image_name, "r+")
+        array[
+            row_off : row_off + model_output.shape[0],
+            col_off : col_off + model_output.shape[1],
+            band_off : band_off + model_output.shape[2],
+        ] = model_output
+        if isinstance(array, np.memmap):
+            array.flush()
+        return
+    with rasterio.open(image_name, "r+") as d_s:
+        d_s.write(
+            np.rollaxis(model_output, 2),
+            window=Window(
+                col_off, row_off, model_output.shape[1], model_output.shape[0]
+            ),
+            indexes=list(range(band_off + 1, band_off + model_output.shape[2] + 1)),
+        )
+
+
+def write_result_statistics(statistics, image_name):
+    """
+    Stores the statistics of the bands of an output image as their GDAL metadata.
+    Array outputs have no band metadata.
+    """
+    if is_array_output(image_name):
+        return
+    with rasterio.open(image_name, "r+") as d_s:
+        for b_i in range(d_s.count):
+            d_s.update_tags(b_i + 1, **statistics.gdal_metadata(b_i))
 
 
 class SuperresolutionProcess(Superresolution):
@@ -61,95 +175,712 @@ class SuperresolutionProcess(Superresolution):
 
     @catch_exceptions(LOGGER)
     def start(self, path_to_input_img, path_to_output_img):
+        current_profile().reset()
         data_list, image_level = self.get_data(path_to_input_img)
+        xmin, ymin, xmax, ymax = self.pixel_region(data_list)
+        self.check_size(dims=(xmin, ymin, xmax, ymax))
 
-        for dsdesc in data_list:
-            if "10m" in dsdesc:
-                if self.params.__dict__["clip_to_aoi"]:
-                    xmin, ymin, xmax, ymax, interest_area = self.area_of_interest(
-                        dsdesc
+        # Validate the bands before any pixel is read or TensorFlow is imported
+        inputs, output_bands, selection = self.select_output(data_list)
+        validated_sr_final_bands, validated_descriptions_all = output_bands
+        band_ranges = selection[1]
+        model_options = self.model_options()
+        filename = os.path.join(self.output_dir, path_to_output_img)
+
+        plan = self.plan(
+            (xmin, ymin, xmax, ymax),
+            []
+            if self.params.__dict__["preview"]
+            else [n for n, r in zip(("20m", "60m"), band_ranges) if r is not None],
+            len(validated_sr_final_bands),
+        )
+        self.add_output_properties(filename, {"superresolution_plan": plan})
+        checkpoint_size = self.params.__dict__["checkpoint_size"]
+        if self.params.__dict__["cache_dir"]:
+            checkpoint_size = checkpoint_size or DEFAULT_WINDOW_SIZE
+        if self.params.__dict__["auto_strategy"]:
+            LOGGER.info(f"Selected strategy: {plan['strategy']}")
+            model_options["parallel"] = plan["strategy"]["workers"] > 1
+            checkpoint_size = checkpoint_size or plan["strategy"]["window_size"]
+
+        if checkpoint_size:
+            self.process_windows(
+                path_to_input_img,
+                filename,
+                image_level,
+                (xmin, ymin, xmax, ymax),
+                inputs,
+                output_bands,
+                selection,
+                model_options,
+                checkpoint_size,
+            )
+            self.report_profile(filename)
+            return
+
+        with stage("read", pixels=(ymax - ymin + 1) * (xmax - xmin + 1)):
+            data10, data20, data60 = [
+                None
+                if dsdesc is None
+                else self.data_final(*dsdesc[:2], xmin, ymin, xmax, ymax, 1, dsdesc[2])
+                for dsdesc in inputs
+            ]
+
+        p_r = self.update(
+            inputs[0][0],
+            data10.shape,
+            np.empty((0, 0, len(validated_sr_final_bands))),
+            xmin,
+            ymin,
+        )
+        if filename.endswith(".npy"):
+            # The networks write straight into the memory map of the output
+            sr_final = create_array(
+                filename, p_r, validated_sr_final_bands, validated_descriptions_all
+            )
+        else:
+            sr_final = np.empty(
+                data10.shape[:2] + (len(validated_sr_final_bands),), dtype=np.uint16
+            )
+
+        if (
+            self.params.__dict__["tune_window_size"]
+            and not self.params.__dict__["preview"]
+        ):
+            # pylint: disable=import-outside-toplevel
+            from autotune import tune_window_size
+
+            model_options["window_size"] = tune_window_size(
+                data10,
+                data20,
+                image_level,
+                self.params.__dict__["inference_backend"],
+            )
+
+        self.super_resolve(
+            (data10, data20, data60),
+            image_level,
+            sr_final,
+            selection,
+            model_options,
+        )
+        del data60
+        LOGGER.info(
+            "Peak memory after super-resolution (parallel_models=%s): %.0f MB",
+            self.params.__dict__["parallel_models"],
+            peak_memory_mb(),
+        )
+
+        LOGGER.info("Now writing the super-resolved bands")
+        with stage("write", pixels=sr_final.shape[0] * sr_final.shape[1]):
+            if isinstance(sr_final, np.memmap):
+                sr_final.flush()
+                statistics = BandStatistics(len(validated_sr_final_bands))
+                statistics.add(sr_final)
+            else:
+                statistics = save_result(
+                    sr_final,
+                    validated_sr_final_bands,
+                    validated_descriptions_all,
+                    p_r,
+                    filename,
+                )
+        del sr_final
+        LOGGER.info("This is for releasing memory: %s", gc.collect())
+        LOGGER.info("Writing the super-resolved bands is finished.")
+        self.add_output_properties(
+            filename, {"raster:bands": statistics.properties(validated_sr_final_bands)}
+        )
+        self.report_profile(filename)
+
+    @catch_exceptions(LOGGER)
+    def start_mosaic(self, paths_to_input_img, path_to_output_img):
+        """
+        Super-resolves the AOI of overlapping tiles of the same UTM zone into one
+        output on their common grid. Every window is super-resolved from one tile
+        only, see mosaic.py.
+        """
+        current_profile().reset()
+        tiles = []
+        for path_to_input_img in paths_to_input_img:
+            data_list, image_level = self.get_data(path_to_input_img)
+            inputs, output_bands, selection = self.select_output(data_list)
+            with rasterio.open(inputs[0][0]) as d_s:
+                tiles.append(
+                    (inputs, image_level, d_s.crs.to_string(), d_s.transform, d_s.shape)
+                )
+        if len({(tile[1], tile[2]) for tile in tiles}) > 1:
+            raise UP42Error(
+                SupportedErrors.INPUT_PARAMETERS_ERROR,
+                "A mosaic needs tiles of the same processing level and UTM zone.",
+            )
+        try:
+            transform, shape, extents = mosaic_grid(
+                [tile[3] for tile in tiles], [tile[4] for tile in tiles]
+            )
+        except ValueError as e:
+            raise UP42Error(SupportedErrors.INPUT_PARAMETERS_ERROR, str(e)) from e
+        bounds = None
+        if self.params.__dict__["clip_to_aoi"]:
+            bounds = transform_bounds("EPSG:4326", tiles[0][2], *self.params.bounds())
+        aoi = mosaic_aoi(transform, shape, bounds)
+        self.check_size(aoi)
+        xmin, ymin, xmax, ymax = aoi
+        window_size = self.params.__dict__["checkpoint_size"] or DEFAULT_WINDOW_SIZE
+        windows = assign_windows(aoi, extents, window_size)
+        report = mosaic_report(aoi, extents, windows)
+        LOGGER.info(f"Mosaic of {len(tiles)} tiles: {report}")
+
+        bands, descriptions = output_bands
+        filename = os.path.join(self.output_dir, path_to_output_img)
+        # The AOI relative to the first tile
+        profile = self.update(
+            tiles[0][0][0][0],
+            (ymax - ymin + 1, xmax - xmin + 1),
+            np.empty((0, 0, len(bands))),
+            xmin - extents[0].left,
+            ymin - extents[0].top,
+        )
+        create_result(bands, descriptions, profile, filename)
+        model_options = self.model_options()
+        statistics = BandStatistics(len(bands))
+        aoi_window = SceneWindow(ymin, xmin, ymax + 1, xmax + 1)
+        for window, tile in windows:
+            extent = extents[tile]
+            tile_aoi = intersection(aoi_window, extent)
+            # Windows split at the edges of the tiles may be smaller than the
+            # patches, a larger window is super-resolved around them
+            processed = grow_window(window, tile_aoi, MIN_WINDOW)
+            context = window_context(
+                processed,
+                (tile_aoi.left, tile_aoi.top, tile_aoi.right - 1, tile_aoi.bottom - 1),
+            )
+            output = np.empty(
+                (processed.height, processed.width, len(bands)), np.uint16
+            )
+            self.super_resolve(
+                self.read_window(
+                    tiles[tile][0],
+                    tile_window(processed, extent),
+                    tile_window(context, extent),
+                ),
+                image_level,
+                output,
+                selection,
+                model_options,
+                halo=HALO,
+            )
+            output = output[
+                window.top - processed.top : window.bottom - processed.top,
+                window.left - processed.left : window.right - processed.left,
+            ]
+            with stage("write", pixels=window.height * window.width):
+                write_result_window(
+                    output, window.top - ymin, window.left - xmin, filename
+                )
+                statistics.add(output)
+        # Pixels beyond all tiles stay empty
+        statistics.add_nodata(
+            aoi_window.height * aoi_window.width - sum(report["pixels"])
+        )
+        write_result_statistics(statistics, filename)
+        self.add_output_properties(
+            filename,
+            {
+                "raster:bands": statistics.properties(bands),
+                "superresolution_mosaic": {
+                    "tiles": list(paths_to_input_img),
+                    **report,
+                },
+            },
+        )
+        LOGGER.info("Writing the super-resolved bands is finished.")
+        self.report_profile(filename)
+
+    def start_group(self, paths_to_input_img, path_to_output_img):
+        """
+        Super-resolves several input images into one output, a time stack with the
+        time_stack parameter and a mosaic otherwise.
+        """
+        if self.params.__dict__["time_stack"]:
+            self.start_stack(paths_to_input_img, path_to_output_img)
+        else:
+            self.start_mosaic(paths_to_input_img, path_to_output_img)
+
+    @catch_exceptions(LOGGER)
+    def start_stack(self, paths_to_input_img, path_to_output_img):
+        """
+        Super-resolves the same AOI of several dates of one tile into one output
+        with the bands of every date, ordered by the sensing time. The AOI, the
+        bands and the output profile are computed once from the first date, the
+        other dates only have to be on the same grid. The models are loaded once
+        for all dates.
+        """
+        current_profile().reset()
+        keep_models_loaded()
+        dates = []
+        for path_to_input_img in paths_to_input_img:
+            data_list, image_level = self.get_data(path_to_input_img)
+            ds10 = next(dsdesc for dsdesc in data_list if "10m" in dsdesc)
+            with rasterio.open(ds10) as d_s:
+                grid = (image_level, d_s.crs.to_string(), d_s.transform, d_s.shape)
+            dates.append((self.sensing_time(ds10), path_to_input_img, data_list, grid))
+        if len({date[3] for date in dates}) > 1:
+            raise UP42Error(
+                SupportedErrors.INPUT_PARAMETERS_ERROR,
+                "A time stack needs products of the same processing level and grid.",
+            )
+        dates.sort(key=lambda date: date[0])
+        image_level = dates[0][3][0]
+
+        xmin, ymin, xmax, ymax = self.pixel_region(dates[0][2])
+        aoi = (xmin, ymin, xmax, ymax)
+        self.check_size(aoi)
+        inputs, output_bands, selection = self.select_output(dates[0][2])
+        bands, descriptions = output_bands
+        stack_bands, stack_descriptions = [], {}
+        for sensing_time, _, _, _ in dates:
+            acquired = datetime.strptime(sensing_time, "%Y%m%dT%H%M%S").isoformat()
+            for band in bands:
+                stack_bands.append(f"{band}_{sensing_time}")
+                stack_descriptions[stack_bands[-1]] = f"{descriptions[band]} {acquired}"
+        LOGGER.info(f"Time stack of {len(dates)} dates with {len(bands)} bands each")
+
+        filename = os.path.join(self.output_dir, path_to_output_img)
+        profile = self.update(
+            inputs[0][0],
+            (ymax - ymin + 1, xmax - xmin + 1),
+            np.empty((0, 0, len(stack_bands))),
+            xmin,
+            ymin,
+        )
+        # Every date writes its own bands
+        profile.update(interleave="band")
+        create_result(stack_bands, stack_descriptions, profile, filename)
+        model_options = self.model_options()
+        window_size = self.params.__dict__["checkpoint_size"]
+        windows = (
+            scene_windows(aoi, window_size)
+            if window_size
+            else [SceneWindow(ymin, xmin, ymax + 1, xmax + 1)]
+        )
+        statistics = BandStatistics(len(stack_bands))
+        for d_i, (sensing_time, path_to_input_img, data_list, _) in enumerate(dates):
+            LOGGER.info(f"Super-resolving {path_to_input_img} of {sensing_time}")
+            date_inputs = self.date_inputs(inputs, data_list)
+            for window in windows:
+                if window_size:
+                    data = self.read_window(
+                        date_inputs, window, window_context(window, aoi)
                     )
                 else:
-                    # Get the pixel bounds of the full scene
-                    xmin, ymin, xmax, ymax, interest_area = self.get_max_min(
-                        0, 0, 20000, 20000, dsdesc
+                    with stage("read", pixels=window.height * window.width):
+                        data = [
+                            None
+                            if dsdesc is None
+                            else self.data_final(
+                                *dsdesc[:2], xmin, ymin, xmax, ymax, 1, dsdesc[2]
+                            )
+                            for dsdesc in date_inputs
+                        ]
+                    if (
+                        d_i == 0
+                        and self.params.__dict__["tune_window_size"]
+                        and not self.params.__dict__["preview"]
+                    ):
+                        # pylint: disable=import-outside-toplevel
+                        from autotune import tune_window_size
+
+                        # Tuned once, all dates have the same size
+                        model_options["window_size"] = tune_window_size(
+                            data[0],
+                            data[1],
+                            image_level,
+                            self.params.__dict__["inference_backend"],
+                        )
+                output = np.empty((window.height, window.width, len(bands)), np.uint16)
+                self.super_resolve(
+                    data,
+                    image_level,
+                    output,
+                    selection,
+                    model_options,
+                    halo=HALO if window_size else 0,
+                )
+                del data
+                with stage("write", pixels=window.height * window.width):
+                    write_result_window(
+                        output,
+                        window.top - ymin,
+                        window.left - xmin,
+                        filename,
+                        band_off=d_i * len(bands),
                     )
-                LOGGER.info("Selected pixel region:")
-                LOGGER.info(f"xmin = {xmin}")
-                LOGGER.info(f"ymin = {ymin}")
-                LOGGER.info(f"xmax = {xmax}")
-                LOGGER.info(f"ymax = {ymax}")
-                LOGGER.info(f"The area of selected region = {interest_area}")
-            self.check_size(dims=(xmin, ymin, xmax, ymax))
+                    for b_i in range(len(bands)):
+                        statistics.add(output[:, :, b_i], d_i * len(bands) + b_i)
+            LOGGER.info(
+                f"Finished {sensing_time}, peak memory {peak_memory_mb():.0f} MB"
+            )
+        write_result_statistics(statistics, filename)
+        self.add_output_properties(
+            filename,
+            {
+                "raster:bands": statistics.properties(stack_bands),
+                "superresolution_stack": {
+                    "images": [date[1] for date in dates],
+                    "sensing_times": [date[0] for date in dates],
+                },
+            },
+        )
+        LOGGER.info("Writing the super-resolved bands is finished.")
+        self.report_profile(filename)
 
+    def pixel_region(self, data_list):
+        """
+        Returns the AOI (xmin, ymin, xmax, ymax) in 10m pixels of a product, the
+        whole scene if clip_to_aoi is not set, see get_max_min.
+        """
+        ds10 = next(dsdesc for dsdesc in data_list if "10m" in dsdesc)
+        if self.params.__dict__["clip_to_aoi"]:
+            xmin, ymin, xmax, ymax, interest_area = self.area_of_interest(ds10)
+        else:
+            # Get the pixel bounds of the full scene
+            xmin, ymin, xmax, ymax, interest_area = self.get_max_min(
+                0, 0, 20000, 20000, ds10
+            )
+        LOGGER.info("Selected pixel region:")
+        LOGGER.info(f"xmin = {xmin}")
+        LOGGER.info(f"ymin = {ymin}")
+        LOGGER.info(f"xmax = {xmax}")
+        LOGGER.info(f"ymax = {ymax}")
+        LOGGER.info(f"The area of selected region = {interest_area}")
+        return xmin, ymin, xmax, ymax
+
+    @staticmethod
+    def date_inputs(inputs, data_list):
+        """
+        Returns the inputs, see select_output, of another date of the same tile and
+        processing level: the same bands of its subdatasets, which are not
+        validated again.
+        """
+        return [
+            None
+            if dsdesc is None
+            else (
+                next(ds for ds in data_list if resolution in ds),
+                dsdesc[1],
+                dsdesc[2],
+            )
+            for dsdesc, resolution in zip(inputs, ("10m", "20m", "60m"))
+        ]
+
+    def model_options(self) -> Dict:
+        """
+        Returns the keyword arguments of run_models from the parameters.
+        """
+        return {
+            "parallel": self.params.__dict__["parallel_models"],
+            "backend": self.params.__dict__["inference_backend"],
+            "low_memory": self.params.__dict__["low_memory"],
+            "half_precision": self.params.__dict__["half_precision"],
+            "window_size": self.params.__dict__["window_size"],
+            "adaptive_threshold": self.params.__dict__["adaptive_threshold"],
+        }
+
+    def select_output(self, data_list):
+        """
+        Validates the bands of the 10m, 20m and 60m subdatasets of a product and
+        selects the output bands.
+
+        Returns:
+            The subdataset, the band indices and the scale of the 10m, 20m and 60m
+            data, None for the 60m data if it is not needed, the output bands with
+            the descriptions of all bands, and the selection, see super_resolve.
+        """
         for dsdesc in data_list:
             if "10m" in dsdesc:
                 LOGGER.info("Selected 10m bands:")
                 validated_10m_bands, validated_10m_indices, dic_10m = self.validate(
                     dsdesc
                 )
-                data10 = self.data_final(
-                    dsdesc, validated_10m_indices, xmin, ymin, xmax, ymax, 1, 1
-                )
+                ds10 = dsdesc
             if "20m" in dsdesc:
                 LOGGER.info("Selected 20m bands:")
                 validated_20m_bands, validated_20m_indices, dic_20m = self.validate(
                     dsdesc
                 )
-                data20 = self.data_final(
-                    dsdesc, validated_20m_indices, xmin, ymin, xmax, ymax, 1, 2
-                )
+                ds20 = dsdesc
             if "60m" in dsdesc:
                 LOGGER.info("Selected 60m bands:")
                 validated_60m_bands, validated_60m_indices, dic_60m = self.validate(
                     dsdesc
                 )
-                data60 = self.data_final(
-                    dsdesc, validated_60m_indices, xmin, ymin, xmax, ymax, 1, 6
-                )
+                ds60 = dsdesc
 
-        validated_descriptions_all = {**dic_10m, **dic_20m, **dic_60m}
-
-        if validated_60m_bands and validated_20m_bands and validated_10m_bands:
-            LOGGER.info("Super-resolving the 60m data into 10m bands")
-            sr60_ = dsen2_60(data10, data20, data60, image_level)
-            sr60 = sr60_.astype(np.uint16)
-            del sr60_, data60
-            LOGGER.info("Super-resolving the 20m data into 10m bands")
-            sr20_ = dsen2_20(data10, data20, image_level)
-            sr20 = sr20_.astype(np.uint16)
-            del sr20_
-        else:
+        if not (validated_60m_bands and validated_20m_bands and validated_10m_bands):
             LOGGER.info("No super-resolution performed, exiting")
             sys.exit(0)
 
+        validated_descriptions_all = {**dic_10m, **dic_20m, **dic_60m}
+
+        # Only the selected bands are written and only the networks that produce
+        # them are run
         if self.params.__dict__["copy_original_bands"]:
-            sr_final = np.concatenate((data10.astype(np.uint16), sr20, sr60), axis=2)
-            validated_sr_final_bands = (
-                validated_10m_bands + validated_20m_bands + validated_60m_bands
+            output_10m_bands = self.selected_bands(validated_10m_bands)
+        else:
+            output_10m_bands = []
+        output_20m_bands = self.selected_bands(validated_20m_bands)
+        output_60m_bands = self.selected_bands(validated_60m_bands)
+        validated_sr_final_bands = (
+            output_10m_bands + output_20m_bands + output_60m_bands
+        )
+        offset = len(output_10m_bands)
+        slice_20 = slice(offset, offset + len(output_20m_bands))
+        slice_60 = slice(slice_20.stop, slice_20.stop + len(output_60m_bands))
+        if not output_20m_bands + output_60m_bands:
+            raise UP42Error(
+                SupportedErrors.INPUT_PARAMETERS_ERROR,
+                f"None of the bands {self.params.__dict__['bands']} is super-resolved, "
+                "select at least one of the 20m or 60m bands.",
             )
+        LOGGER.info(f"Output bands: {validated_sr_final_bands}")
+
+        channels_10 = [validated_10m_bands.index(b) for b in output_10m_bands]
+        band_ranges = (
+            slice_20 if output_20m_bands else None,
+            slice_60 if output_60m_bands else None,
+        )
+        channels = {
+            "channels_20": [validated_20m_bands.index(b) for b in output_20m_bands],
+            "channels_60": [validated_60m_bands.index(b) for b in output_60m_bands],
+        }
+        inputs = [
+            (ds10, validated_10m_indices, 1),
+            (ds20, validated_20m_indices, 2),
+            (ds60, validated_60m_indices, 6) if output_60m_bands else None,
+        ]
+        return (
+            inputs,
+            (validated_sr_final_bands, validated_descriptions_all),
+            (channels_10, band_ranges, channels),
+        )
+
+    def report_profile(self, filename):
+        """
+        Logs the wall time, CPU time and peak memory of the stages of the run and
+        attaches them to the properties of the output feature.
+        """
+        report = current_profile().report()
+        LOGGER.info(f"Profile: {json.dumps(report)}")
+        self.add_output_properties(filename, {"superresolution_profile": report})
+        if self.params.__dict__["adaptive_threshold"] is not None:
+            adaptive = adaptive_report(report)
+            LOGGER.info(f"Skipped patches: {json.dumps(adaptive)}")
+            self.add_output_properties(filename, {"superresolution_adaptive": adaptive})
+
+    # pylint: disable=too-many-arguments
+    def super_resolve(
+        self, data, image_level, output, selection, model_options, halo=0
+    ):
+        """
+        Writes the selected 10m bands and the super-resolved 20m and 60m bands of
+        the 10m, 20m and 60m data into the uint16 output array.
+
+        Args:
+            data: The 10m, 20m and 60m data, the 60m data may be None.
+            selection: The channels of the 10m data, the band ranges of the 20m and
+                60m bands in the output and the selected network outputs.
+            model_options: Keyword arguments of run_models.
+            halo: The 10m pixels around the output area in the data, see run_models.
+        """
+        # pylint: disable=import-outside-toplevel
+        from supres import run_models, run_preview
+
+        channels_10, band_ranges, channels = selection
+        data10 = data[0][halo : data[0].shape[0] - halo, halo : data[0].shape[1] - halo]
+        for b_i, channel in enumerate(channels_10):
+            output[:, :, b_i] = data10[:, :, channel]
+
+        if self.params.__dict__["preview"]:
+            LOGGER.info("Preview mode, upsampling bilinearly without the networks")
+            run_preview(*data, output, *band_ranges, halo=halo, **channels)
         else:
-            sr_final = np.concatenate((sr20, sr60), axis=2)
-            validated_sr_final_bands = validated_20m_bands + validated_60m_bands
+            run_models(
+                *data,
+                image_level,
+                output,
+                *band_ranges,
+                halo=halo,
+                **channels,
+                **model_options,
+            )
 
-        for dsdesc in data_list:
-            if "10m" in dsdesc:
-                p_r = self.update(dsdesc, data10.shape, sr_final, xmin, ymin)
-        filename = os.path.join(self.output_dir, path_to_output_img)
+    # pylint: disable=too-many-arguments
+    def process_windows(
+        self,
+        product,
+        filename,
+        image_level,
+        aoi,
+        inputs,
+        output_bands,
+        selection,
+        model_options,
+        window_size,
+    ):
+        """
+        Super-resolves the AOI window by window and writes every window to the
+        output file right away. The finished windows are recorded in a checkpoint
+        manifest next to the output, a rerun with the same inputs and parameters
+        only processes the remaining windows. With the cache_dir parameter the
+        windows of the last output of the product with the same fingerprint apart
+        from the AOI are copied instead of processed, if they have the same
+        context, see WindowCache.
 
-        LOGGER.info("Now writing the super-resolved bands")
-        save_result(
-            sr_final,
-            validated_sr_final_bands,
-            validated_descriptions_all,
-            p_r,
-            filename,
+        Args:
+            product: The name of the input product.
+            filename: The path of the output file.
+            aoi: The AOI (xmin, ymin, xmax, ymax) in 10m pixels of the product.
+            inputs: The subdataset, the band indices and the scale of the 10m, 20m
+                and 60m data, None for the 60m data if it is not needed.
+            output_bands: The output bands and the descriptions of all bands.
+            selection: See super_resolve.
+            model_options: Keyword arguments of run_models.
+            window_size: The size of the windows, a multiple of WINDOW_MULTIPLE.
+        """
+        # pylint: disable=import-outside-toplevel
+        from supres import model_filenames
+
+        xmin, ymin, xmax, ymax = aoi
+        bands, descriptions = output_bands
+        if self.params.__dict__["tune_window_size"]:
+            LOGGER.info("tune_window_size is ignored when processing in windows")
+        model_files = []
+        if not self.params.__dict__["preview"]:
+            model_files = [
+                model_file
+                for model_file, band_range in zip(
+                    model_filenames(image_level), selection[1]
+                )
+                if band_range is not None
+            ]
+        checkpoint = Checkpoint(
+            filename + CHECKPOINT_SUFFIX,
+            fingerprint(
+                product,
+                image_level,
+                aoi,
+                bands,
+                model_files,
+                {
+                    **{key: self.params.__dict__[key] for key in OUTPUT_PARAMETERS},
+                    "checkpoint_size": window_size,
+                },
+            ),
         )
-        del sr_final
-        LOGGER.info("This is for releasing memory: %s", gc.collect())
+        if not (os.path.exists(filename) and checkpoint.load()):
+            profile = self.update(
+                inputs[0][0],
+                (ymax - ymin + 1, xmax - xmin + 1),
+                np.empty((0, 0, len(bands))),
+                xmin,
+                ymin,
+            )
+            create_result(bands, descriptions, profile, filename)
+            checkpoint.start()
+
+        cache = None
+        if self.params.__dict__["cache_dir"]:
+            cache = WindowCache(
+                self.params.__dict__["cache_dir"], checkpoint.fingerprint
+            )
+
+        windows = scene_windows(aoi, window_size)
+        LOGGER.info(
+            f"{len(checkpoint.finished)} of {len(windows)} windows are already finished"
+        )
+        reused = 0
+        statistics = BandStatistics(len(bands))
+        for window in windows:
+            if window in checkpoint:
+                # Only the statistics of the windows of an earlier run are read
+                statistics.add(
+                    read_result_window(
+                        filename,
+                        window.top - ymin,
+                        window.left - xmin,
+                        window.height,
+                        window.width,
+                    )
+                )
+                continue
+            context = window_context(window, aoi)
+            offset = cache.lookup(window, context) if cache else None
+            if offset is not None:
+                output = read_result_window(
+                    cache.image_path, *offset, window.height, window.width
+                )
+                reused += 1
+            else:
+                output = np.empty((window.height, window.width, len(bands)), np.uint16)
+                self.super_resolve(
+                    self.read_window(inputs, window, context),
+                    image_level,
+                    output,
+                    selection,
+                    model_options,
+                    halo=HALO,
+                )
+            with stage("write", pixels=window.height * window.width):
+                write_result_window(
+                    output, window.top - ymin, window.left - xmin, filename
+                )
+                statistics.add(output)
+            checkpoint.add(window, context)
+            LOGGER.info(
+                f"Finished window {window}, peak memory {peak_memory_mb():.0f} MB"
+            )
+        if cache:
+            LOGGER.info(f"Reused {reused} of {len(windows)} windows from the cache")
+            cache.store(filename, aoi, checkpoint)
+        write_result_statistics(statistics, filename)
+        self.add_output_properties(
+            filename, {"raster:bands": statistics.properties(bands)}
+        )
+        checkpoint.remove()
         LOGGER.info("Writing the super-resolved bands is finished.")
 
+    def read_window(self, inputs, window, context):
+        """
+        Reads the 10m, 20m and 60m data of the context of a window and mirrors it
+        at the border of the AOI, see process_windows for `inputs`.
+        """
+        data = []
+        for dsdesc in inputs:
+            if dsdesc is None:
+                data.append(None)
+                continue
+            dataset, indices, scale = dsdesc
+            with stage("read", pixels=context.height * context.width // scale ** 2):
+                window_data = self.data_final(
+                    dataset,
+                    indices,
+                    context.left,
+                    context.top,
+                    context.right - 1,
+                    context.bottom - 1,
+                    1,
+                    scale,
+                )
+            data.append(mirror_halo(window_data, window, context, scale))
+        return data
+
 
 if __name__ == "__main__":
+    LOGGER.info(f"Block startup took {process_uptime():.2f}s")
     PARAMS = load_params()
-    SuperresolutionProcess(PARAMS).start(sys.argv[1], sys.argv[2])
+    PROCESS = SuperresolutionProcess(PARAMS)
+    if len(sys.argv) > 3 or PROCESS.params.__dict__["time_stack"]:
+        PROCESS.start_group(sys.argv[1:-1], sys.argv[-1])
+    else:
+        PROCESS.start(sys.argv[1], sys.argv[2])
@@ -0,0 +1,241 @@
+"""
+This module plans the mosaic of several overlapping tiles of the same UTM zone,
+e.g. the MGRS tiles an AOI crosses, on their common 10m grid. Neighbouring tiles
+overlap by about 10 km. Every window of the mosaic is super-resolved once, from
+the tile it lies deepest in, so the overlap is not computed twice. The halo of a
+window is read from the same tile, so windows from different tiles join without
+seams wherever the tile has real pixels around the window, see windows.py.
+"""
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from rasterio import Affine
+
+from windows import WINDOW_MULTIPLE, SceneWindow, scene_windows
+
+# The tiles must be aligned to the 60m pixels
+GRID_MULTIPLE = 6
+
+
+def mosaic_grid(
+    transforms: Sequence[Affine], shapes: Sequence[Tuple[int, int]]
+) -> Tuple[Affine, Tuple[int, int], List[SceneWindow]]:
+    """
+    Returns the transform and the shape of the common 10m grid of tiles with the
+    given 10m transforms and shapes (height, width), and the extents of the tiles
+    in it.
+
+    Raises:
+        ValueError: If the tiles are not on a common 60m grid.
+    """
+    resolution = transforms[0].a
+    for transform in transforms:
+        if (transform.a, transform.b, transform.d, transform.e) != (
+            resolution,
+            0,
+            0,
+            -resolution,
+        ):
+            raise ValueError("The tiles have different resolutions or are rotated")
+    left = min(transform.c for transform in transforms)
+    top = max(transform.f for transform in transforms)
+    extents = []
+    for transform, (height, width) in zip(transforms, shapes):
+        col_off = (transform.c - left) / resolution
+        row_off = (top - transform.f) / resolution
+        if col_off % GRID_MULTIPLE or row_off % GRID_MULTIPLE:
+            raise ValueError("The tiles are not on a common 60m grid")
+        extents.append(
+            SceneWindow(
+                int(row_off), int(col_off), int(row_off) + height, int(col_off) + width
+            )
+        )
+    shape = (max(e.bottom for e in extents), max(e.right for e in extents))
+    return Affine(resolution, 0, left, 0, -resolution, top), shape, extents
+
+
+def mosaic_aoi(
+    transform: Affine, shape: Tuple[int, int], bounds: Optional[Sequence[float]]
+) -> Tuple[int, int, int, int]:
+    """
+    Returns the AOI (xmin, ymin, xmax, ymax) in 10m pixels of the mosaic grid, see
+    Superresolution.get_max_min, of the bounds (left, bottom, right, top) in the
+    CRS of the grid, the whole mosaic if the bounds are None.
+    """
+    height, width = shape
+    if bounds is None:
+        return 0, 0, width - 1, height - 1
+    left, bottom, right, top = bounds
+    cols = sorted(int((x - transform.c) // transform.a) for x in (left, right))
+    rows = sorted(int((transform.f - y) // transform.a) for y in (bottom, top))
+    xmin, xmax = (min(max(c, 0), width - 1) for c in cols)
+    ymin, ymax = (min(max(r, 0), height - 1) for r in rows)
+    # Enlarged to the nearest 60m pixel boundary like get_max_min
+    return (
+        xmin // GRID_MULTIPLE * GRID_MULTIPLE,
+        ymin // GRID_MULTIPLE * GRID_MULTIPLE,
+        (xmax + 1) // GRID_MULTIPLE * GRID_MULTIPLE - 1,
+        (ymax + 1) // GRID_MULTIPLE * GRID_MULTIPLE - 1,
+    )
+
+
+def intersection(a: SceneWindow, b: SceneWindow) -> Optional[SceneWindow]:
+    window = SceneWindow(
+        max(a.top, b.top),
+        max(a.left, b.left),
+        min(a.bottom, b.bottom),
+        min(a.right, b.right),
+    )
+    if window.height <= 0 or window.width <= 0:
+        return None
+    return window
+
+
+def tile_window(window: SceneWindow, extent: SceneWindow) -> SceneWindow:
+    """
+    Returns a window of the mosaic in the pixels of the tile with the extent.
+    """
+    return SceneWindow(
+        window.top - extent.top,
+        window.left - extent.left,
+        window.bottom - extent.top,
+        window.right - extent.left,
+    )
+
+
+def grow_window(window: SceneWindow, bounds: SceneWindow, size: int) -> SceneWindow:
+    """
+    Enlarges the window to at least `size` pixels in each direction where it is
+    smaller, staying within the bounds as far as they allow. The bounds and the
+    window are aligned to the 60m pixels.
+    """
+
+    def grow(start, stop, low, high):
+        new_start = max(start - max(size - (stop - start), 0) // 2, low)
+        new_stop = min(max(stop, new_start + size), high)
+        new_start = max(min(new_start, new_stop - size), low)
+        # Aligned to the 60m pixels
+        return (
+            new_start // GRID_MULTIPLE * GRID_MULTIPLE,
+            min(-(-new_stop // GRID_MULTIPLE) * GRID_MULTIPLE, high),
+        )
+
+    top, bottom = grow(window.top, window.bottom, bounds.top, bounds.bottom)
+    left, right = grow(window.left, window.right, bounds.left, bounds.right)
+    return SceneWindow(top, left, bottom, right)
+
+
+def depth(window: SceneWindow, extent: SceneWindow) -> int:
+    """
+    Returns the distance in pixels of the window to the border of the extent,
+    negative if the window is not inside the extent.
+    """
+    return min(
+        window.top - extent.top,
+        window.left - extent.left,
+        extent.bottom - window.bottom,
+        extent.right - window.right,
+    )
+
+
+def owner(window: SceneWindow, extents: Sequence[SceneWindow]) -> int:
+    """
+    Returns the index of the tile the window lies deepest in.
+    """
+    return max(range(len(extents)), key=lambda i: depth(window, extents[i]))
+
+
+def split_window(
+    window: SceneWindow, extents: Sequence[SceneWindow]
+) -> List[SceneWindow]:
+    """
+    Splits a window at the edges of the extents that cross it, so that every part
+    is inside or outside of each extent.
+    """
+    rows = sorted(
+        {window.top, window.bottom}
+        | {
+            y
+            for e in extents
+            for y in (e.top, e.bottom)
+            if window.top < y < window.bottom
+        }
+    )
+    cols = sorted(
+        {window.left, window.right}
+        | {
+            x
+            for e in extents
+            for x in (e.left, e.right)
+            if window.left < x < window.right
+        }
+    )
+    return [
+        SceneWindow(top, left, bottom, right)
+        for top, bottom in zip(rows[:-1], rows[1:])
+        for left, right in zip(cols[:-1], cols[1:])
+    ]
+
+
+def assign_windows(
+    aoi: Sequence[int], extents: Sequence[SceneWindow], window_size: int
+) -> List[Tuple[SceneWindow, int]]:
+    """
+    Splits the AOI of the mosaic into windows and assigns each to the tile that
+    super-resolves it. A window that no tile contains, because it crosses the
+    edge of a tile, is split into windows of WINDOW_MULTIPLE pixels that are
+    assigned on their own, and these at the edges of the tiles if needed. Windows
+    beyond all tiles are left out.
+
+    Args:
+        aoi: The AOI in 10m pixels of the mosaic, see mosaic_aoi.
+        extents: The extents of the tiles in the mosaic.
+        window_size: The size of the windows, a multiple of WINDOW_MULTIPLE.
+
+    Returns:
+        The windows and the indices of their tiles, each inside its tile.
+    """
+    assigned = []
+    for window in scene_windows(aoi, window_size):
+        tile = owner(window, extents)
+        if depth(window, extents[tile]) >= 0:
+            assigned.append((window, tile))
+            continue
+        cells = scene_windows(
+            (window.left, window.top, window.right - 1, window.bottom - 1),
+            WINDOW_MULTIPLE,
+        )
+        for cell in cells:
+            parts = [cell]
+            if depth(cell, extents[owner(cell, extents)]) < 0:
+                parts = split_window(cell, extents)
+            for part in parts:
+                tile = owner(part, extents)
+                if depth(part, extents[tile]) >= 0:
+                    assigned.append((part, tile))
+    return assigned
+
+
+def mosaic_report(
+    aoi: Sequence[int],
+    extents: Sequence[SceneWindow],
+    windows: Sequence[Tuple[SceneWindow, int]],
+) -> Dict:
+    """
+    Returns the pixels each tile super-resolves in the mosaic and the pixels the
+    tiles would super-resolve on their own.
+    """
+    xmin, ymin, xmax, ymax = aoi
+    aoi_window = SceneWindow(ymin, xmin, ymax + 1, xmax + 1)
+    tile_pixels = []
+    for extent in extents:
+        part = intersection(aoi_window, extent)
+        tile_pixels.append(part.height * part.width if part else 0)
+    pixels = [0] * len(extents)
+    for window, tile in windows:
+        pixels[tile] += window.height * window.width
+    return {
+        "aoi": list(aoi),
+        "pixels": pixels,
+        "separate_pixels": tile_pixels,
+        "saved_fraction": 1 - sum(pixels) / max(sum(tile_pixels), 1),
+    }
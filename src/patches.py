@@ -5,65 +5,111 @@ from typing import Tuple, List
 import numpy as np
 from skimage.transform import resize
 
+from profiling import stage
+
 
 def interp_patches(
-    image_20: np.ndarray, image_10_shape: Tuple[int, int, int, int]
+    image_20: np.ndarray,
+    image_10_shape: Tuple[int, int, int, int],
+    dtype=np.float32,
+    scale: float = 1,
 ) -> np.ndarray:
-    """Upsample patches to shape of higher resolution"""
-    data20_interp = np.zeros((image_20.shape[0:2] + image_10_shape[2:4])).astype(
-        np.float32
-    )
+    """Upsample patches to shape of higher resolution. The result is divided by
+    `scale`, which keeps reflectances in the range of small dtypes like float16."""
+    data20_interp = np.zeros((image_20.shape[0:2] + image_10_shape[2:4]), dtype=dtype)
     for k in range(image_20.shape[0]):
         for w in range(image_20.shape[1]):
             data20_interp[k, w] = (
-                resize(image_20[k, w] / 30000, image_10_shape[2:4], mode="reflect")
+                resize(
+                    np.asarray(image_20[k, w], dtype=np.float32) / 30000,
+                    image_10_shape[2:4],
+                    mode="reflect",
+                )
                 * 30000
+                / scale
             )  # bilinear
     return data20_interp
 
 
+def interp_image(
+    image: np.ndarray, shape: Tuple[int, int], output: np.ndarray
+) -> np.ndarray:
+    """Upsample a channels last image band by band to `shape` with the bilinear
+    interpolation of interp_patches and write it into the channels last `output`."""
+    for b_i in range(image.shape[2]):
+        output[:, :, b_i] = interp_patches(
+            image[np.newaxis, np.newaxis, :, :, b_i], (1, 1) + tuple(shape)
+        )[0, 0]
+    return output
+
+
+def crop_symmetric(
+    dset: np.ndarray, upper_left_i: int, upper_left_j: int, patch_size: int, pad: int
+) -> np.ndarray:
+    """Crop a window of the image mirrored by `pad` pixels at its borders, without
+    padding the whole image. The window coordinates refer to the padded image.
+    Windows inside the image are views, windows at the image border are mirrored
+    like np.pad(..., mode="symmetric")."""
+    i_0, j_0 = upper_left_i - pad, upper_left_j - pad
+    i_1, j_1 = i_0 + patch_size, j_0 + patch_size
+    window = dset[
+        max(i_0, 0) : min(i_1, dset.shape[0]), max(j_0, 0) : min(j_1, dset.shape[1])
+    ]
+    padding = (
+        (max(-i_0, 0), max(i_1 - dset.shape[0], 0)),
+        (max(-j_0, 0), max(j_1 - dset.shape[1], 0)),
+        (0, 0),
+    )
+    if any(before or after for before, after in padding):
+        window = np.pad(window, padding, mode="symmetric")
+    return window
+
+
 def get_patches(
     dset: np.ndarray,
     patch_size: int,
     border: int,
     patches_along_i: int,
     patches_along_j: int,
+    dtype=np.float32,
+    pad: int = 0,
 ) -> np.ndarray:
+    """Cut the image into overlapping patches of shape (p, c, w, h). With `dtype`
+    None the patches keep the dtype of the image, e.g. uint16. The image is mirrored
+    by `pad` pixels at its borders, see crop_symmetric."""
     n_bands = dset.shape[2]
+    height, width = dset.shape[0] + 2 * pad, dset.shape[1] + 2 * pad
 
     # array index
     nr_patches = (patches_along_i + 1) * (patches_along_j + 1)
     range_i = np.arange(0, patches_along_i) * (patch_size - 2 * border)
     range_j = np.arange(0, patches_along_j) * (patch_size - 2 * border)
 
-    patches = np.zeros((nr_patches, n_bands) + (patch_size, patch_size)).astype(
-        np.float32
+    patches = np.zeros(
+        (nr_patches, n_bands) + (patch_size, patch_size),
+        dtype=dset.dtype if dtype is None else dtype,
     )
 
     # if height and width are divisible by patch size - border * 2, or if
     # range_i \and range_j are smaller than size
     # add one extra patch at the end of the image
     if (
-        np.mod(dset.shape[0] - 2 * border, patch_size - 2 * border) != 0
-        or dset.shape[0] - 2 * border / patch_size - 2 * border > patches_along_i
+        np.mod(height - 2 * border, patch_size - 2 * border) != 0
+        or height - 2 * border / patch_size - 2 * border > patches_along_i
     ):
-        range_i = np.append(range_i, (dset.shape[0] - patch_size))
+        range_i = np.append(range_i, (height - patch_size))
     if (
-        np.mod(dset.shape[1] - 2 * border, patch_size - 2 * border) != 0
-        or dset.shape[1] - 2 * border / patch_size - 2 * border > patches_along_j
+        np.mod(width - 2 * border, patch_size - 2 * border) != 0
+        or width - 2 * border / patch_size - 2 * border > patches_along_j
     ):
-        range_j = np.append(range_j, (dset.shape[1] - patch_size))
+        range_j = np.append(range_j, (width - patch_size))
 
     patch_count = 0
     for ii in range_i.astype(int):
         for jj in range_j.astype(int):
-            upper_left_i = ii
-            upper_left_j = jj
             # make shape (p, c, w, h)
-            patches[patch_count] = crop_array_to_window(
-                dset,
-                get_crop_window(upper_left_i, upper_left_j, patch_size, 1),
-                rollaxis=True,
+            patches[patch_count] = np.rollaxis(
+                crop_symmetric(dset, ii, jj, patch_size, pad), 2
             )
             patch_count += 1
     # array shape, ignore unsuscriptable
@@ -72,48 +118,58 @@ def get_patches(
     return patches
 
 
+# pylint: disable=too-many-arguments
 def get_test_patches(
     dset_10: np.ndarray,
     dset_20: np.ndarray,
     patch_size: int = 128,
     border: int = 4,
     interp: bool = True,
+    dtype=np.float32,
+    interp_dtype=np.float32,
+    interp_scale: float = 1,
+    mirror: bool = True,
 ) -> Tuple[np.ndarray, np.ndarray]:
-    """Used for inference. Creates patches of specific size in the whole image (10m and 20m)"""
+    """Used for inference. Creates patches of specific size in the whole image (10m and 20m)
+    The patches have the given `dtype` (None keeps the input dtype), the upsampled
+    patches `interp_dtype` and are divided by `interp_scale`, see interp_patches.
+    With `mirror` False the images already contain the `border` around the area
+    that is super-resolved, e.g. the neighbouring pixels of a window."""
 
     patch_size_lr = patch_size // 2
     border_lr = border // 2
 
-    # Mirror the data at the borders to have the same dimensions as the input
-    dset_10 = np.pad(
-        dset_10,
-        ((border, border), (border, border), (0, 0)),
-        mode="symmetric",
-    )
-    dset_20 = np.pad(
-        dset_20,
-        ((border_lr, border_lr), (border_lr, border_lr), (0, 0)),
-        mode="symmetric",
-    )
-
-    patches_along_i = (dset_20.shape[0] - 2 * border_lr) // (
+    # The data is mirrored at the borders to have the same dimensions as the input,
+    # only the patches at the image border are padded.
+    pad, pad_lr = (border, border_lr) if mirror else (0, 0)
+    patches_along_i = (dset_20.shape[0] + 2 * (pad_lr - border_lr)) // (
         patch_size_lr - 2 * border_lr
     )
-    patches_along_j = (dset_20.shape[1] - 2 * border_lr) // (
+    patches_along_j = (dset_20.shape[1] + 2 * (pad_lr - border_lr)) // (
         patch_size_lr - 2 * border_lr
     )
 
-    image_10 = get_patches(
-        dset_10, patch_size, border, patches_along_i, patches_along_j
-    )
-    image_20 = get_patches(
-        dset_20, patch_size_lr, border_lr, patches_along_i, patches_along_j
-    )
+    with stage("patches"):
+        image_10 = get_patches(
+            dset_10, patch_size, border, patches_along_i, patches_along_j, dtype, pad
+        )
+        image_20 = get_patches(
+            dset_20,
+            patch_size_lr,
+            border_lr,
+            patches_along_i,
+            patches_along_j,
+            dtype,
+            pad_lr,
+        )
 
     image_10_shape = image_10.shape
 
     if interp:
-        data20_interp = interp_patches(image_20, image_10_shape)
+        with stage("interp"):
+            data20_interp = interp_patches(
+                image_20, image_10_shape, interp_dtype, interp_scale
+            )
     else:
         data20_interp = image_20
     return image_10, data20_interp
@@ -128,53 +184,62 @@ def get_test_patches60(
     patch_size: int = 192,
     border: int = 12,
     interp: bool = True,
+    dtype=np.float32,
+    interp_dtype=np.float32,
+    interp_scale: float = 1,
+    mirror: bool = True,
 ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
-    """Used for inference. Creates patches of specific size in the whole image (10m, 20m and 60m)"""
+    """Used for inference. Creates patches of specific size in the whole image (10m, 20m and 60m)
+    See get_test_patches for `dtype`, `interp_dtype`, `interp_scale` and `mirror`."""
 
     patch_size_20 = patch_size // 2
     patch_size_60 = patch_size // 6
     border_20 = border // 2
     border_60 = border // 6
 
-    # Mirror the data at the borders to have the same dimensions as the input
-    dset_10 = np.pad(
-        dset_10,
-        ((border, border), (border, border), (0, 0)),
-        mode="symmetric",
-    )
-    dset_20 = np.pad(
-        dset_20,
-        ((border_20, border_20), (border_20, border_20), (0, 0)),
-        mode="symmetric",
-    )
-    dset_60 = np.pad(
-        dset_60,
-        ((border_60, border_60), (border_60, border_60), (0, 0)),
-        mode="symmetric",
-    )
-
-    patches_along_i = (dset_60.shape[0] - 2 * border_60) // (
+    # The data is mirrored at the borders to have the same dimensions as the input,
+    # only the patches at the image border are padded.
+    pad, pad_20, pad_60 = (border, border_20, border_60) if mirror else (0, 0, 0)
+    patches_along_i = (dset_60.shape[0] + 2 * (pad_60 - border_60)) // (
         patch_size_60 - 2 * border_60
     )
-    patches_along_j = (dset_60.shape[1] - 2 * border_60) // (
+    patches_along_j = (dset_60.shape[1] + 2 * (pad_60 - border_60)) // (
         patch_size_60 - 2 * border_60
     )
 
-    image_10 = get_patches(
-        dset_10, patch_size, border, patches_along_i, patches_along_j
-    )
-    image_20 = get_patches(
-        dset_20, patch_size_20, border_20, patches_along_i, patches_along_j
-    )
-    image_60 = get_patches(
-        dset_60, patch_size_60, border_60, patches_along_i, patches_along_j
-    )
+    with stage("patches"):
+        image_10 = get_patches(
+            dset_10, patch_size, border, patches_along_i, patches_along_j, dtype, pad
+        )
+        image_20 = get_patches(
+            dset_20,
+            patch_size_20,
+            border_20,
+            patches_along_i,
+            patches_along_j,
+            dtype,
+            pad_20,
+        )
+        image_60 = get_patches(
+            dset_60,
+            patch_size_60,
+            border_60,
+            patches_along_i,
+            patches_along_j,
+            dtype,
+            pad_60,
+        )
 
     image_10_shape = image_10.shape
 
     if interp:
-        data20_interp = interp_patches(image_20, image_10_shape)
-        data60_interp = interp_patches(image_60, image_10_shape)
+        with stage("interp"):
+            data20_interp = interp_patches(
+                image_20, image_10_shape, interp_dtype, interp_scale
+            )
+            data60_interp = interp_patches(
+                image_60, image_10_shape, interp_dtype, interp_scale
+            )
 
     else:
         data20_interp = image_20
@@ -215,42 +280,50 @@ def crop_array_to_window(
         return cropped_array
 
 
+def _grid_columns(n_patches: int, x_tiles: int, y_tiles: int, width: int, stride: int):
+    """Number of patch columns per row in the patch array. get_patches adds a
+    duplicate last column when the width is divisible by the stride."""
+    if width % stride == 0 and n_patches % (x_tiles + 1) == 0:
+        if n_patches // (x_tiles + 1) >= y_tiles:
+            return x_tiles + 1
+    return x_tiles
+
+
+def _write_blocks(images: np.ndarray, centers: np.ndarray):
+    """Writes a (rows, cols, c, s, s) grid of patch centers into a channels last
+    image of (rows * s, cols * s, c). Splitting the image axes keeps the view."""
+    rows, cols, bands, size, _ = centers.shape
+    blocks = images.reshape(rows, size, cols, size, bands)
+    blocks[...] = centers.transpose((0, 3, 1, 4, 2))
+
+
 def recompose_images(a: np.ndarray, border: int, size=None) -> np.ndarray:
-    """ From array with patches recompose original image."""
+    """From array with patches recompose original image, channels last. The regular
+    interior grid is joined with block operations, only the last row and column,
+    which are clamped to the image border and overlap their neighbours, are written
+    separately. Later patches overwrite the overlap as in the patch order."""
     if a.shape[0] == 1:
-        images = a[0]
-    else:
-        # # This is done because we do not mirror the data at the image border
-        # size = [s - border * 2 for s in size]
-        patch_size = a.shape[2] - border * 2
-
-        # print('Patch has dimension {}'.format(patch_size))
-        # print('Prediction has shape {}'.format(a.shape))
-        x_tiles = int(ceil(size[1] / float(patch_size)))
-        y_tiles = int(ceil(size[0] / float(patch_size)))
-        # print('Tiles per image {} {}'.format(x_tiles, y_tiles))
-
-        # Initialize image
-        # print('Image size is: {}'.format(size))
-        images = np.zeros((a.shape[1], size[0], size[1])).astype(np.float32)
-
-        current_patch = 0
-        for y in range(0, y_tiles):
-            ypoint = y * patch_size
-            if ypoint > size[0] - patch_size:
-                ypoint = size[0] - patch_size
-            for x in range(0, x_tiles):
-                xpoint = x * patch_size
-                if xpoint > size[1] - patch_size:
-                    xpoint = size[1] - patch_size
-                images[
-                    :, ypoint : ypoint + patch_size, xpoint : xpoint + patch_size
-                ] = a[
-                    current_patch,
-                    :,
-                    border : a.shape[2] - border,
-                    border : a.shape[3] - border,
-                ]
-                current_patch += 1
-
-    return images.transpose((1, 2, 0))
+        return a[0].transpose((1, 2, 0))
+
+    patch_size = a.shape[2] - border * 2
+    x_tiles = int(ceil(size[1] / float(patch_size)))
+    y_tiles = int(ceil(size[0] / float(patch_size)))
+    n_cols = _grid_columns(a.shape[0], x_tiles, y_tiles, size[1], patch_size)
+
+    centers = a[
+        : y_tiles * n_cols,
+        :,
+        border : a.shape[2] - border,
+        border : a.shape[3] - border,
+    ]
+    centers = centers.reshape((y_tiles, n_cols) + centers.shape[1:])[:, :x_tiles]
+    # Number of rows and columns that are not clamped to the image border
+    rows, cols = (y_tiles - 1) * patch_size, (x_tiles - 1) * patch_size
+    last_i, last_j = size[0] - patch_size, size[1] - patch_size
+
+    images = np.empty((size[0], size[1], a.shape[1]), dtype=np.float32)
+    _write_blocks(images[:rows, :cols], centers[:-1, :-1])
+    _write_blocks(images[:rows, last_j:], centers[:-1, -1:])
+    _write_blocks(images[last_i:, :cols], centers[-1:, :-1])
+    _write_blocks(images[last_i:, last_j:], centers[-1:, -1:])
+    return images
@@ -0,0 +1,227 @@
+"""
+This module plans a super-resolution request before any pixel is read: the patch
+counts of the networks, the memory of each stage, the CPU time and the strategy
+that fits into the available memory, in-memory or in windows.
+
+The CPU times come from the throughput of the inference backends in
+throughput.json, measured by benchmarks/calibrate_throughput.py.
+"""
+import json
+import os
+from typing import Dict, Optional, Sequence
+
+from blockutils.logging import get_logger
+
+from autotune import FEATURES, LIVE_TENSORS, available_memory
+from supres import BORDER_20M, BORDER_60M, predict_batch_size, window_patch_size
+from windows import WINDOW_MULTIPLE, scene_windows
+
+LOGGER = get_logger(__name__)
+
+MB = 1024 ** 2
+
+# Calibration of the throughput, written by benchmarks/calibrate_throughput.py
+CALIBRATION_PATH = os.path.join(os.path.dirname(__file__), "throughput.json")
+# Default number of patches per batch of the inference backends
+BATCH_SIZE = 32
+# Share of the available memory the plan may use
+MEMORY_BUDGET = 0.8
+# Window sizes tried for the windowed strategy, the largest that fits is used
+WINDOW_CANDIDATES = tuple(WINDOW_MULTIPLE * k for k in (20, 12, 6, 3, 1))
+
+# Patch size, border, scale of the coarsest input, which large patch sizes are a
+# multiple of, and the input bands of the networks, the last ones are predicted
+NETWORKS = {
+    "20m": {"patch_size": 128, "border": BORDER_20M, "scale": 2, "inputs": (4, 6)},
+    "60m": {"patch_size": 192, "border": BORDER_60M, "scale": 6, "inputs": (4, 6, 2)},
+}
+
+
+def load_throughput(path: str = CALIBRATION_PATH) -> Dict[str, Dict[str, float]]:
+    """
+    Returns the input pixels (including the patch border) per second on the CPU
+    of the "20m" and the "60m" network per inference backend, from a calibration
+    file. The networks differ in their patch size and inputs, so they are
+    calibrated separately.
+    """
+    with open(path) as f_p:
+        return json.load(f_p)["throughput"]
+
+
+THROUGHPUT = load_throughput()
+
+
+def backend_throughput(network: str, backend: str) -> float:
+    """
+    Returns the calibrated throughput of a network with an inference backend, or
+    the lowest one of all backends of the network if it was not calibrated.
+    """
+    throughput = THROUGHPUT[network]
+    if backend not in throughput:
+        LOGGER.warning(
+            f"No throughput of the {network} network with the inference backend "
+            f"{backend} in {CALIBRATION_PATH}, estimating with the slowest backend. "
+            "Run benchmarks/calibrate_throughput.py to calibrate it."
+        )
+        return min(throughput.values())
+    return throughput[backend]
+
+
+def patch_count(height: int, width: int, patch_size: int, border: int, scale: int):
+    """
+    Returns the number of patches get_test_patches(60) cuts from an image of
+    `height` x `width` 10m pixels, see get_patches.
+    """
+    stride = (patch_size - 2 * border) // scale
+    return (height // scale // stride + 1) * (width // scale // stride + 1)
+
+
+def network_plan(network: str, height: int, width: int, options: Dict) -> Dict:
+    """
+    Estimates the patches, the memory in MB of the stages and the CPU seconds of
+    one network on an image or window of `height` x `width` 10m pixels. The patch
+    border is mirrored or read around a window, the patch count is the same.
+
+    Args:
+        network: "20m" or "60m".
+        options: The parameters inference_backend, low_memory, half_precision and
+            window_size.
+    """
+    config = NETWORKS[network]
+    patch_size = window_patch_size(
+        options["window_size"],
+        config["patch_size"],
+        config["border"],
+        config["scale"],
+        (height, width),
+    )
+    patches = patch_count(height, width, patch_size, config["border"], config["scale"])
+    pixels = patches * patch_size ** 2
+    n_10m, *n_interp = config["inputs"]
+    raw_bytes = 2 if options["low_memory"] or options["half_precision"] else 4
+    interp_bytes = 2 if options["half_precision"] else 4
+    batch_size = predict_batch_size(options["window_size"], patch_size) or BATCH_SIZE
+    n_out = n_interp[-1]
+    return {
+        "patch_size": patch_size,
+        "patches": patches,
+        "memory_mb": {
+            "patches": pixels * (n_10m * raw_bytes + sum(n_interp) * interp_bytes) / MB,
+            "predict": batch_size * patch_size ** 2 * FEATURES * LIVE_TENSORS * 4 / MB,
+            # _predict appends the batches, which copies the predictions
+            "prediction": 2 * pixels * n_out * 4 / MB,
+            "recompose": height * width * n_out * 4 / MB,
+        },
+        "cpu_seconds": pixels
+        / backend_throughput(network, options["inference_backend"]),
+    }
+
+
+def peak_memory(
+    height: int,
+    width: int,
+    networks: Sequence[str],
+    n_output_bands: int,
+    options: Dict,
+    parallel: bool,
+    window: bool = False,
+) -> float:
+    """
+    Estimates the peak memory in MB of super-resolving an image: the input data
+    and the output stay in memory while the networks run one after the other or,
+    with `parallel`, at the same time.
+    """
+    pixels = height * width
+    if window:
+        # The data is read with the halo around the window
+        pixels = (height + 2 * BORDER_60M) * (width + 2 * BORDER_60M)
+    data = pixels * 2 * (4 + 6 / 4 + (2 / 36 if "60m" in networks else 0)) / MB
+    output = height * width * n_output_bands * 2 / MB
+    stages = [
+        sum(network_plan(n, height, width, options)["memory_mb"].values())
+        for n in networks
+    ]
+    if not stages:
+        return data + output
+    return data + output + (sum(stages) if parallel else max(stages))
+
+
+# pylint: disable=too-many-arguments,too-many-locals
+def plan_request(
+    aoi: Sequence[int],
+    networks: Sequence[str],
+    n_output_bands: int,
+    options: Dict,
+    parallel: Optional[bool] = False,
+    memory: Optional[int] = None,
+    cpus: Optional[int] = None,
+) -> Dict:
+    """
+    Plans the super-resolution of an AOI.
+
+    Args:
+        aoi: The AOI (xmin, ymin, xmax, ymax) in 10m pixels of the product.
+        networks: The networks that are run, "20m" and/or "60m".
+        n_output_bands: The number of output bands.
+        options: See network_plan.
+        parallel: The networks run in parallel if the strategy is in-memory. If
+            None, the plan runs them in parallel when both fit into the memory at
+            once and there is more than one CPU.
+        memory: The available memory in bytes, measured if None.
+        cpus: The number of CPUs, counted if None.
+
+    Returns:
+        The plan as a dictionary that can be serialised to JSON.
+    """
+    xmin, ymin, xmax, ymax = aoi
+    height, width = ymax - ymin + 1, xmax - xmin + 1
+    if memory is None:
+        memory = available_memory()
+    budget = memory * MEMORY_BUDGET / MB
+
+    plans = {n: network_plan(n, height, width, options) for n in networks}
+    in_memory = {
+        workers: peak_memory(
+            height, width, networks, n_output_bands, options, workers > 1
+        )
+        for workers in (1, 2)
+    }
+    if parallel is None:
+        parallel = (cpus or os.cpu_count() or 1) > 1
+    if in_memory[1] <= budget:
+        workers = 2 if parallel and len(networks) > 1 and in_memory[2] <= budget else 1
+        strategy = {"mode": "in_memory", "window_size": None, "workers": workers}
+        peak = in_memory[workers]
+    else:
+        # The smallest window if none fits
+        for size in WINDOW_CANDIDATES:
+            peak = peak_memory(
+                size, size, networks, n_output_bands, options, False, True
+            )
+            if peak <= budget:
+                break
+        strategy = {"mode": "windowed", "window_size": size, "workers": 1}
+        for network, network_plan_ in plans.items():
+            # The windows overlap by their patch border
+            patches = sum(
+                network_plan(network, w.height, w.width, options)["patches"]
+                for w in scene_windows(aoi, size)
+            )
+            network_plan_["cpu_seconds"] *= patches / network_plan_["patches"]
+            network_plan_["window_patches"] = patches
+
+    return {
+        "aoi": list(aoi),
+        "height": height,
+        "width": width,
+        "networks": plans,
+        "memory_mb": {
+            "input": height * width * 2 * (4 + 6 / 4 + 2 / 36) / MB,
+            "output": height * width * n_output_bands * 2 / MB,
+            "peak_in_memory": in_memory[1],
+            "peak": peak,
+            "available": memory / MB,
+        },
+        "cpu_seconds": sum(p["cpu_seconds"] for p in plans.values()),
+        "strategy": strategy,
+    }
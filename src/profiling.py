@@ -0,0 +1,246 @@
+"""
+Helpers to measure the resource usage of the super-resolution process.
+
+The stages of a run, e.g. reading, patching, upsampling, prediction, recomposition
+and writing, are recorded with `stage` into the module-wide PROFILE:
+
+    with stage("predict", patches=len(patches)):
+        prediction = model.predict(patches)
+
+Inside `scope("20m")` the stages are recorded as "20m/predict" etc., per thread,
+so the networks can run in parallel worker threads.
+
+A thread records into another profile inside `use_profile(profile)`, e.g. every
+job of the inference service into its own. Threads started for a run have to
+enter the profile of the run themselves, see current_profile.
+
+The memory of a stage is sampled from the resident set size while it runs, see
+RssSampler: the peak during the stage and its rise over the start of the stage.
+The peak resident set size of the process, ru_maxrss, only ever grows and would
+repeat the high-water mark of the largest stage for every later one.
+"""
+import itertools
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+MB = 1024 ** 2
+
+# Seconds between two samples of the resident set size during the stages
+SAMPLE_INTERVAL = 0.01
+
+
+def current_rss_mb() -> float:
+    """
+    Returns the resident set size of the current process in megabytes. Only
+    available on Linux, 0 otherwise.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            pages = int(statm.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return 0.0
+    return pages * os.sysconf("SC_PAGE_SIZE") / MB
+
+
+def peak_memory_mb() -> float:
+    """
+    Returns the peak resident set size of the current process in megabytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux
+    if sys.platform == "darwin":
+        return peak / 1024 ** 2
+    return peak / 1024
+
+
+def process_uptime() -> float:
+    """
+    Returns the seconds since the current process was started, i.e. including the
+    interpreter startup and all imports. Only available on Linux, 0 otherwise.
+    """
+    try:
+        with open("/proc/self/stat") as stat, open("/proc/uptime") as uptime:
+            # The process name may contain spaces, the start time is the 20th field
+            # after it and is counted in clock ticks since boot.
+            start_ticks = int(stat.read().rsplit(")", 1)[1].split()[19])
+            system_uptime = float(uptime.read().split()[0])
+    except (OSError, IndexError, ValueError):
+        return 0.0
+    return system_uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+
+
+class RssSampler:
+    """
+    Samples the resident set size of the process in a daemon thread while at
+    least one measurement is open, and keeps the peak of every measurement. The
+    sampling misses peaks shorter than the interval.
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self._peaks: Dict[int, float] = {}
+        self._keys = itertools.count()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> Tuple[int, float]:
+        """
+        Opens a measurement and returns its key and the current RSS in MB.
+        """
+        rss = current_rss_mb()
+        with self._lock:
+            key = next(self._keys)
+            self._peaks[key] = rss
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample, daemon=True)
+                self._thread.start()
+        return key, rss
+
+    def stop(self, key: int) -> float:
+        """
+        Closes a measurement and returns the peak RSS in MB since its start.
+        """
+        rss = current_rss_mb()
+        with self._lock:
+            return max(self._peaks.pop(key), rss)
+
+    def _sample(self):
+        while True:
+            rss = current_rss_mb()
+            with self._lock:
+                if not self._peaks:
+                    self._thread = None
+                    return
+                for key, peak in self._peaks.items():
+                    self._peaks[key] = max(peak, rss)
+            time.sleep(self.interval)
+
+
+class StageProfile:
+    """
+    Accumulates the calls, wall time, CPU time, counts (e.g. patches or pixels)
+    and the memory of named stages. The CPU time and the memory are those of the
+    whole process, including the threads of numpy and the inference backends, so
+    stages that run at the same time share them.
+
+    The memory of a stage is the peak resident set size sampled while it runs,
+    `rss_peak_mb`, and the largest rise of it over the start of a call,
+    `rss_increase_mb`, i.e. the memory the stage allocated on top of the earlier
+    stages.
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, Dict] = {}
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._sampler = RssSampler()
+
+    def reset(self):
+        with self._lock:
+            self.stages = {}
+            self.started = time.perf_counter()
+
+    @contextmanager
+    def scope(self, name: str):
+        """
+        Prefixes the names of the stages recorded in this thread with `name`.
+        """
+        previous = getattr(self._local, "prefix", "")
+        self._local.prefix = f"{previous}{name}/"
+        try:
+            yield
+        finally:
+            self._local.prefix = previous
+
+    @contextmanager
+    def stage(self, name: str, **counts: int):
+        """
+        Records the block as one call of the stage `name`, the counts are summed
+        over the calls.
+        """
+        name = getattr(self._local, "prefix", "") + name
+        key, rss = self._sampler.start()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            peak = self._sampler.stop(key)
+            with self._lock:
+                record = self.stages.setdefault(
+                    name,
+                    {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0},
+                )
+                record["calls"] += 1
+                record["wall_seconds"] += wall
+                record["cpu_seconds"] += cpu
+                record["rss_peak_mb"] = max(record.get("rss_peak_mb", 0.0), peak)
+                record["rss_increase_mb"] = max(
+                    record.get("rss_increase_mb", 0.0), peak - rss
+                )
+                for key, value in counts.items():
+                    record[key] = record.get(key, 0) + value
+
+    def report(self) -> Dict:
+        """
+        Returns the stages as a dictionary that can be serialised to JSON, with the
+        patches per second of the stages that count patches, and the peak resident
+        set size of the process since it started.
+        """
+        with self._lock:
+            stages = {name: dict(record) for name, record in self.stages.items()}
+        for record in stages.values():
+            if "patches" in record and record["wall_seconds"] > 0:
+                record["patches_per_second"] = (
+                    record["patches"] / record["wall_seconds"]
+                )
+        return {
+            "wall_seconds": time.perf_counter() - self.started,
+            "peak_rss_mb": peak_memory_mb(),
+            "stages": stages,
+        }
+
+
+PROFILE = StageProfile()
+# The profile of the current thread if it does not record into PROFILE
+_CURRENT = threading.local()
+
+
+def current_profile() -> StageProfile:
+    """
+    Returns the profile the current thread records into, PROFILE by default.
+    """
+    return getattr(_CURRENT, "profile", PROFILE)
+
+
+@contextmanager
+def use_profile(profile: StageProfile):
+    """
+    Records the stages of the current thread into `profile` instead.
+    """
+    previous = current_profile()
+    _CURRENT.profile = profile
+    try:
+        yield profile
+    finally:
+        _CURRENT.profile = previous
+
+
+def stage(name: str, **counts: int):
+    """
+    Records a stage into the current profile, see StageProfile.stage.
+    """
+    return current_profile().stage(name, **counts)
+
+
+def scope(name: str):
+    """
+    Prefixes the stages recorded into the current profile, see StageProfile.scope.
+    """
+    return current_profile().scope(name)
@@ -0,0 +1,230 @@
+"""
+This module creates int8 quantized variants of the DSen2 ONNX models for the
+onnx_int8 inference backend. The models are calibrated on patches of a real
+Sentinel-2 product and a report compares them to the float models: the RMSE per
+band in reflectance units and the patches per second on the CPU.
+
+Usage:
+    python src/quantization.py --product /tmp/input/<image_id> --report report.json
+"""
+import argparse
+import json
+import os
+import platform
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+import onnxruntime
+from onnxruntime.quantization import (
+    CalibrationDataReader,
+    QuantFormat,
+    QuantType,
+    quantize_static,
+)
+from blockutils.logging import get_logger
+
+from patches import get_test_patches, get_test_patches60
+from backends import OnnxPredictor, onnx_model_path, quantized_model_path
+from s2_tiles_supres import Superresolution, BANDS_20M, BANDS_60M
+import supres
+
+LOGGER = get_logger(__name__)
+
+
+def representative_patches(
+    d10: np.ndarray,
+    d20: np.ndarray,
+    d60: np.ndarray = None,
+    n_patches: int = 256,
+    seed: int = 0,
+) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+    """
+    Creates the scaled model inputs of the 20m network, or of the 60m network if
+    `d60` is given, and draws two disjoint random samples of patches: one to
+    calibrate the quantization and one to evaluate it.
+
+    Returns:
+        The calibration and the evaluation patches.
+    """
+    if d60 is None:
+        test = get_test_patches(d10, d20, patch_size=128, border=8)
+    else:
+        test = get_test_patches60(d10, d20, d60, patch_size=192, border=12)
+    index = np.random.RandomState(seed).permutation(test[0].shape[0])
+    n_patches = min(n_patches, len(index) // 2)
+    calibration = np.sort(index[:n_patches])
+    evaluation = np.sort(index[n_patches : 2 * n_patches])
+    return (
+        [(p[calibration] / supres.SCALE).astype(np.float32) for p in test],
+        [(p[evaluation] / supres.SCALE).astype(np.float32) for p in test],
+    )
+
+
+class PatchCalibrationReader(CalibrationDataReader):
+    """
+    Feeds the calibration patches batch by batch to the ONNX Runtime calibrator.
+    """
+
+    def __init__(self, patches: List[np.ndarray], model_path: str, batch_size=8):
+        session = onnxruntime.InferenceSession(
+            model_path, providers=["CPUExecutionProvider"]
+        )
+        input_names = [i.name for i in session.get_inputs()]
+        self.batches = iter(
+            {
+                name: p[start : start + batch_size]
+                for name, p in zip(input_names, patches)
+            }
+            for start in range(0, patches[0].shape[0], batch_size)
+        )
+
+    def get_next(self):
+        return next(self.batches, None)
+
+
+def quantize_model(
+    model_filename: str, patches: List[np.ndarray], output_path: str = None
+) -> str:
+    """
+    Quantizes the ONNX model of a hdf5 model file to int8, weights per channel and
+    activations calibrated on the given patches.
+
+    Returns:
+        The path of the quantized model.
+    """
+    if output_path is None:
+        output_path = quantized_model_path(model_filename)
+    model_path = onnx_model_path(model_filename)
+    quantize_static(
+        model_path,
+        output_path,
+        PatchCalibrationReader(patches, model_path),
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+    )
+    LOGGER.info(f"Quantized {model_path} to {output_path}")
+    return output_path
+
+
+def _throughput(model, patches: List[np.ndarray]) -> Tuple[np.ndarray, float]:
+    model.predict([p[:1] for p in patches])  # warm up
+    start = time.perf_counter()
+    prediction = model.predict(patches)
+    return prediction, patches[0].shape[0] / (time.perf_counter() - start)
+
+
+def compare_models(
+    model_filename: str, patches: List[np.ndarray], band_names: List[str]
+) -> Dict:
+    """
+    Compares the int8 quantized model of a hdf5 model file to the float ONNX model.
+
+    Returns:
+        The RMSE per band in reflectance units (scaled by supres.SCALE) and the
+        patches per second of both models on the CPU.
+    """
+    reference, float_throughput = _throughput(
+        OnnxPredictor(onnx_model_path(model_filename)), patches
+    )
+    prediction, int8_throughput = _throughput(
+        OnnxPredictor(quantized_model_path(model_filename)), patches
+    )
+    rmse = np.sqrt(np.mean((prediction - reference) ** 2, axis=(0, 2, 3)))
+    return {
+        "model": os.path.basename(model_filename),
+        "evaluation_patches": patches[0].shape[0],
+        "rmse": {
+            band: float(value * supres.SCALE) for band, value in zip(band_names, rmse)
+        },
+        "float_patches_per_second": float_throughput,
+        "int8_patches_per_second": int8_throughput,
+    }
+
+
+def read_product(product_dir: str, size: int) -> Tuple:
+    """
+    Reads the top left `size` x `size` 10m pixels of the 10m, 20m and 60m bands of
+    a Sentinel-2 product.
+
+    Returns:
+        The 10m, 20m and 60m data and the image level of the product.
+    """
+    product_dir = product_dir.rstrip("/")
+    s_2 = Superresolution({}, input_dir=os.path.dirname(product_dir))
+    data_list, image_level = s_2.get_data(os.path.basename(product_dir))
+    ds10 = [d for d in data_list if "10m" in d][0]
+    xmin, ymin, xmax, ymax, _ = s_2.get_max_min(0, 0, size - 1, size - 1, ds10)
+    data = []
+    for res, scale in (("10m", 1), ("20m", 2), ("60m", 6)):
+        dsdesc = [d for d in data_list if res in d][0]
+        _, indices, _ = s_2.validate(dsdesc)
+        data.append(s_2.data_final(dsdesc, indices, xmin, ymin, xmax, ymax, 1, scale))
+    return data[0], data[1], data[2], image_level
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Quantize the DSen2 ONNX models to int8 and report their accuracy.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "-p",
+        "--product",
+        type=str,
+        required=True,
+        help="Folder of a Sentinel-2 product used for calibration and evaluation.",
+    )
+    parser.add_argument(
+        "-s", "--size", type=int, default=2400, help="Size of the area read in px."
+    )
+    parser.add_argument(
+        "-n",
+        "--patches",
+        type=int,
+        default=256,
+        help="Number of calibration patches, the same number is used for evaluation.",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the sampling.")
+    parser.add_argument(
+        "-r",
+        "--report",
+        type=str,
+        default="quantization_report.json",
+        help="Path of the JSON report.",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    ARGS = parse_args()
+    D10, D20, D60, IMAGE_LEVEL = read_product(ARGS.product, ARGS.size)
+    if IMAGE_LEVEL == "MSIL1C":
+        MODELS = [
+            (supres.L1C_MDL_PATH_20M_DSEN2, None, BANDS_20M),
+            (supres.L1C_MDL_PATH_60M_DSEN2, D60, BANDS_60M),
+        ]
+    else:
+        MODELS = [
+            (supres.L2A_MDL_PATH_20M_DSEN2, None, BANDS_20M),
+            (supres.L2A_MDL_PATH_60M_DSEN2, D60, BANDS_60M),
+        ]
+    REPORT = {
+        "product": os.path.basename(ARGS.product.rstrip("/")),
+        "size": ARGS.size,
+        "seed": ARGS.seed,
+        "processor": platform.processor() or platform.machine(),
+        "onnxruntime": onnxruntime.__version__,
+        "models": [],
+    }
+    for MODEL_FILENAME, DATA60, BAND_NAMES in MODELS:
+        CALIBRATION, EVALUATION = representative_patches(
+            D10, D20, DATA60, ARGS.patches, ARGS.seed
+        )
+        quantize_model(MODEL_FILENAME, CALIBRATION)
+        REPORT["models"].append(compare_models(MODEL_FILENAME, EVALUATION, BAND_NAMES))
+    with open(ARGS.report, "w") as f_p:
+        f_p.write(json.dumps(REPORT, indent=2))
+    LOGGER.info(json.dumps(REPORT, indent=2))
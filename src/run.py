@@ -1,5 +1,7 @@
 """
-This module runs the main class in s2_tiles_supres script.
+This module runs the main class in s2_tiles_supres script. With the environment
+variable SUPRES_SERVICE set, it is a thin client of the inference service, see
+service.py.
 """
 from s2_tiles_supres import Superresolution
 
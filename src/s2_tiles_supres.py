@@ -7,23 +7,30 @@ import json
 from collections import defaultdict
 import subprocess
 
-from typing import List, Tuple
+from typing import Dict, List, Optional, Tuple
 from pathlib import Path
 import glob
 import warnings
 
 import numpy as np
 from geojson import FeatureCollection
+from shapely.geometry import mapping, shape
+from shapely.ops import unary_union
 import rasterio
 from rasterio.windows import Window
 from rasterio import Affine as A
 import pyproj as proj
 from blockutils.blocks import ProcessingBlock
 from blockutils.logging import get_logger
-from blockutils.common import load_metadata
+from blockutils.common import load_metadata, load_params
 from blockutils.stac import STACQuery
 from blockutils.exceptions import UP42Error, SupportedErrors
 
+from array_output import OUTPUT_FORMATS
+from backends import BACKENDS
+from planner import plan_request
+from windows import WINDOW_MULTIPLE
+
 
 warnings.filterwarnings(action="ignore", category=FutureWarning)
 LOGGER = get_logger(__name__)
@@ -32,6 +39,31 @@ LOGGER = get_logger(__name__)
 # https://github.com/lanha/DSen2 and is distributed under the same
 # license.
 
+# Bands of the 10m, 20m and 60m subdatasets, the 20m and 60m bands in the order
+# of the network outputs
+BANDS_10M = ["B2", "B3", "B4", "B8"]
+BANDS_20M = ["B5", "B6", "B7", "B8A", "B11", "B12"]
+BANDS_60M = ["B1", "B9"]
+
+# Sidecar file of an output image with properties for its feature
+PROPERTIES_SUFFIX = ".properties.json"
+# Address of the inference service that runs the features, see service.py
+SERVICE_ENV = "SUPRES_SERVICE"
+# Seconds to wait for a job of the inference service, see submit_to_service
+SERVICE_TIMEOUT_ENV = "SUPRES_SERVICE_TIMEOUT"
+
+# Parameters that change the output pixels besides the AOI and the bands
+OUTPUT_PARAMETERS = [
+    "copy_original_bands",
+    "inference_backend",
+    "low_memory",
+    "half_precision",
+    "window_size",
+    "preview",
+    "checkpoint_size",
+    "adaptive_threshold",
+]
+
 
 class Superresolution(ProcessingBlock):
     """
@@ -56,6 +88,21 @@ class Superresolution(ProcessingBlock):
         params = STACQuery.from_dict(params, lambda x: True)
         params.set_param_if_not_exists("copy_original_bands", False)
         params.set_param_if_not_exists("clip_to_aoi", False)
+        params.set_param_if_not_exists("parallel_models", False)
+        params.set_param_if_not_exists("inference_backend", "keras")
+        params.set_param_if_not_exists("low_memory", False)
+        params.set_param_if_not_exists("half_precision", False)
+        params.set_param_if_not_exists("window_size", None)
+        params.set_param_if_not_exists("tune_window_size", False)
+        params.set_param_if_not_exists("bands", None)
+        params.set_param_if_not_exists("preview", False)
+        params.set_param_if_not_exists("checkpoint_size", None)
+        params.set_param_if_not_exists("cache_dir", None)
+        params.set_param_if_not_exists("auto_strategy", False)
+        params.set_param_if_not_exists("output_format", "gtiff")
+        params.set_param_if_not_exists("mosaic", False)
+        params.set_param_if_not_exists("time_stack", False)
+        params.set_param_if_not_exists("adaptive_threshold", None)
 
         self.params = params
 
@@ -71,21 +118,78 @@ class Superresolution(ProcessingBlock):
         """
         return cls(kwargs)
 
+    def output_filename(self, path_to_input_img: str) -> str:
+        """
+        Returns the name of the output of an input image in the output format.
+        """
+        extension = OUTPUT_FORMATS[self.params.__dict__["output_format"]]
+        return Path(path_to_input_img).stem + "_superresolution" + extension
+
+    def output_groups(self, features: List) -> List[Tuple[List, str]]:
+        """
+        Returns the input features of each output and its name: one output per
+        feature, one for all features in mosaic mode, see start_mosaic, or one per
+        tile and grid in time stack mode, see start_stack.
+        """
+        if self.params.__dict__["time_stack"]:
+            groups: Dict[Tuple, List] = {}
+            for feature in features:
+                key = self.grid_key(feature["properties"]["up42.data_path"])
+                groups.setdefault(key, []).append(feature)
+            return [
+                (
+                    group,
+                    self.output_filename(
+                        Path(group[0]["properties"]["up42.data_path"]).stem + "_stack"
+                    ),
+                )
+                for group in groups.values()
+            ]
+        if self.params.__dict__["mosaic"] and features:
+            path_to_input_img = features[0]["properties"]["up42.data_path"]
+            return [
+                (
+                    list(features),
+                    self.output_filename(Path(path_to_input_img).stem + "_mosaic"),
+                )
+            ]
+        return [
+            ([feature], self.output_filename(feature["properties"]["up42.data_path"]))
+            for feature in features
+        ]
+
     # pylint: disable-msg=too-many-locals
-    def get_final_json(self) -> FeatureCollection:
+    def get_final_json(
+        self, groups: Optional[List[Tuple[List, str]]] = None
+    ) -> FeatureCollection:
         """
         This method return an output json file.
+
+        Args:
+            groups: The output groups of the input features, see output_groups,
+                grouped from the input metadata if None.
         """
-        input_metadata = load_metadata()
+        if groups is None:
+            groups = self.output_groups(load_metadata().features)
         feature_list = []
-        for feature in input_metadata.features:
-            path_to_input_img = feature["properties"]["up42.data_path"]
-            path_to_output_img = Path(path_to_input_img).stem + "_superresolution.tif"
-            out_feature = feature.copy()
+        for group, path_to_output_img in groups:
+            out_feature = group[0].copy()
+            out_feature["properties"] = dict(out_feature["properties"])
             if self.params.__dict__["clip_to_aoi"]:
                 out_feature["geometry"] = self.params.geometry()
                 out_feature["bbox"] = self.params.bounds()
+            elif len(group) > 1:
+                footprint = unary_union([shape(f["geometry"]) for f in group])
+                out_feature["geometry"] = mapping(footprint)
+                out_feature["bbox"] = list(footprint.bounds)
             out_feature["properties"]["up42.data_path"] = path_to_output_img
+            properties_path = (
+                os.path.join(self.output_dir, path_to_output_img) + PROPERTIES_SUFFIX
+            )
+            if os.path.exists(properties_path):
+                with open(properties_path) as f_p:
+                    out_feature["properties"].update(json.load(f_p))
+                os.remove(properties_path)
             feature_list.append(out_feature)
         out_fc = FeatureCollection(feature_list)
 
@@ -111,6 +215,40 @@ class Superresolution(ProcessingBlock):
 
         return datasets, image_level
 
+    def grid_key(self, image_id) -> Tuple:
+        """
+        This method returns the processing level and the 10m grid (CRS, transform
+        and shape) of an input image. The dates of a time stack share both.
+        """
+        data_list, image_level = self.get_data(image_id)
+        ds10 = next(dsdesc for dsdesc in data_list if "10m" in dsdesc)
+        with rasterio.open(ds10) as d_s:
+            return (
+                image_level,
+                d_s.crs.to_string(),
+                tuple(d_s.transform)[:6],
+                d_s.shape,
+            )
+
+    @staticmethod
+    def sensing_time(dsdesc: str) -> str:
+        """
+        This method returns the sensing time of a product from the name of one of
+        its subdatasets, as in the product name.
+
+        Examples:
+            >>> sensing_time("SENTINEL2_L1C:/tmp/input/a/S2A_MSIL1C_20200101T100031"
+            ...     "_N0214_R022_T33UUU_20200101T120000.SAFE/MTD_MSIL1C.xml:10m:EPSG_32633")
+            '20200101T100031'
+        """
+        m_re = re.search(r"_(\d{8}T\d{6})_", dsdesc)
+        if m_re is None:
+            raise UP42Error(
+                SupportedErrors.INPUT_PARAMETERS_ERROR,
+                f"No sensing time in the product name of {dsdesc}",
+            )
+        return m_re.group(1)
+
     @staticmethod
     def get_max_min(x_1: int, y_1: int, x_2: int, y_2: int, data) -> Tuple:
         """
@@ -279,6 +417,61 @@ class Superresolution(ProcessingBlock):
                     validated_descriptions[name] = desc
         return validated_bands, validated_indices, validated_descriptions
 
+    def plan(self, aoi: Tuple, networks: List[str], n_output_bands: int) -> Dict:
+        """
+        This method plans the super-resolution of the AOI with the networks, "20m"
+        and/or "60m", before any pixel is read, see planner.plan_request.
+        """
+        options = {
+            key: self.params.__dict__[key]
+            for key in (
+                "inference_backend",
+                "low_memory",
+                "half_precision",
+                "window_size",
+            )
+        }
+        # With auto_strategy the plan chooses parallel_models
+        plan = plan_request(
+            aoi,
+            networks,
+            n_output_bands,
+            options,
+            None
+            if self.params.__dict__["auto_strategy"]
+            else self.params.__dict__["parallel_models"],
+        )
+        LOGGER.info(f"Plan: {json.dumps(plan)}")
+        return plan
+
+    @staticmethod
+    def add_output_properties(image_path: str, properties: Dict):
+        """
+        This method adds properties of an output image to its sidecar file, which
+        get_final_json attaches to the feature of the image.
+        """
+        path = image_path + PROPERTIES_SUFFIX
+        if os.path.exists(path):
+            with open(path) as f_p:
+                properties = {**json.load(f_p), **properties}
+        with open(path, "w") as f_p:
+            f_p.write(json.dumps(properties, indent=2))
+
+    def selected_bands(self, validated_bands: List[str]) -> List[str]:
+        """
+        This method returns the validated bands that are selected with the bands
+        parameter, all of them if it is not set.
+
+        Examples:
+            >>> self.params.bands = ["B5", "B11"]
+            >>> selected_bands(validated_20m_bands)
+            ['B5', 'B11']
+        """
+        bands = self.params.__dict__["bands"]
+        if bands is None:
+            return validated_bands
+        return [band for band in validated_bands if band in bands]
+
     @staticmethod
     # pylint: disable-msg=too-many-arguments
     def data_final(
@@ -322,26 +515,70 @@ class Superresolution(ProcessingBlock):
             input_fc: geojson FeatureCollection of all input images
         """
         self.assert_input_params()
-        output_jsonfile = self.get_final_json()
 
         LOGGER.info("Started process...")
-        for feature in input_fc.features:
-            LOGGER.info(f"Processing feature {feature}")
-            path_to_input_img = feature["properties"]["up42.data_path"]
-            path_to_output_img = Path(path_to_input_img).stem + "_superresolution.tif"
+        # Grouping a time stack opens every input product, so it is done once
+        groups = self.output_groups(input_fc.features)
+        for group, path_to_output_img in groups:
+            LOGGER.info(f"Processing features {group}")
+            paths_to_input_img = [f["properties"]["up42.data_path"] for f in group]
+            if os.environ.get(SERVICE_ENV):
+                self.submit_to_service(
+                    os.environ[SERVICE_ENV], paths_to_input_img, path_to_output_img
+                )
+                continue
             try:
+                # More than one input image is a mosaic or a time stack, see
+                # start_group
                 subprocess.run(
                     "python3 src/inference.py %s %s"
-                    % (path_to_input_img, path_to_output_img),
+                    % (" ".join(paths_to_input_img), path_to_output_img),
                     check=True,
                     shell=True,
                 )
             except subprocess.CalledProcessError as e:
                 raise UP42Error(SupportedErrors(e.returncode)) from e
 
+        # The properties of the outputs are only complete after the processing
+        output_jsonfile = self.get_final_json(groups)
         self.save_output_json(output_jsonfile, self.output_dir)
         return output_jsonfile
 
+    def submit_to_service(self, url: str, paths_to_input_img, path_to_output_img):
+        """
+        Runs the inference of the features of an output in the inference service
+        at `url` instead of a new process, see service.py. Waits at most the
+        seconds in SUPRES_SERVICE_TIMEOUT, by default service.DEFAULT_TIMEOUT.
+        """
+        # The service imports this module
+        # pylint: disable=import-outside-toplevel
+        from service import DEFAULT_TIMEOUT, submit_job
+
+        job = submit_job(
+            url,
+            {
+                "image_id": paths_to_input_img[0]
+                if len(paths_to_input_img) == 1
+                and not self.params.__dict__["time_stack"]
+                else paths_to_input_img,
+                "output": path_to_output_img,
+                "params": load_params(),
+                "input_dir": self.input_dir,
+                "output_dir": self.output_dir,
+            },
+            timeout=float(os.environ.get(SERVICE_TIMEOUT_ENV, DEFAULT_TIMEOUT)),
+        )
+        LOGGER.info(
+            f"Job {job['id']} {job['state']}, queued {job['queued_seconds']:.2f}s, "
+            f"ran {job['run_seconds']:.2f}s"
+        )
+        if job["exit_code"]:
+            codes = {error.value: error for error in SupportedErrors}
+            raise UP42Error(
+                codes.get(job["exit_code"], SupportedErrors.ERR_INCORRECT_ERRCODE),
+                f"Job {job['id']} failed with exit code {job['exit_code']}",
+            )
+
     @staticmethod
     def save_output_json(output_jsonfile, output_dir):
         with open(output_dir + "data.json", "w") as f_p:
@@ -372,6 +609,89 @@ class Superresolution(ProcessingBlock):
         return p_r
 
     def assert_input_params(self):
+        if self.params.__dict__["inference_backend"] not in BACKENDS:
+            raise UP42Error(
+                SupportedErrors.INPUT_PARAMETERS_ERROR,
+                f"inference_backend must be one of {sorted(BACKENDS)}.",
+            )
+        window_size = self.params.__dict__["window_size"]
+        if window_size is not None and (
+            not isinstance(window_size, int) or window_size < 128
+        ):
+            raise UP42Error(
+                SupportedErrors.INPUT_PARAMETERS_ERROR,
+                "window_size must be null or an integer of at least 128.",
+            )
+        checkpoint_size = self.params.__dict__["checkpoint_size"]
+        if checkpoint_size is not None and (
+            not isinstance(checkpoint_size, int)
+            or checkpoint_size <= 0
+            or checkpoint_size % WINDOW_MULTIPLE
+        ):
+            raise UP42Error(
+                SupportedErrors.INPUT_PARAMETERS_ERROR,
+                "checkpoint_size must be null or a positive multiple of 336.",
+            )
+        adaptive_threshold = self.params.__dict__["adaptive_threshold"]
+        if adaptive_threshold is not None and (
+            isinstance(adaptive_threshold, bool)
+            or not isinstance(adaptive_threshold, (int, float))
+            or adaptive_threshold < 0
+        ):
+            raise UP42Error(
+                SupportedErrors.INPUT_PARAMETERS_ERROR,
+                "adaptive_threshold must be null or a number of at least 0.",
+            )
+        cache_dir = self.params.__dict__["cache_dir"]
+        if cache_dir is not None and not isinstance(cache_dir, str):
+            raise UP42Error(
+                SupportedErrors.INPUT_PARAMETERS_ERROR,
+                "cache_dir must be null or the path of a directory.",
+            )
+        output_format = self.params.__dict__["output_format"]
+        if output_format not in OUTPUT_FORMATS:
+            raise UP42Error(
+                SupportedErrors.INPUT_PARAMETERS_ERROR,
+                f"output_format must be one of {sorted(OUTPUT_FORMATS)}.",
+            )
+        if self.params.__dict__["mosaic"] and cache_dir is not None:
+            raise UP42Error(
+                SupportedErrors.INPUT_PARAMETERS_ERROR,
+                "cache_dir can't be combined with mosaic.",
+            )
+        if self.params.__dict__["time_stack"] and (
+            self.params.__dict__["mosaic"] or cache_dir is not None
+        ):
+            raise UP42Error(
+                SupportedErrors.INPUT_PARAMETERS_ERROR,
+                "time_stack can't be combined with mosaic or cache_dir.",
+            )
+        if cache_dir is not None and output_format != "gtiff":
+            raise UP42Error(
+                SupportedErrors.INPUT_PARAMETERS_ERROR,
+                "cache_dir requires the output_format gtiff.",
+            )
+        bands = self.params.__dict__["bands"]
+        if bands is not None:
+            if not isinstance(bands, list) or not set(bands) <= set(
+                BANDS_10M + BANDS_20M + BANDS_60M
+            ):
+                raise UP42Error(
+                    SupportedErrors.INPUT_PARAMETERS_ERROR,
+                    'bands must be null or a list of Sentinel-2 band names, e.g. ["B5", "B11"].',
+                )
+            if not set(bands) & set(BANDS_20M + BANDS_60M):
+                raise UP42Error(
+                    SupportedErrors.INPUT_PARAMETERS_ERROR,
+                    "bands must contain at least one of the 20m or 60m bands, the 10m "
+                    "bands are only copied to the output with copy_original_bands.",
+                )
+            ignored = [band for band in bands if band in BANDS_10M]
+            if ignored and not self.params.__dict__["copy_original_bands"]:
+                LOGGER.warning(
+                    f"The 10m bands {ignored} are ignored, they are only written "
+                    "with copy_original_bands."
+                )
         if not self.params.__dict__["clip_to_aoi"]:
             if self.params.bbox or self.params.contains or self.params.intersects:
                 raise UP42Error(
@@ -0,0 +1,373 @@
+"""
+This module runs the block as a long-lived local inference service, which skips
+the startup of every run: the Python interpreter, the TensorFlow import, the
+distribution strategy and the loading of the models.
+
+The service listens on HTTP on localhost and runs the jobs in-process with
+SuperresolutionProcess, at most `workers` at a time, the others wait in a queue:
+
+    POST /jobs       {"image_id": ..., "output": ..., "params": {...},
+                      "input_dir": ..., "output_dir": ...}
+                     Queues a job and returns its id. A list of image ids is
+                     super-resolved as a mosaic or a time stack, see
+                     start_group.
+    GET  /jobs/<id>  The state of a job (queued, running, finished or failed), its
+                     exit code and its timings.
+    GET  /health     The loaded models and the number of queued and running jobs.
+
+The models of the L1C and L2A 20m and 60m networks are loaded at startup and stay
+loaded, see backends.keep_models_loaded. Run it with
+
+    python src/service.py --port 8642 --workers 1 --backend keras
+
+and set SUPRES_SERVICE=http://127.0.0.1:8642 for run.py to send its features to
+the service instead of starting a process per feature, see submit_job.
+
+Every job records its stages into its own profile, see profiling.use_profile.
+The CPU time and the memory of the stages are those of the whole process, so jobs
+that run at the same time share them. Finished and failed jobs are kept for
+FINISHED_TTL seconds for the clients to poll them.
+"""
+import argparse
+import json
+import os
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+from blockutils.logging import get_logger
+from blockutils.exceptions import SupportedErrors, UP42Error, catch_exceptions
+
+from backends import get_backend, keep_models_loaded, loaded_models
+from inference import SuperresolutionProcess
+from profiling import StageProfile, use_profile
+from s2_tiles_supres import PROPERTIES_SUFFIX
+from supres import model_filenames
+
+LOGGER = get_logger(__name__)
+
+DEFAULT_PORT = 8642
+# Seconds a client waits for a job by default, a full tile on CPU takes hours
+DEFAULT_TIMEOUT = 6 * 3600
+# Jobs that may wait for a worker, further jobs are rejected
+MAX_QUEUED = 64
+# Seconds a finished or failed job is kept for the clients to poll it
+FINISHED_TTL = 3600
+# Seconds a client waits for one response of the service
+REQUEST_TIMEOUT = 60
+
+
+class Job:
+    """
+    A super-resolution job of the service and its timings.
+    """
+
+    def __init__(self, request: Dict):
+        self.id = uuid.uuid4().hex
+        self.request = request
+        self.state = "queued"
+        self.exit_code: Optional[int] = None
+        self.submitted = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.profile: Optional[Dict] = None
+
+    def to_dict(self) -> Dict:
+        now = time.time()
+        started = self.started or now
+        return {
+            "id": self.id,
+            "state": self.state,
+            "exit_code": self.exit_code,
+            "image_id": self.request["image_id"],
+            "output": self.request["output"],
+            "queued_seconds": started - self.submitted,
+            "run_seconds": (self.finished or now) - started if self.started else 0.0,
+            "profile": self.profile,
+        }
+
+
+class JobQueue:
+    """
+    Runs the jobs with at most `workers` at the same time.
+    """
+
+    def __init__(
+        self,
+        workers: int = 1,
+        max_queued: int = MAX_QUEUED,
+        finished_ttl: float = FINISHED_TTL,
+    ):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.finished_ttl = finished_ttl
+        self.jobs: Dict[str, Job] = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def _evict(self):
+        """
+        Removes the jobs that finished more than finished_ttl seconds ago, the
+        lock must be held.
+        """
+        expired = time.time() - self.finished_ttl
+        for job_id in [
+            job.id
+            for job in self.jobs.values()
+            if job.finished is not None and job.finished < expired
+        ]:
+            del self.jobs[job_id]
+
+    def counts(self) -> Dict[str, int]:
+        with self.lock:
+            self._evict()
+            states = [job.state for job in self.jobs.values()]
+        return {state: states.count(state) for state in ("queued", "running")}
+
+    def submit(self, request: Dict) -> Optional[Job]:
+        """
+        Queues a job, returns None if the queue is full.
+        """
+        job = Job(request)
+        with self.lock:
+            self._evict()
+            queued = sum(j.state == "queued" for j in self.jobs.values())
+            if queued >= self.max_queued:
+                return None
+            self.jobs[job.id] = job
+        self.executor.submit(self.run, job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self.lock:
+            self._evict()
+            return self.jobs.get(job_id)
+
+    @staticmethod
+    @catch_exceptions(LOGGER)
+    def run_request(request: Dict, output_dir: str):
+        """
+        Runs the request of a job like a run of the block, errors exit with the
+        error code of the block.
+        """
+        process = SuperresolutionProcess(
+            request.get("params", {}),
+            output_dir=output_dir,
+            input_dir=request.get("input_dir", "/tmp/input/"),
+        )
+        # Jobs posted to the service directly are not validated by process
+        process.assert_input_params()
+        if isinstance(request["image_id"], list):
+            process.start_group(request["image_id"], request["output"])
+        else:
+            process.start(request["image_id"], request["output"])
+
+    @classmethod
+    def run(cls, job: Job):
+        request = job.request
+        output_dir = request.get("output_dir", "/tmp/output/")
+        job.started = time.time()
+        job.state = "running"
+        LOGGER.info(f"Running job {job.id} on {request['image_id']}")
+        try:
+            # Jobs that run at the same time do not mix their stages
+            with use_profile(StageProfile()):
+                cls.run_request(request, output_dir)
+            job.exit_code = 0
+        # run_request exits with the error code of the block, see catch_exceptions
+        except SystemExit as e:
+            job.exit_code = e.code if isinstance(e.code, int) and e.code else 1
+        # pylint: disable=broad-except
+        except Exception:
+            LOGGER.exception(f"Job {job.id} failed")
+            job.exit_code = 1
+        finally:
+            if job.exit_code is None:
+                job.exit_code = 1
+            properties_path = (
+                os.path.join(output_dir, str(request["output"])) + PROPERTIES_SUFFIX
+            )
+            try:
+                with open(properties_path) as f_p:
+                    job.profile = json.load(f_p).get("superresolution_profile")
+            except (OSError, ValueError):
+                pass
+            job.finished = time.time()
+            job.state = "finished" if job.exit_code == 0 else "failed"
+            LOGGER.info(
+                f"Job {job.id} {job.state} in {job.finished - job.started:.2f}s"
+            )
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """
+    The HTTP interface of the service, the queue is an attribute of the server.
+    """
+
+    def send_json(self, status: int, body: Dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    # pylint: disable=invalid-name
+    def do_GET(self):
+        queue = self.server.queue
+        if self.path == "/health":
+            self.send_json(
+                200,
+                {
+                    "workers": queue.workers,
+                    "jobs": queue.counts(),
+                    "models": [list(model) for model in loaded_models()],
+                },
+            )
+        elif self.path.startswith("/jobs/"):
+            job = queue.get(self.path[len("/jobs/") :])
+            if job is None:
+                self.send_json(404, {"error": "Unknown job"})
+            else:
+                self.send_json(200, job.to_dict())
+        else:
+            self.send_json(404, {"error": "Not found"})
+
+    # pylint: disable=invalid-name
+    def do_POST(self):
+        if self.path != "/jobs":
+            self.send_json(404, {"error": "Not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length))
+        except ValueError:
+            self.send_json(400, {"error": "Invalid JSON"})
+            return
+        if not isinstance(request, dict) or not {"image_id", "output"} <= set(request):
+            self.send_json(400, {"error": "A job needs an image_id and an output"})
+            return
+        job = self.server.queue.submit(request)
+        if job is None:
+            self.send_json(503, {"error": "Too many queued jobs"})
+        else:
+            self.send_json(202, job.to_dict())
+
+    # pylint: disable=redefined-builtin
+    def log_message(self, format, *args):
+        LOGGER.debug(format % args)
+
+
+def preload_models(backend: str = "keras"):
+    """
+    Loads the models of the L1C and L2A 20m and 60m networks for the backend and
+    keeps them loaded. Missing model files are skipped.
+    """
+    keep_models_loaded()
+    inference_backend = get_backend(backend)
+    for image_level in ("MSIL1C", "MSIL2A"):
+        for model_filename in model_filenames(image_level):
+            try:
+                inference_backend.load_model(model_filename)
+            # pylint: disable=broad-except
+            except Exception as e:
+                LOGGER.warning(f"Could not preload {model_filename}: {e}")
+
+
+def create_server(
+    host: str = "127.0.0.1", port: int = DEFAULT_PORT, workers: int = 1
+) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), ServiceHandler)
+    server.queue = JobQueue(workers)
+    return server
+
+
+def _request(
+    url: str, body: Optional[Dict] = None, timeout: float = REQUEST_TIMEOUT
+) -> Dict:
+    """
+    Sends a request to the service and returns its JSON response.
+
+    Raises:
+        UP42Error: If the service cannot be reached or does not respond within
+            `timeout` seconds.
+    """
+    data = None if body is None else json.dumps(body).encode()
+    request = urllib.request.Request(
+        url, data=data, headers={"Content-Type": "application/json"}
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        raise RuntimeError(f"{url}: {json.loads(e.read())['error']}") from e
+    except (urllib.error.URLError, socket.timeout) as e:
+        raise UP42Error(
+            SupportedErrors.API_CONNECTION_ERROR, f"{url} did not respond: {e}"
+        ) from e
+
+
+def submit_job(
+    url: str,
+    request: Dict,
+    poll_interval: float = 0.5,
+    timeout: Optional[float] = DEFAULT_TIMEOUT,
+) -> Dict:
+    """
+    Submits a job to the service at `url` and waits until it is finished or failed.
+
+    Returns:
+        The state of the job, see Job.to_dict.
+
+    Raises:
+        UP42Error: If the job is not finished or failed within `timeout` seconds,
+            or the service does not respond, see _request.
+    """
+    job = _request(url.rstrip("/") + "/jobs", request)
+    start = time.time()
+    while job["state"] in ("queued", "running"):
+        if timeout is not None and time.time() - start > timeout:
+            raise UP42Error(
+                SupportedErrors.API_CONNECTION_ERROR,
+                f"Job {job['id']} did not finish in {timeout}s",
+            )
+        time.sleep(poll_interval)
+        job = _request(url.rstrip("/") + f"/jobs/{job['id']}")
+    return job
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Jobs that run at the same time"
+    )
+    parser.add_argument(
+        "--backend", default="keras", help="Inference backend of the preloaded models"
+    )
+    args = parser.parse_args()
+
+    preload_models(args.backend)
+    server = create_server(args.host, args.port, args.workers)
+    LOGGER.info(f"Serving on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.queue.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+This module provides stand-ins for the DSen2 networks with the same inputs and
+outputs, to test and benchmark the reading, patching, batching, recomposition and
+writing without the cost of the real networks or their weights.
+
+A stand-in is selected with a model path of the form "stand-in:20m" or
+"stand-in:60m:sleep=5", see stand_in_path, in place of the hdf5 files in supres.py.
+All inference backends then load a StandInModel that returns the upsampled input
+bands, optionally sleeping the given milliseconds per patch to simulate the cost
+of the inference. The environment variable DSEN2_STAND_IN, set to the sleep in
+milliseconds, selects the stand-ins for a whole run of the block, see
+supres.model_filenames.
+
+create_keras_model writes a small Keras network with the signature of the real
+ones instead, to exercise the TensorFlow and ONNX backends, or with `resblocks`
+a network with the architecture and the cost of DSen2 and random weights, to
+calibrate the throughput of the backends, see benchmarks/calibrate_throughput.py.
+"""
+import re
+import time
+
+import numpy as np
+
+STAND_IN_PREFIX = "stand-in:"
+STAND_IN_ENV = "DSEN2_STAND_IN"
+
+# Channels of the inputs of the networks, the last ones are predicted
+INPUT_CHANNELS = {"20m": (4, 6), "60m": (4, 6, 2)}
+# Feature channels and residual blocks of the DSen2 networks
+FEATURES = 128
+RESBLOCKS = 6
+
+
+def stand_in_path(network: str, sleep_ms: float = 0) -> str:
+    """
+    Returns the model path that selects the stand-in of the "20m" or "60m" network.
+    """
+    path = f"{STAND_IN_PREFIX}{network}"
+    if sleep_ms:
+        path += f":sleep={sleep_ms:g}"
+    return path
+
+
+def is_stand_in(model_filename: str) -> bool:
+    return str(model_filename).startswith(STAND_IN_PREFIX)
+
+
+class StandInModel:
+    """
+    Predicts the upsampled input bands of the network, i.e. DSen2 without its
+    residual, with the predict interface of a Keras model.
+    """
+
+    def __init__(self, network: str, sleep_ms: float = 0):
+        self.network = network
+        self.sleep_ms = sleep_ms
+
+    # pylint: disable=unused-argument
+    def predict(self, inputs, batch_size: int = None):
+        if self.sleep_ms:
+            time.sleep(self.sleep_ms * inputs[0].shape[0] / 1000)
+        return np.array(inputs[-1], dtype=np.float32)
+
+
+def load_stand_in(model_filename: str) -> StandInModel:
+    """
+    Creates the stand-in selected by a model path, see stand_in_path.
+    """
+    match = re.fullmatch(
+        re.escape(STAND_IN_PREFIX) + r"(20m|60m)(?::sleep=([0-9.]+))?", model_filename
+    )
+    if not match:
+        raise ValueError(f"Invalid stand-in model path {model_filename}")
+    return StandInModel(match.group(1), float(match.group(2) or 0))
+
+
+def create_keras_model(
+    network: str, model_filename: str, seed: int = 0, resblocks: int = 0
+) -> str:
+    """
+    Saves a small Keras network with the channels first inputs and output of the
+    "20m" or "60m" DSen2 network to a hdf5 file: one convolution of all inputs
+    added to the upsampled input bands. With `resblocks`, the convolution is
+    replaced by the DSen2 layers: a convolution to FEATURES channels, the given
+    number of residual blocks and a convolution to the output bands.
+    """
+    # pylint: disable=import-outside-toplevel
+    import tensorflow as tf
+
+    keras = tf.keras
+    keras.utils.set_random_seed(seed)
+    inputs = [keras.Input((c, None, None)) for c in INPUT_CHANNELS[network]]
+    x = keras.layers.Concatenate(axis=1)(inputs)
+    # The real weights use channels first convolutions, which only run on GPUs
+    x = keras.layers.Permute((2, 3, 1))(x)
+    if resblocks:
+        x = keras.layers.Conv2D(FEATURES, 3, padding="same", activation="relu")(x)
+        for _ in range(resblocks):
+            y = keras.layers.Conv2D(FEATURES, 3, padding="same", activation="relu")(x)
+            y = keras.layers.Conv2D(FEATURES, 3, padding="same")(y)
+            y = keras.layers.Rescaling(0.1)(y)
+            x = keras.layers.Add()([x, y])
+    x = keras.layers.Conv2D(INPUT_CHANNELS[network][-1], 3, padding="same")(x)
+    x = keras.layers.Permute((3, 1, 2))(x)
+    x = keras.layers.Add()([x, inputs[-1]])
+    keras.Model(inputs, x).save(model_filename)
+    return model_filename
@@ -1,13 +1,24 @@
 from __future__ import division
 
 import gc
-import tensorflow as tf
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 from tqdm import tqdm
-from tensorflow import keras
 from blockutils.logging import get_logger
 
-from patches import get_test_patches, get_test_patches60, recompose_images
+from patches import (
+    get_test_patches,
+    get_test_patches60,
+    recompose_images,
+    interp_image,
+)
+from adaptive import fade_residual, predict_adaptive
+from backends import get_backend
+from profiling import current_profile, scope, stage, use_profile
+from stand_in import STAND_IN_ENV, stand_in_path
 
 LOGGER = get_logger(__name__)
 # This code is adapted from this repository
@@ -22,57 +33,377 @@ L1C_MDL_PATH_60M_DSEN2 = MDL_PATH + "l1c_dsen2_60m_s2_038_lr_1e-04.hdf5"
 L2A_MDL_PATH_20M_DSEN2 = MDL_PATH + "l2a_dsen2_20m_s2_038_lr_1e-04.hdf5"
 L2A_MDL_PATH_60M_DSEN2 = MDL_PATH + "l2a_dsen2_60m_s2_038_lr_1e-04.hdf5"
 
-STRATEGY = tf.distribute.MirroredStrategy()
+# Border of the patches discarded after prediction, in 10m pixels
+BORDER_20M = 8
+BORDER_60M = 12
+
+# Number of 10m pixels predicted at once with large windows, as many as in the
+# default batch of 32 patches of 128 x 128 px
+PREDICT_PIXELS = 32 * 128 * 128
+
+
+def window_patch_size(window_size, default, border, multiple, shape) -> int:
+    """
+    Returns the patch size to run a network on windows of `window_size` 10m pixels.
+    The networks are fully convolutional, so larger patches only waste less of
+    their border. The patch size is at least `default`, a multiple of `multiple`
+    and not larger than the mirrored image of shape `shape`.
+    """
+    if not window_size:
+        return default
+    largest = min(shape[0], shape[1]) + 2 * border
+    size = max(default, min(window_size, largest))
+    return size - size % multiple
+
+
+def predict_batch_size(window_size, patch_size):
+    """
+    Returns the number of patches predicted at once, None keeps the default of
+    the backend for the fixed patch sizes.
+    """
+    if not window_size:
+        return None
+    return max(1, PREDICT_PIXELS // patch_size ** 2)
+
+
+def model_filenames(image_level):
+    """
+    Returns the model files of the 20m and the 60m network for the image level,
+    or the stand-in model paths if the environment variable DSEN2_STAND_IN is set,
+    see stand_in.py.
+    """
+    if os.environ.get(STAND_IN_ENV) is not None:
+        sleep_ms = float(os.environ[STAND_IN_ENV] or 0)
+        return stand_in_path("20m", sleep_ms), stand_in_path("60m", sleep_ms)
+    if image_level == "MSIL1C":
+        return L1C_MDL_PATH_20M_DSEN2, L1C_MDL_PATH_60M_DSEN2
+    return L2A_MDL_PATH_20M_DSEN2, L2A_MDL_PATH_60M_DSEN2
+
 
+def _patch_options(half_precision):
+    """
+    Options of get_test_patches(60) for the low-memory modes and the divisors that
+    scale the raw and the upsampled patches per batch in _predict. The raw patches
+    stay uint16, the upsampled ones are either float32 or float16 divided by SCALE.
+    """
+    if half_precision:
+        return {"dtype": None, "interp_dtype": np.float16, "interp_scale": SCALE}, 1
+    return {"dtype": None}, SCALE
 
-def dsen2_20(d10, d20, image_level):
+
+# pylint: disable=too-many-arguments
+def dsen2_20(
+    d10,
+    d20,
+    image_level,
+    backend="keras",
+    low_memory=False,
+    half_precision=False,
+    window_size=None,
+    bordered=False,
+    adaptive_threshold=None,
+):
     # Input to the funcion must be of shape:
     #     d10: [x,y,4]      (B2, B3, B4, B8)
     #     d20: [x/2,y/4,6]  (B5, B6, B7, B8a, B11, B12)
     #     deep: specifies whether to use VDSen2 (True), or DSen2 (False)
+    #     backend: name of the inference backend, see backends.BACKENDS
+    #     low_memory: keep the patches uint16 and scale them per batch
+    #     half_precision: also hold the upsampled patches as float16
+    #     window_size: run on windows of this size instead of 128 px patches
+    #     bordered: the inputs contain the border around the output, see run_models
+    #     adaptive_threshold: only predict patches with this 10m detail, see
+    #         adaptive.py
 
-    border = 8
-    p10, p20 = get_test_patches(d10, d20, patch_size=128, border=border)
-    p10 /= SCALE
-    p20 /= SCALE
-    test = [p10, p20]
-    if image_level == "MSIL1C":
-        model_filename = L1C_MDL_PATH_20M_DSEN2
+    border = BORDER_20M
+    size = d10.shape[:2]
+    if bordered:
+        size = (size[0] - 2 * border, size[1] - 2 * border)
+    patch_size = window_patch_size(window_size, 128, border, 2, size)
+    if low_memory or half_precision:
+        options, interp_scale = _patch_options(half_precision)
+        p10, p20 = get_test_patches(
+            d10,
+            d20,
+            patch_size=patch_size,
+            border=border,
+            mirror=not bordered,
+            **options,
+        )
+        scales = [SCALE, interp_scale]
     else:
-        model_filename = L2A_MDL_PATH_20M_DSEN2
-
-    prediction = _predict(test, model_filename)
-    del test, p10, p20
-    images = recompose_images(prediction, border=border, size=d10.shape)
-    images *= SCALE
-    return images
+        p10, p20 = get_test_patches(
+            d10, d20, patch_size=patch_size, border=border, mirror=not bordered
+        )
+        p10 /= SCALE
+        p20 /= SCALE
+        scales = None
+    test = [p10, p20]
+    model_filename = model_filenames(image_level)[0]
+    del p10, p20
+    return _predict_images(
+        test,
+        model_filename,
+        backend,
+        scales,
+        predict_batch_size(window_size, patch_size),
+        border,
+        size,
+        adaptive_threshold,
+    )
 
 
-def dsen2_60(d10, d20, d60, image_level):
+# pylint: disable=too-many-arguments
+def dsen2_60(
+    d10,
+    d20,
+    d60,
+    image_level,
+    backend="keras",
+    low_memory=False,
+    half_precision=False,
+    window_size=None,
+    bordered=False,
+    adaptive_threshold=None,
+):
     # Input to the funcion must be of shape:
     #     d10: [x,y,4]      (B2, B3, B4, B8)
     #     d20: [x/2,y/4,6]  (B5, B6, B7, B8a, B11, B12)
     #     d60: [x/6,y/6,2]  (B1, B9) -- NOT B10
     #     deep: specifies whether to use VDSen2 (True), or DSen2 (False)
+    #     backend: name of the inference backend, see backends.BACKENDS
+    #     low_memory: keep the patches uint16 and scale them per batch
+    #     half_precision: also hold the upsampled patches as float16
+    #     window_size: run on windows of this size instead of 192 px patches
+    #     bordered: the inputs contain the border around the output, see run_models
+    #     adaptive_threshold: only predict patches with this 10m detail, see
+    #         adaptive.py
 
-    border = 12
-    p10, p20, p60 = get_test_patches60(d10, d20, d60, patch_size=192, border=border)
-    p10 /= SCALE
-    p20 /= SCALE
-    p60 /= SCALE
+    border = BORDER_60M
+    size = d10.shape[:2]
+    if bordered:
+        size = (size[0] - 2 * border, size[1] - 2 * border)
+    patch_size = window_patch_size(window_size, 192, border, 6, size)
+    if low_memory or half_precision:
+        options, interp_scale = _patch_options(half_precision)
+        p10, p20, p60 = get_test_patches60(
+            d10,
+            d20,
+            d60,
+            patch_size=patch_size,
+            border=border,
+            mirror=not bordered,
+            **options,
+        )
+        scales = [SCALE, interp_scale, interp_scale]
+    else:
+        p10, p20, p60 = get_test_patches60(
+            d10, d20, d60, patch_size=patch_size, border=border, mirror=not bordered
+        )
+        p10 /= SCALE
+        p20 /= SCALE
+        p60 /= SCALE
+        scales = None
 
     test = [p10, p20, p60]
-    if image_level == "MSIL1C":
-        model_filename = L1C_MDL_PATH_60M_DSEN2
-    else:
-        model_filename = L2A_MDL_PATH_60M_DSEN2
-    prediction = _predict(test, model_filename)
-    del test, p10, p20, p60
-    images = recompose_images(prediction, border=border, size=d10.shape)
-    images *= SCALE
+    model_filename = model_filenames(image_level)[1]
+    del p10, p20, p60
+    return _predict_images(
+        test,
+        model_filename,
+        backend,
+        scales,
+        predict_batch_size(window_size, patch_size),
+        border,
+        size,
+        adaptive_threshold,
+    )
+
+
+# pylint: disable=too-many-arguments
+def _predict_images(
+    test, model_filename, backend, scales, batch_size, border, size, threshold
+):
+    """
+    Predicts the patches and recomposes the image of the size of the 10m data.
+    With a threshold only the patches with detail are predicted, see adaptive.py.
+    """
+    if threshold is None:
+        prediction = _predict(test, model_filename, backend, scales, batch_size)
+        del test
+        with stage("recompose"):
+            images = recompose_images(prediction, border=border, size=size)
+            images *= SCALE
+        return images
+
+    prediction, predicted = predict_adaptive(
+        test,
+        lambda patches: _predict(patches, model_filename, backend, scales, batch_size),
+        threshold,
+        scales,
+    )
+    mixed = 0 < predicted.sum() < predicted.size
+    with stage("recompose"):
+        if mixed:
+            # The upsampled bands as an image, in the units of the prediction
+            interp = recompose_images(test[-1], border=border, size=size)
+            if scales:
+                interp /= scales[-1]
+        del test
+        shape = (predicted.size, 1) + prediction.shape[2:]
+        images = recompose_images(prediction, border=border, size=size)
+        del prediction
+        if mixed:
+            fade_residual(
+                images,
+                interp,
+                recompose_images(
+                    np.broadcast_to(
+                        predicted.astype(np.float32)[:, None, None, None], shape
+                    ),
+                    border=border,
+                    size=size,
+                )[:, :, 0],
+            )
+        images *= SCALE
     return images
 
 
+def _crop_halo(data, width):
+    """
+    Removes `width` 10m pixels from all sides of the 10m, 20m and 60m inputs.
+    """
+    if width <= 0:
+        return data
+    return [
+        d[
+            width // scale : d.shape[0] - width // scale,
+            width // scale : d.shape[1] - width // scale,
+        ]
+        for d, scale in zip(data, (1, 2, 6))
+    ]
+
+
+# pylint: disable=too-many-arguments
+def run_models(
+    d10,
+    d20,
+    d60,
+    image_level,
+    output,
+    slice_20,
+    slice_60,
+    parallel=False,
+    channels_20=None,
+    channels_60=None,
+    halo=0,
+    **kwargs,
+):
+    """
+    Super-resolves the 20m and 60m bands and writes them into the band ranges
+    `slice_20` and `slice_60` of the preallocated uint16 `output` array. Further
+    keyword arguments are passed on to dsen2_20 and dsen2_60.
+
+    `channels_20` and `channels_60` select the written network outputs, None
+    writes all of them. A network whose slice is None is not run, `d60` is only
+    needed for the 60m network.
+
+    With `halo` the inputs contain that many 10m pixels around the area of
+    `output`, at least BORDER_60M and a multiple of 6. The networks then use these
+    pixels as the border of their patches instead of mirroring the inputs.
+
+    The inputs are only read, so with `parallel` both networks run at the same
+    time in their own worker thread and share the input arrays.
+    """
+
+    def sr_60():
+        LOGGER.info("Super-resolving the 60m data into 10m bands")
+        with scope("60m"):
+            images = dsen2_60(
+                *_crop_halo((d10, d20, d60), halo - BORDER_60M),
+                image_level,
+                bordered=halo > 0,
+                **kwargs,
+            )
+            if channels_60 is not None:
+                images = images[:, :, channels_60]
+            with stage("cast"):
+                output[:, :, slice_60] = images
+
+    def sr_20():
+        LOGGER.info("Super-resolving the 20m data into 10m bands")
+        with scope("20m"):
+            images = dsen2_20(
+                *_crop_halo((d10, d20), halo - BORDER_20M),
+                image_level,
+                bordered=halo > 0,
+                **kwargs,
+            )
+            if channels_20 is not None:
+                images = images[:, :, channels_20]
+            with stage("cast"):
+                output[:, :, slice_20] = images
+
+    tasks = [
+        task
+        for task, band_range in ((sr_60, slice_60), (sr_20, slice_20))
+        if band_range is not None
+    ]
+    if parallel and len(tasks) > 1:
+        profile = current_profile()
+
+        def run_task(task):
+            # The worker threads record into the profile of the run
+            with use_profile(profile):
+                task()
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(run_task, task) for task in tasks]
+            for future in futures:
+                future.result()
+    else:
+        for task in tasks:
+            task()
+    return output
+
+
+def run_preview(
+    d10,
+    d20,
+    d60,
+    output,
+    slice_20,
+    slice_60,
+    channels_20=None,
+    channels_60=None,
+    halo=0,
+):
+    """
+    Fast preview of run_models without the networks: upsamples the 20m and 60m
+    bands bilinearly to 10m and writes them into the same band ranges of `output`.
+    See run_models for `halo`.
+    """
+    for data, band_range, channels in (
+        (d20, slice_20, channels_20),
+        (d60, slice_60, channels_60),
+    ):
+        if band_range is None:
+            continue
+        if channels is not None:
+            data = data[:, :, channels]
+        with stage("interp", pixels=d10.shape[0] * d10.shape[1]):
+            if halo:
+                images = interp_image(
+                    data,
+                    d10.shape[:2],
+                    np.empty(d10.shape[:2] + data.shape[2:], np.uint16),
+                )
+                output[:, :, band_range] = images[halo:-halo, halo:-halo]
+            else:
+                interp_image(data, d10.shape[:2], output[:, :, band_range])
+    return output
+
+
 class BatchGenerator:
     def __init__(self, dataset_list, batch_size=128):
         self.batch_size = batch_size
@@ -97,18 +428,30 @@ class BatchGenerator:
         return self
 
 
-def _predict(test, model_filename):
-    with STRATEGY.scope():
-        model = keras.models.load_model(model_filename)
+def _predict(test, model_filename, backend="keras", scales=None, batch_size=None):
+    # scales: divisors applied to each input per batch, which then also
+    # converts it to float32. None if the inputs are already scaled.
+    # batch_size: number of patches the model predicts at once
+    start = time.perf_counter()
+    with stage("load_model"):
+        model = get_backend(backend).load_model(model_filename)
+    LOGGER.info(f"Loading the model took {time.perf_counter() - start:.2f}s")
     LOGGER.info("Symbolic Model Created.")
     LOGGER.info(f"Predicting using file: {model_filename}")
     first = True
-    for a_slice in tqdm(BatchGenerator(test)):
-        if first:
-            first = False
-            prediction = model.predict(a_slice)
-        else:
-            prediction = np.append(prediction, model.predict(a_slice), axis=0)
+    with stage("predict", patches=test[0].shape[0]):
+        for a_slice in tqdm(BatchGenerator(test)):
+            if scales is not None:
+                a_slice = [
+                    np.asarray(d, np.float32) / s for d, s in zip(a_slice, scales)
+                ]
+            if first:
+                first = False
+                prediction = model.predict(a_slice, batch_size=batch_size)
+            else:
+                prediction = np.append(
+                    prediction, model.predict(a_slice, batch_size=batch_size), axis=0
+                )
 
     LOGGER.info("Predicted...")
     del model
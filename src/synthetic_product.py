@@ -0,0 +1,358 @@
+"""
+This module writes synthetic Sentinel-2 products in the SAFE layout that GDAL's
+SENTINEL2 driver and Superresolution.get_data read, for offline load tests of the
+whole block up to a full tile. The products have the L1C or L2A metadata, the
+10m, 20m and 60m band files with the band descriptions validate expects, field-like
+reflectances that are consistent across the resolutions and a nodata swath edge.
+
+By default the band files are tiled GeoTIFFs named like the JPEG2000 files of a
+real product, GDAL opens them by their content. "jp2" writes real JPEG2000 files,
+which is much slower but includes the decoding cost in the measurements.
+
+Usage:
+    python src/synthetic_product.py --input-dir /tmp/input --level MSIL2A --size 10980
+"""
+import argparse
+import json
+import os
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.warp import transform_bounds
+from blockutils.logging import get_logger
+
+LOGGER = get_logger(__name__)
+
+# Upper left corner of the synthetic tile 33UUU in EPSG:32633
+ULX, ULY = 399960, 5900040
+EPSG = 32633
+TILE = "T33UUU"
+SENSING_TIME = "20200101T100031"
+
+# Resolution and typical reflectance of the bands, the L2A products have no B10
+BANDS = {
+    "B01": (60, 1500),
+    "B02": (10, 1200),
+    "B03": (10, 1100),
+    "B04": (10, 1000),
+    "B05": (20, 1300),
+    "B06": (20, 2000),
+    "B07": (20, 2300),
+    "B08": (10, 2500),
+    "B8A": (20, 2600),
+    "B09": (60, 800),
+    "B10": (60, 30),
+    "B11": (20, 2000),
+    "B12": (20, 1300),
+}
+# Auxiliary L2A rasters and their resolutions
+L2A_AUXILIARY = {"AOT": (10, 20, 60), "WVP": (10, 20, 60), "SCL": (20, 60)}
+# Side length in 10m pixels of the fields the reflectances are constant in
+FIELD_SIZE = 30
+
+
+def product_name(level: str, sensing_time: str = SENSING_TIME) -> str:
+    return (
+        f"S2A_{level}_{sensing_time}_N0214_R022_{TILE}_{sensing_time[:8]}T120000.SAFE"
+    )
+
+
+def scene(size: int, seed: int = 0) -> np.ndarray:
+    """
+    Returns a 10m field of relative reflectances around 1: fields of FIELD_SIZE
+    pixels, a smooth gradient and pixel noise.
+    """
+    random = np.random.RandomState(seed)
+    n_fields = size // FIELD_SIZE + 1
+    fields = random.uniform(0.4, 1.6, (n_fields, n_fields)).astype(np.float32)
+    data = np.repeat(np.repeat(fields, FIELD_SIZE, 0), FIELD_SIZE, 1)[:size, :size]
+    data += np.linspace(-0.2, 0.2, size, dtype=np.float32)[np.newaxis]
+    data += random.normal(0, 0.05, (size, size)).astype(np.float32)
+    return data
+
+
+def downsample(data: np.ndarray, factor: int) -> np.ndarray:
+    """
+    Averages blocks of factor x factor pixels.
+    """
+    if factor == 1:
+        return data
+    size = data.shape[0] // factor
+    return data.reshape(size, factor, size, factor).mean(axis=(1, 3))
+
+
+def valid_mask(size: int, nodata_fraction: float) -> np.ndarray:
+    """
+    Returns the valid pixels of a tile of `size` 10m pixels whose lower right corner
+    of about `nodata_fraction` of the area lies beyond the diagonal swath edge.
+    """
+    if nodata_fraction <= 0:
+        return np.ones((size, size), dtype=bool)
+    # The triangle below i + j = limit covers nodata_fraction of the square
+    limit = 2 * size * (1 - np.sqrt(2 * min(nodata_fraction, 0.5)) / 2)
+    i, j = np.ogrid[:size, :size]
+    return i + j < limit
+
+
+def origin(offset: Tuple[int, int]) -> Tuple[int, int]:
+    """
+    Returns the upper left corner of a product `offset` (rows, columns) 10m pixels
+    from the synthetic tile.
+    """
+    return ULX + offset[1] * 10, ULY - offset[0] * 10
+
+
+def _profile(size: int, resolution: int, image_format: str, ul: Tuple) -> Dict:
+    profile = {
+        "width": size,
+        "height": size,
+        "count": 1,
+        "dtype": "uint16",
+        "crs": f"EPSG:{EPSG}",
+        "transform": from_origin(*ul, resolution, resolution),
+        "nodata": 0,
+    }
+    if image_format == "jp2":
+        profile.update(driver="JP2OpenJPEG", QUALITY=100, REVERSIBLE="YES")
+    else:
+        profile.update(driver="GTiff", tiled=True, blockxsize=512, blockysize=512)
+    return profile
+
+
+def _write_band(
+    path: str, data: np.ndarray, resolution: int, image_format: str, ul: Tuple
+):
+    with rasterio.open(
+        path + ".jp2", "w", **_profile(data.shape[0], resolution, image_format, ul)
+    ) as d_s:
+        d_s.write(data, 1)
+
+
+def _l2a_file(prefix: str, band: str, resolution: int, sensing_time: str) -> str:
+    return f"{prefix}/R{resolution}m/{TILE}_{sensing_time}_{band}_{resolution}m"
+
+
+def _band_files(level: str, granule: str, sensing_time: str) -> Dict:
+    """
+    Returns the paths without extension in the product, relative to the SAFE
+    folder, of the band files per band and resolution.
+    """
+    files = {}
+    prefix = f"GRANULE/{granule}/IMG_DATA"
+    for band, (resolution, _) in BANDS.items():
+        if level == "MSIL1C":
+            files[band, resolution] = f"{prefix}/{TILE}_{sensing_time}_{band}"
+        elif band != "B10":
+            # L2A products also have the bands at all coarser resolutions
+            for res in (r for r in (10, 20, 60) if r >= resolution):
+                files[band, res] = _l2a_file(prefix, band, res, sensing_time)
+    if level == "MSIL2A":
+        for band, resolutions in L2A_AUXILIARY.items():
+            for res in resolutions:
+                files[band, res] = _l2a_file(prefix, band, res, sensing_time)
+    return files
+
+
+def _product_metadata(level: str, name: str, granule: str, files: Dict) -> str:
+    product_level = "Level-1C" if level == "MSIL1C" else "Level-2A"
+    band_names = "".join(
+        f"<BAND_NAME>{band.replace('B0', 'B')}</BAND_NAME>"
+        for band in BANDS
+        if level == "MSIL1C" or band != "B10"
+    )
+    image_files = "\n".join(
+        f"            <IMAGE_FILE>{path}</IMAGE_FILE>" for path in files.values()
+    )
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<n1:{product_level}_User_Product xmlns:n1="https://psd-14.sentinel2.eo.esa.int/PSD/User_Product_{product_level}.xsd">
+  <n1:General_Info>
+    <Product_Info>
+      <PRODUCT_URI>{name}</PRODUCT_URI>
+      <PROCESSING_LEVEL>{product_level}</PROCESSING_LEVEL>
+      <PRODUCT_TYPE>S2MSI{level[-2:]}</PRODUCT_TYPE>
+      <Query_Options completeSingleTile="true">
+        <PRODUCT_FORMAT>SAFE_COMPACT</PRODUCT_FORMAT>
+        <Band_List>{band_names}</Band_List>
+      </Query_Options>
+      <Product_Organisation>
+        <Granule_List>
+          <Granule datastripIdentifier="DS" granuleIdentifier="{granule}" imageFormat="JPEG2000">
+{image_files}
+          </Granule>
+        </Granule_List>
+      </Product_Organisation>
+    </Product_Info>
+    <Product_Image_Characteristics>
+      <QUANTIFICATION_VALUE unit="none">10000</QUANTIFICATION_VALUE>
+    </Product_Image_Characteristics>
+  </n1:General_Info>
+</n1:{product_level}_User_Product>
+"""
+
+
+def _tile_metadata(level: str, size: int, ul: Tuple) -> str:
+    product_level = "Level-1C" if level == "MSIL1C" else "Level-2A"
+    sizes = "".join(
+        f'<Size resolution="{res}"><NROWS>{size * 10 // res}</NROWS>'
+        f"<NCOLS>{size * 10 // res}</NCOLS></Size>"
+        for res in (10, 20, 60)
+    )
+    positions = "".join(
+        f'<Geoposition resolution="{res}"><ULX>{ul[0]}</ULX><ULY>{ul[1]}</ULY>'
+        f"<XDIM>{res}</XDIM><YDIM>-{res}</YDIM></Geoposition>"
+        for res in (10, 20, 60)
+    )
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<n1:{product_level}_Tile_ID xmlns:n1="https://psd-14.sentinel2.eo.esa.int/PSD/S2_PDI_{product_level}_Tile_Metadata.xsd">
+  <n1:Geometric_Info>
+    <Tile_Geocoding metadataLevel="Brief">
+      <HORIZONTAL_CS_CODE>EPSG:{EPSG}</HORIZONTAL_CS_CODE>
+      {sizes}
+      {positions}
+    </Tile_Geocoding>
+  </n1:Geometric_Info>
+</n1:{product_level}_Tile_ID>
+"""
+
+
+# pylint: disable=too-many-arguments,too-many-locals
+def create_product(
+    input_dir: str,
+    image_id: str = "synthetic",
+    level: str = "MSIL1C",
+    size: int = 1098,
+    seed: int = 0,
+    nodata_fraction: float = 0.2,
+    image_format: str = "gtiff",
+    offset: Tuple[int, int] = (0, 0),
+    scene_size: Optional[int] = None,
+    sensing_time: str = SENSING_TIME,
+) -> str:
+    """
+    Writes a synthetic product to `input_dir`/`image_id`/<name>.SAFE, the layout
+    Superresolution.get_data expects.
+
+    Args:
+        level: "MSIL1C" or "MSIL2A".
+        size: The side length in 10m pixels, a multiple of 6, 10980 for a full tile.
+        seed: Seed of the reflectances.
+        nodata_fraction: Share of the tile beyond the swath edge, filled with 0.
+        image_format: "gtiff" or "jp2", see the module docstring.
+        offset: Offset (rows, columns) in 10m pixels from the synthetic tile, a
+            multiple of 6.
+        scene_size: The side length of the scene the product is cut from at the
+            offset, by default just large enough. Products cut from scenes of the
+            same size and seed have the same pixels where they overlap, like
+            neighbouring tiles.
+        sensing_time: The sensing time in the names of the product and its files,
+            like "20200101T100031". Products of several dates of the same tile
+            differ in it and in the seed.
+
+    Returns:
+        The path of the product metadata file.
+    """
+    if size % 6 or offset[0] % 6 or offset[1] % 6:
+        raise ValueError(f"The size {size} or offset {offset} is not a multiple of 6")
+    name = product_name(level, sensing_time)
+    granule = f"{level[3:]}_{TILE}_A023862_{sensing_time}"
+    safe_dir = os.path.join(input_dir, image_id, name)
+    files = _band_files(level, granule, sensing_time)
+    for path in files.values():
+        os.makedirs(os.path.dirname(os.path.join(safe_dir, path)), exist_ok=True)
+
+    row, col = offset
+    base = scene(scene_size or size + max(offset), seed)
+    base = base[row : row + size, col : col + size]
+    mask = valid_mask(size, nodata_fraction)
+    band_noise = np.random.RandomState(seed + 1)
+    for (band, resolution), path in files.items():
+        factor = resolution // 10
+        if band in L2A_AUXILIARY:
+            data = np.full((size // factor,) * 2, 100 if band != "SCL" else 4)
+        else:
+            scale = BANDS[band][1] * band_noise.uniform(0.9, 1.1)
+            data = downsample(base, factor) * scale
+        data = np.clip(data, 1, 20000).astype(np.uint16)
+        data[~mask[::factor, ::factor]] = 0
+        _write_band(
+            os.path.join(safe_dir, path), data, resolution, image_format, origin(offset)
+        )
+        LOGGER.info(f"Wrote {path}")
+
+    os.makedirs(os.path.join(safe_dir, "GRANULE", granule), exist_ok=True)
+    with open(os.path.join(safe_dir, "GRANULE", granule, "MTD_TL.xml"), "w") as f_p:
+        f_p.write(_tile_metadata(level, size, origin(offset)))
+    metadata_path = os.path.join(safe_dir, f"MTD_{level}.xml")
+    with open(metadata_path, "w") as f_p:
+        f_p.write(_product_metadata(level, name, granule, files))
+    return metadata_path
+
+
+def product_feature(image_id: str, size: int, offset: Tuple[int, int] = (0, 0)) -> Dict:
+    """
+    Returns the GeoJSON feature of a synthetic product, as in the data.json of the
+    block input.
+    """
+    left, top = origin(offset)
+    bounds = transform_bounds(
+        f"EPSG:{EPSG}", "EPSG:4326", left, top - size * 10, left + size * 10, top
+    )
+    xmin, ymin, xmax, ymax = bounds
+    return {
+        "type": "Feature",
+        "bbox": list(bounds),
+        "geometry": {
+            "type": "Polygon",
+            "coordinates": [
+                [[xmin, ymin], [xmax, ymin], [xmax, ymax], [xmin, ymax], [xmin, ymin]]
+            ],
+        },
+        "properties": {"up42.data_path": image_id},
+    }
+
+
+def write_data_json(input_dir: str, features: list, path: Optional[str] = None):
+    """
+    Writes the feature collection of the block input.
+    """
+    with open(path or os.path.join(input_dir, "data.json"), "w") as f_p:
+        f_p.write(json.dumps({"type": "FeatureCollection", "features": features}))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Write a synthetic Sentinel-2 product for offline load tests.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("-i", "--input-dir", type=str, default="/tmp/input/")
+    parser.add_argument("--image-id", type=str, default="synthetic")
+    parser.add_argument("-l", "--level", choices=["MSIL1C", "MSIL2A"], default="MSIL1C")
+    parser.add_argument(
+        "-s", "--size", type=int, default=1098, help="Side length in 10m px."
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--nodata-fraction",
+        type=float,
+        default=0.2,
+        help="Share of the tile beyond the swath edge.",
+    )
+    parser.add_argument("-f", "--format", choices=["gtiff", "jp2"], default="gtiff")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    ARGS = parse_args()
+    PATH = create_product(
+        ARGS.input_dir,
+        ARGS.image_id,
+        ARGS.level,
+        ARGS.size,
+        ARGS.seed,
+        ARGS.nodata_fraction,
+        ARGS.format,
+    )
+    write_data_json(ARGS.input_dir, [product_feature(ARGS.image_id, ARGS.size)])
+    LOGGER.info(f"Wrote {PATH}")
@@ -0,0 +1,296 @@
+"""
+This module splits a scene into windows that are super-resolved and written one by
+one, and keeps a checkpoint manifest of the finished windows next to the output.
+A rerun with the same inputs and parameters skips the finished windows. With a
+cache directory the windows of a previous output of the same product are reused
+when the AOI changes, e.g. when it is extended.
+
+The windows are anchored to the pixel grid of the product, so that a window has the
+same extent in every AOI that contains it. Each window is read with a halo of real
+pixels around it that the networks use as the border of their patches. The data is
+only mirrored at the border of the AOI, so a window does not depend on the other
+windows.
+"""
+import hashlib
+import json
+import os
+import shutil
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from blockutils.logging import get_logger
+
+from supres import BORDER_60M
+
+LOGGER = get_logger(__name__)
+
+# Least common multiple of the patch strides of the 20m (112 px) and the 60m
+# network (168 px), the windows start at multiples of it
+WINDOW_MULTIPLE = 336
+# Shorter windows at the border of the AOI are merged into their neighbour, this
+# is also the minimum size of the AOI, see SuperresolutionProcess.check_size
+MIN_WINDOW = 192
+# 10m pixels around a window used as the border of the patches
+HALO = BORDER_60M
+# Window size if only the cache directory is set
+DEFAULT_WINDOW_SIZE = 6 * WINDOW_MULTIPLE
+CHECKPOINT_SUFFIX = ".checkpoint.json"
+
+
+class SceneWindow(NamedTuple):
+    """
+    A rectangle in 10m pixels of the product, bottom and right exclusive.
+    """
+
+    top: int
+    left: int
+    bottom: int
+    right: int
+
+    @property
+    def height(self) -> int:
+        return self.bottom - self.top
+
+    @property
+    def width(self) -> int:
+        return self.right - self.left
+
+
+def window_ranges(start: int, stop: int, size: int) -> List[Tuple[int, int]]:
+    """
+    Splits the range [start, stop) at the multiples of `size`. Ranges at the ends
+    that are shorter than MIN_WINDOW are merged into their neighbour.
+    """
+    edges = [start] + list(range((start // size + 1) * size, stop, size)) + [stop]
+    ranges = list(zip(edges[:-1], edges[1:]))
+    if len(ranges) > 1 and ranges[0][1] - ranges[0][0] < MIN_WINDOW:
+        ranges[:2] = [(ranges[0][0], ranges[1][1])]
+    if len(ranges) > 1 and ranges[-1][1] - ranges[-1][0] < MIN_WINDOW:
+        ranges[-2:] = [(ranges[-2][0], ranges[-1][1])]
+    return ranges
+
+
+def scene_windows(aoi: Sequence[int], size: int) -> List[SceneWindow]:
+    """
+    Returns the windows that cover the AOI (xmin, ymin, xmax, ymax), see
+    Superresolution.get_max_min, row by row.
+
+    Args:
+        aoi: The AOI in 10m pixels of the product, xmax and ymax inclusive.
+        size: The window size, a multiple of WINDOW_MULTIPLE.
+    """
+    xmin, ymin, xmax, ymax = aoi
+    return [
+        SceneWindow(top, left, bottom, right)
+        for top, bottom in window_ranges(ymin, ymax + 1, size)
+        for left, right in window_ranges(xmin, xmax + 1, size)
+    ]
+
+
+def window_context(window: SceneWindow, aoi: Sequence[int]) -> SceneWindow:
+    """
+    Returns the window enlarged by the HALO and clipped to the AOI, i.e. the pixels
+    that are read to super-resolve the window.
+    """
+    xmin, ymin, xmax, ymax = aoi
+    return SceneWindow(
+        max(window.top - HALO, ymin),
+        max(window.left - HALO, xmin),
+        min(window.bottom + HALO, ymax + 1),
+        min(window.right + HALO, xmax + 1),
+    )
+
+
+def mirror_halo(
+    data: Optional[np.ndarray], window: SceneWindow, context: SceneWindow, scale: int
+) -> Optional[np.ndarray]:
+    """
+    Mirrors the data read for the context of a window at the border of the AOI,
+    where the context is smaller than the HALO.
+
+    Args:
+        data: The channels last data of the context at the resolution of `scale`.
+        scale: 1, 2 or 6 for the 10m, 20m and 60m data.
+    """
+    if data is None:
+        return None
+    padding = (
+        (HALO - (window.top - context.top)) // scale,
+        (HALO - (context.bottom - window.bottom)) // scale,
+    ), (
+        (HALO - (window.left - context.left)) // scale,
+        (HALO - (context.right - window.right)) // scale,
+    )
+    if any(any(p) for p in padding):
+        data = np.pad(data, padding + ((0, 0),), mode="symmetric")
+    return data
+
+
+def file_digest(path: str) -> Optional[str]:
+    """
+    Returns the SHA-256 of a file, None if it does not exist.
+    """
+    if not os.path.isfile(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, "rb") as f_p:
+        for chunk in iter(lambda: f_p.read(2 ** 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# pylint: disable=too-many-arguments
+def fingerprint(
+    product: str,
+    image_level: str,
+    aoi: Sequence[int],
+    bands: List[str],
+    model_files: Sequence[str],
+    parameters: Dict,
+) -> Dict:
+    """
+    Describes everything the output pixels depend on, a checkpoint is only resumed
+    if its fingerprint is the same.
+    """
+    return json.loads(
+        json.dumps(
+            {
+                "product": product,
+                "image_level": image_level,
+                "aoi": aoi,
+                "bands": bands,
+                "models": {
+                    os.path.basename(path): file_digest(path) for path in model_files
+                },
+                "parameters": parameters,
+            }
+        )
+    )
+
+
+class Checkpoint:
+    """
+    Manifest of the finished windows of an output file, written atomically after
+    every window.
+    """
+
+    def __init__(self, path: str, fingerprint_: Dict):
+        self.path = path
+        self.fingerprint = fingerprint_
+        self.finished: Dict[SceneWindow, SceneWindow] = {}
+
+    def load(self) -> bool:
+        """
+        Loads the finished windows of a previous run. Returns False if there is no
+        manifest or if it belongs to other inputs or parameters.
+        """
+        try:
+            with open(self.path) as f_p:
+                manifest = json.load(f_p)
+        except (OSError, ValueError):
+            return False
+        if manifest.get("fingerprint") != self.fingerprint:
+            LOGGER.info(f"Discarding {self.path}, the inputs or parameters changed")
+            return False
+        self.finished = {
+            SceneWindow(*w["window"]): SceneWindow(*w["context"])
+            for w in manifest["windows"]
+        }
+        return True
+
+    def start(self):
+        """
+        Starts an empty manifest.
+        """
+        self.finished = {}
+        self._save()
+
+    def add(self, window: SceneWindow, context: SceneWindow):
+        """
+        Records a window whose pixels are written to the output.
+        """
+        self.finished[window] = context
+        self._save()
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __contains__(self, window: SceneWindow) -> bool:
+        return window in self.finished
+
+    def _save(self):
+        manifest = {
+            "fingerprint": self.fingerprint,
+            "windows": [
+                {"window": list(window), "context": list(context)}
+                for window, context in self.finished.items()
+            ],
+        }
+        with open(self.path + ".tmp", "w") as f_p:
+            f_p.write(json.dumps(manifest, indent=2))
+        os.replace(self.path + ".tmp", self.path)
+
+
+class WindowCache:
+    """
+    The last output of a product for a fingerprint without the AOI, with the
+    windows it consists of and the context each window was super-resolved with.
+    A window can be reused in another AOI if it has the same extent and context
+    there, its pixels then do not differ from a recomputation.
+    """
+
+    def __init__(self, cache_dir: str, fingerprint_: Dict):
+        self.fingerprint = {k: v for k, v in fingerprint_.items() if k != "aoi"}
+        key = hashlib.sha256(
+            json.dumps(self.fingerprint, sort_keys=True).encode()
+        ).hexdigest()[:16]
+        self.image_path = os.path.join(cache_dir, key + ".tif")
+        self.manifest_path = os.path.join(cache_dir, key + ".json")
+        self.aoi: Optional[List[int]] = None
+        self.windows: Dict[SceneWindow, SceneWindow] = {}
+
+        try:
+            with open(self.manifest_path) as f_p:
+                manifest = json.load(f_p)
+        except (OSError, ValueError):
+            return
+        if manifest.get("fingerprint") == self.fingerprint and os.path.exists(
+            self.image_path
+        ):
+            self.aoi = manifest["aoi"]
+            self.windows = {
+                SceneWindow(*w["window"]): SceneWindow(*w["context"])
+                for w in manifest["windows"]
+            }
+            LOGGER.info(f"Found {len(self.windows)} cached windows of AOI {self.aoi}")
+
+    def lookup(self, window: SceneWindow, context: SceneWindow) -> Optional[Tuple]:
+        """
+        Returns the row and column offset of the window in the cached image, None
+        if it is not cached with the same context.
+        """
+        if self.windows.get(window) != context:
+            return None
+        xmin, ymin, _, _ = self.aoi
+        return window.top - ymin, window.left - xmin
+
+    def store(self, image_path: str, aoi: Sequence[int], checkpoint: Checkpoint):
+        """
+        Replaces the cached output by a finished output with the windows of its
+        checkpoint.
+        """
+        os.makedirs(os.path.dirname(self.image_path) or ".", exist_ok=True)
+        shutil.copyfile(image_path, self.image_path + ".tmp")
+        os.replace(self.image_path + ".tmp", self.image_path)
+        manifest = {
+            "fingerprint": self.fingerprint,
+            "aoi": list(aoi),
+            "windows": [
+                {"window": list(window), "context": list(context)}
+                for window, context in checkpoint.finished.items()
+            ],
+        }
+        with open(self.manifest_path + ".tmp", "w") as f_p:
+            f_p.write(json.dumps(manifest, indent=2))
+        os.replace(self.manifest_path + ".tmp", self.manifest_path)
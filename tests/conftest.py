@@ -0,0 +1,27 @@
+"""
+Fixtures shared by the test modules.
+"""
+import pytest
+
+from context import stand_in
+
+
+@pytest.fixture()
+def model_filename(tmp_path):
+    # Small stand-in with the input/output signature of the 20m network that
+    # also runs on CPU, the real weights use channels first convolutions.
+    return stand_in.create_keras_model("20m", str(tmp_path / "stand_in.hdf5"))
+
+
+@pytest.fixture()
+def dsen2_model_filenames(tmp_path):
+    # The layers of the 20m and 60m DSen2 networks with random weights, which
+    # have the cost and the sensitivity of a deep network
+    return tuple(
+        stand_in.create_keras_model(
+            network,
+            str(tmp_path / f"dsen2_{network}.hdf5"),
+            resblocks=stand_in.RESBLOCKS,
+        )
+        for network in ("20m", "60m")
+    )
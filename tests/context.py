@@ -12,3 +12,19 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../s
 from s2_tiles_supres import Superresolution
 from supres import dsen2_60, dsen2_20, BatchGenerator
 import patches
+import supres
+import backends
+import convert_models
+import quantization
+import autotune
+import windows
+import planner
+import profiling
+import band_stats
+import array_output
+import mosaic
+import adaptive
+import synthetic_product
+import stand_in
+import inference
+import service
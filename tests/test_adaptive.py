@@ -0,0 +1,94 @@
+"""
+This module include test cases for the adaptive inference on patches with detail.
+"""
+import mock
+import numpy as np
+import pytest
+from blockutils.exceptions import UP42Error
+
+from context import Superresolution, adaptive, profiling, supres, synthetic_product
+
+
+def _half_flat(size=288):
+    """
+    10m and 20m data whose left half is uniform and whose right half is noise.
+    """
+    random = np.random.RandomState(0)
+    d10 = np.full((size, size, 4), 1500, dtype=np.uint16)
+    d10[:, size // 2 :] = random.randint(500, 5000, (size, size // 2, 4))
+    d20 = random.randint(500, 5000, (size // 2, size // 2, 6)).astype(np.uint16)
+    return d10, d20
+
+
+def test_detail_scores():
+    flat = np.full((3, 4, 16, 16), 1000, dtype=np.uint16)
+    assert (adaptive.detail_scores(flat, 2000) == 0).all()
+    flat[1, :, :, ::2] = 3000
+    scores = adaptive.detail_scores(flat, 2000)
+    assert scores[1] == pytest.approx(1.0)
+    assert scores[0] == scores[2] == 0
+
+
+def test_fade_residual():
+    predicted = np.zeros((64, 64), np.float32)
+    predicted[:, 32:] = 1
+    images = np.ones((64, 64, 1), np.float32)
+    adaptive.fade_residual(images, np.zeros_like(images), predicted, transition=8)
+    row = images[0, :, 0]
+    assert (row[:32] == 0).all() and (row[41:] == 1).all()
+    # The residual rises in steps of at most 1 / 8 from the skipped pixels on
+    assert (np.diff(row) >= 0).all() and np.diff(row).max() <= 1 / 8 + 1e-6
+
+
+def test_predict_adaptive():
+    p10 = np.full((3, 4, 16, 16), 1000, dtype=np.uint16)
+    p10[1, :, :, ::2] = 3000
+    p20 = np.arange(3 * 6 * 16 * 16, dtype=np.uint16).reshape((3, 6, 16, 16))
+    predict = mock.Mock(side_effect=lambda test: np.full(test[1].shape, -1.0))
+    prediction, predicted = adaptive.predict_adaptive(
+        [p10, p20], predict, 0.5, scales=[2000, 2000]
+    )
+    assert predicted.tolist() == [False, True, False]
+    # Only the patch with detail is predicted, the others are upsampled bands
+    assert predict.call_args[0][0][0].shape[0] == 1
+    assert prediction.dtype == np.float32
+    assert (prediction[1] == -1).all()
+    np.testing.assert_allclose(prediction[[0, 2]], p20[[0, 2]] / 2000, rtol=1e-6)
+
+
+def test_dsen2_20_adaptive(model_filename):
+    d10, d20 = _half_flat()
+    with mock.patch.object(supres, "L1C_MDL_PATH_20M_DSEN2", model_filename):
+        full = supres.dsen2_20(d10, d20, "MSIL1C")
+        profiling.PROFILE.reset()
+        result = supres.dsen2_20(d10, d20, "MSIL1C", adaptive_threshold=0.1)
+        report = adaptive.adaptive_report(profiling.PROFILE.report())
+        everything = supres.dsen2_20(d10, d20, "MSIL1C", adaptive_threshold=0)
+        upsampled = supres.dsen2_20(d10, d20, "MSIL1C", adaptive_threshold=1e9)
+    np.testing.assert_array_equal(everything, full)
+    assert 0 < report["all"]["skipped_fraction"] < 1
+    # The detailed half is predicted, the uniform half is upsampled
+    np.testing.assert_allclose(result[:, 200:], full[:, 200:], rtol=1e-5)
+    np.testing.assert_allclose(result[:, :100], upsampled[:, :100], rtol=1e-5)
+    assert np.abs(full[:, :100] - upsampled[:, :100]).max() > 1
+    # No seam between the skipped and the predicted patches
+    steps = np.abs(np.diff(result - upsampled, axis=1)).max(axis=(0, 2))
+    assert steps[100:160].max() <= steps[200:].max()
+
+
+def test_evaluate(tmp_path, monkeypatch):
+    monkeypatch.setenv("DSEN2_STAND_IN", "0")
+    synthetic_product.create_product(str(tmp_path), "product", size=360)
+    results = adaptive.evaluate(
+        str(tmp_path), "product", [0, 10], output_dir=str(tmp_path)
+    )
+    assert [r["skipped"]["20m"]["skipped_fraction"] for r in results] == [0, 1]
+    assert results[1]["skipped"]["60m"]["skipped_fraction"] == 1
+    # The stand-ins predict the upsampled bands
+    assert max(results[1]["max_abs_error"].values()) <= 1
+
+
+@pytest.mark.parametrize("threshold", [-0.1, "0.01", True])
+def test_invalid_adaptive_threshold(threshold):
+    with pytest.raises(UP42Error):
+        Superresolution({"adaptive_threshold": threshold}).assert_input_params()
@@ -0,0 +1,64 @@
+"""
+This module include test cases for the Zarr and NumPy array outputs.
+"""
+import json
+
+import numpy as np
+import pytest
+import rasterio
+
+from context import array_output, inference, synthetic_product
+
+
+@pytest.fixture(scope="module")
+def product(tmp_path_factory):
+    input_dir = tmp_path_factory.mktemp("input")
+    synthetic_product.create_product(str(input_dir), "product", size=360)
+    return str(input_dir)
+
+
+@pytest.mark.parametrize("output_format", ["zarr", "npy"])
+@pytest.mark.parametrize("checkpoint_size", [None, 336])
+@pytest.mark.parametrize("stand_in", [False, True])
+def test_start_array_output(
+    product, tmp_path, monkeypatch, output_format, checkpoint_size, stand_in
+):
+    if output_format == "zarr":
+        pytest.importorskip("zarr")
+    params = {"clip_to_aoi": False, "checkpoint_size": checkpoint_size}
+    if stand_in:
+        monkeypatch.setenv("DSEN2_STAND_IN", "0")
+    else:
+        params["preview"] = True
+
+    def start(output_format):
+        process = inference.SuperresolutionProcess(
+            {**params, "output_format": output_format},
+            input_dir=product,
+            output_dir=str(tmp_path) + "/",
+        )
+        filename = process.output_filename("product")
+        process.start("product", filename)
+        return str(tmp_path / filename)
+
+    with rasterio.open(start("gtiff")) as d_s:
+        reference = np.rollaxis(d_s.read(), 0, 3)
+        profile = d_s.profile
+        descriptions = d_s.descriptions
+
+    filename = start(output_format)
+    assert filename.endswith("_superresolution." + output_format)
+    array = array_output.open_array(filename)
+    np.testing.assert_array_equal(array[:], reference)
+    if output_format == "npy":
+        with open(filename + array_output.GEOREFERENCING_SUFFIX) as f_p:
+            attributes = json.load(f_p)
+    else:
+        attributes = dict(array.attrs)
+        assert array.chunks[2] == reference.shape[2]
+    assert attributes["epsg"] == synthetic_product.EPSG
+    assert attributes["transform"] == list(profile["transform"])[:6]
+    assert attributes["bands"][0] == "B5"
+    assert attributes["descriptions"] == list(descriptions)
+    with open(filename + ".properties.json") as f_p:
+        assert json.load(f_p)["raster:bands"][0]["name"] == "B5"
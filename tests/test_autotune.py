@@ -0,0 +1,28 @@
+"""
+This module include test cases for the window size auto-tuner.
+"""
+import mock
+import numpy as np
+
+from context import autotune, supres
+
+
+def test_window_memory():
+    assert autotune.window_memory(256) == 4 * autotune.window_memory(128)
+    assert autotune.available_memory() > 0
+
+
+def test_tune_window_size(model_filename):
+    d10 = np.random.randint(0, 10000, (600, 600, 4)).astype(np.uint16)
+    d20 = np.random.randint(0, 10000, (300, 300, 6)).astype(np.uint16)
+    with mock.patch.object(supres, "L1C_MDL_PATH_20M_DSEN2", model_filename):
+        window_size = autotune.tune_window_size(
+            d10, d20, "MSIL1C", candidates=(128, 256, 1024)
+        )
+    assert window_size in (128, 256)
+
+
+def test_tune_window_size_no_memory():
+    d10 = np.zeros((600, 600, 4))
+    with mock.patch.object(autotune, "available_memory", return_value=0):
+        assert autotune.tune_window_size(d10, None, "MSIL1C") == 128
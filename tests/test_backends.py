@@ -0,0 +1,73 @@
+"""
+This module include test cases for the inference backends and the model conversion.
+"""
+import contextlib
+
+import mock
+import numpy as np
+import pytest
+import tensorflow as tf
+from blockutils.exceptions import UP42Error
+
+from context import backends, convert_models, patches
+
+
+# pylint: disable=redefined-outer-name
+@pytest.fixture()
+def test_patches():
+    p10, p20 = patches.get_test_patches(
+        np.random.rand(240, 240, 4), np.random.rand(120, 120, 6), 64, 8
+    )
+    return [p10.astype(np.float32), p20.astype(np.float32)]
+
+
+def test_get_backend():
+    assert isinstance(backends.get_backend("keras"), backends.KerasBackend)
+    assert isinstance(backends.get_backend("onnx"), backends.OnnxBackend)
+    assert isinstance(backends.get_backend("onnx_int8"), backends.OnnxInt8Backend)
+    with pytest.raises(UP42Error):
+        backends.get_backend("tensorrt")
+    with pytest.raises(TypeError):
+        backends.InferenceBackend()
+
+
+def test_precompiled_model_parity(model_filename, test_patches):
+    backend = backends.get_backend("keras")
+    hdf5_prediction = backend.load_model(model_filename).predict(test_patches)
+
+    artifact = convert_models.convert_model(model_filename)
+    assert artifact == backends.saved_model_path(model_filename)
+    model = backend.load_model(model_filename)
+    assert isinstance(model, backends.SavedModelPredictor)
+    prediction = model.predict(test_patches)
+
+    assert prediction.shape == test_patches[1].shape
+    np.testing.assert_allclose(prediction, hdf5_prediction, rtol=1e-5, atol=1e-5)
+
+
+def test_precompiled_model_multi_device(model_filename):
+    convert_models.convert_model(model_filename)
+    strategy = mock.Mock(num_replicas_in_sync=2)
+    strategy.scope.return_value = contextlib.nullcontext()
+    with mock.patch.object(backends, "get_strategy", return_value=strategy):
+        model = backends.get_backend("keras").load_model(model_filename)
+    # The Keras model distributes the batches, the SavedModel does not
+    assert not isinstance(model, backends.SavedModelPredictor)
+    strategy.scope.assert_called_once()
+
+
+def test_onnx_backend_parity(model_filename, test_patches):
+    keras_prediction = (
+        backends.get_backend("keras").load_model(model_filename).predict(test_patches)
+    )
+
+    with pytest.raises(FileNotFoundError):
+        backends.get_backend("onnx").load_model(model_filename)
+    artifact = convert_models.export_onnx(model_filename)
+    assert artifact == backends.onnx_model_path(model_filename)
+    prediction = (
+        backends.get_backend("onnx").load_model(model_filename).predict(test_patches)
+    )
+
+    assert prediction.shape == test_patches[1].shape
+    np.testing.assert_allclose(prediction, keras_prediction, rtol=1e-5, atol=1e-5)
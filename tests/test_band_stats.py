@@ -0,0 +1,43 @@
+"""
+This module include test cases for the statistics of the output bands.
+"""
+import numpy as np
+import pytest
+
+from context import band_stats
+
+
+def test_band_statistics():
+    data = np.random.randint(1, 5000, (300, 200, 2)).astype(np.uint16)
+    data[:30] = 0
+    statistics = band_stats.BandStatistics(2)
+    # The statistics of windows add up to those of the image
+    statistics.add(data[:100])
+    statistics.add(data[100:])
+    valid = data[:, :, 1][data[:, :, 1] > 0]
+    band = statistics.band(1)
+    assert band["statistics"] == pytest.approx(
+        {
+            "valid_percent": 90.0,
+            "minimum": valid.min(),
+            "maximum": valid.max(),
+            "mean": valid.mean(),
+            "stddev": valid.std(),
+        }
+    )
+    histogram = band["histogram"]
+    assert len(histogram["buckets"]) == band_stats.HISTOGRAM_BUCKETS
+    expected, _ = np.histogram(
+        valid, band_stats.HISTOGRAM_BUCKETS, (histogram["min"], histogram["max"])
+    )
+    np.testing.assert_array_equal(histogram["buckets"], expected)
+    metadata = statistics.gdal_metadata(1)
+    assert float(metadata["STATISTICS_MEAN"]) == pytest.approx(valid.mean())
+    assert statistics.properties(["B5", "B6"])[1]["name"] == "B6"
+
+
+def test_band_statistics_nodata():
+    statistics = band_stats.BandStatistics(1)
+    statistics.add(np.zeros((10, 10), np.uint16), 0)
+    assert statistics.band(0) == {"statistics": {"valid_percent": 0.0}}
+    assert "STATISTICS_MEAN" not in statistics.gdal_metadata(0)
@@ -0,0 +1,81 @@
+"""
+This module checks that the benchmark suite runs and writes its results.
+"""
+import json
+import os
+import subprocess
+import sys
+
+BENCHMARKS_DIR = os.path.join(os.path.dirname(__file__), "..", "benchmarks")
+
+
+def test_run_benchmarks(tmp_path):
+    output = str(tmp_path / "results.json")
+    subprocess.run(
+        [
+            sys.executable,
+            "run_benchmarks.py",
+            "--sizes",
+            "tiny",
+            "--repeat",
+            "1",
+            "--output",
+            output,
+        ],
+        cwd=BENCHMARKS_DIR,
+        check=True,
+    )
+    with open(output) as f_p:
+        results = json.load(f_p)
+    assert "patches.recompose_images[tiny]" in results["benchmarks"]
+    assert "inference.save_result[tiny]" in results["benchmarks"]
+    assert "backends.onnx_predict[tiny]" in results["benchmarks"]
+    for result in results["benchmarks"].values():
+        assert result["seconds"] > 0
+        assert result["size"] == 216
+
+
+def _results(seconds, memory_mb):
+    return {
+        "machine": {},
+        "benchmarks": {
+            "patches.recompose_images[tiny]": {
+                "min_seconds": seconds,
+                "peak_memory_mb": memory_mb,
+            }
+        },
+    }
+
+
+def _compare(tmp_path, baseline, current):
+    for name, results in (("baseline", baseline), ("current", current)):
+        with open(tmp_path / f"{name}.json", "w") as f_p:
+            json.dump(results, f_p)
+    return subprocess.run(
+        [
+            sys.executable,
+            "compare_benchmarks.py",
+            "--baseline",
+            str(tmp_path / "baseline.json"),
+            "--results",
+            str(tmp_path / "current.json"),
+        ],
+        cwd=BENCHMARKS_DIR,
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+        check=False,
+    )
+
+
+def test_compare_benchmarks(tmp_path):
+    # Noise below the tolerance passes
+    result = _compare(tmp_path, _results(0.1, 100.0), _results(0.12, 105.0))
+    assert result.returncode == 0
+    result = _compare(tmp_path, _results(0.1, 100.0), _results(0.1, 400.0))
+    assert result.returncode == 1
+    assert "more memory" in result.stdout
+    result = _compare(tmp_path, _results(0.1, 100.0), _results(1.0, 100.0))
+    assert result.returncode == 1
+    assert "slower" in result.stdout
+    result = _compare(tmp_path, _results(0.1, 100.0), {"benchmarks": {}})
+    assert "missing" in result.stdout
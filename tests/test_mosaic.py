@@ -0,0 +1,137 @@
+"""
+This module include test cases for the mosaic of overlapping tiles.
+"""
+import json
+
+import mock
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+from context import inference, mosaic, synthetic_product, windows
+
+
+def test_mosaic_grid():
+    transforms = [
+        from_origin(399960, 5900040, 10, 10),
+        from_origin(409920, 5890080, 10, 10),
+    ]
+    transform, shape, extents = mosaic.mosaic_grid(transforms, [(1200, 1200)] * 2)
+    assert (transform.c, transform.f) == (399960, 5900040)
+    assert shape == (2196, 2196)
+    assert extents[1] == windows.SceneWindow(996, 996, 2196, 2196)
+    with pytest.raises(ValueError):
+        mosaic.mosaic_grid(
+            [transforms[0], from_origin(400000, 5900040, 10, 10)], [(6, 6)] * 2
+        )
+    assert mosaic.mosaic_aoi(transform, shape, (400000, 5880000, 410000, 5890000)) == (
+        0,
+        1002,
+        1001,
+        2003,
+    )
+
+
+def test_assign_windows():
+    extents = [
+        windows.SceneWindow(0, 0, 1200, 1200),
+        windows.SceneWindow(0, 996, 1200, 2196),
+        windows.SceneWindow(996, 0, 2196, 1200),
+    ]
+    aoi = (0, 0, 2195, 2195)
+    assigned = mosaic.assign_windows(aoi, extents, 1008)
+    covered = np.zeros((2196, 2196), dtype=int)
+    for window, tile in assigned:
+        assert mosaic.depth(window, extents[tile]) >= 0
+        covered[window.top : window.bottom, window.left : window.right] += 1
+    # Every pixel of a tile is super-resolved once, none beyond the tiles
+    assert covered.max() == 1
+    assert covered[:1200].all() and covered[:, :1200].all()
+    assert not covered[1200:, 1200:].any()
+    report = mosaic.mosaic_report(aoi, extents, assigned)
+    assert sum(report["pixels"]) == covered.sum()
+    assert report["saved_fraction"] == pytest.approx(
+        1 - covered.sum() / (3 * 1200 ** 2)
+    )
+
+
+@pytest.fixture(name="tiles")
+def fixture_tiles(tmp_path):
+    # Two overlapping tiles cut from the same scene and the scene itself
+    for image_id, offset in (("a", (0, 0)), ("b", (0, 504))):
+        synthetic_product.create_product(
+            str(tmp_path),
+            image_id,
+            size=720,
+            nodata_fraction=0,
+            offset=offset,
+            scene_size=1224,
+        )
+    synthetic_product.create_product(
+        str(tmp_path), "scene", size=1224, nodata_fraction=0
+    )
+    return tmp_path
+
+
+def test_start_mosaic(tiles):
+    input_dir = str(tiles)
+    params = {"preview": True, "clip_to_aoi": False, "checkpoint_size": 336}
+    process = inference.SuperresolutionProcess(
+        params, input_dir=input_dir, output_dir=input_dir + "/"
+    )
+    process.start_mosaic(["a", "b"], "mosaic.tif")
+    process.start("scene", "scene.tif")
+
+    with rasterio.open(tiles / "mosaic.tif") as d_s:
+        assert d_s.shape == (720, 1224)
+        assert d_s.transform.c == synthetic_product.ULX
+        result = d_s.read()
+    with rasterio.open(tiles / "scene.tif") as d_s:
+        reference = d_s.read(window=((0, 720), (0, 1224)))
+    # Seamless apart from the mirrored halo at the bottom of the AOI
+    np.testing.assert_allclose(result[:, :700], reference[:, :700], atol=1)
+    with open(tiles / "mosaic.tif.properties.json") as f_p:
+        report = json.load(f_p)["superresolution_mosaic"]
+    assert report["tiles"] == ["a", "b"]
+    assert sum(report["pixels"]) == 720 * 1224
+    assert report["saved_fraction"] > 0.1
+
+
+def test_start_mosaic_stand_in(tiles, monkeypatch):
+    monkeypatch.setenv("DSEN2_STAND_IN", "0")
+    input_dir = str(tiles)
+    process = inference.SuperresolutionProcess(
+        {"clip_to_aoi": False, "checkpoint_size": 336},
+        input_dir=input_dir,
+        output_dir=input_dir + "/",
+    )
+    written = np.zeros((720, 1224), dtype=int)
+
+    def write_result_window(model_output, row_off, col_off, image_name, band_off=0):
+        height, width = model_output.shape[:2]
+        written[row_off : row_off + height, col_off : col_off + width] += 1
+        write(model_output, row_off, col_off, image_name, band_off)
+
+    write = inference.write_result_window
+    with mock.patch.object(inference, "write_result_window", write_result_window):
+        process.start_mosaic(["a", "b"], "mosaic.tif")
+    process.start("scene", "scene.tif")
+
+    # The overlap of the tiles, columns 504 to 720, is super-resolved once
+    assert (written == 1).all()
+    with rasterio.open(tiles / "mosaic.tif") as d_s:
+        result = d_s.read().astype(np.int32)
+    with rasterio.open(tiles / "scene.tif") as d_s:
+        reference = d_s.read(window=((0, 720), (0, 1224))).astype(np.int32)
+    # The windows of both tiles join like a single-tile run of the scene
+    assert result.any()
+    np.testing.assert_allclose(result[:, :700], reference[:, :700], atol=1)
+
+
+def test_grow_window():
+    bounds = windows.SceneWindow(0, 0, 1200, 1200)
+    grown = mosaic.grow_window(windows.SceneWindow(1152, 600, 1200, 648), bounds, 192)
+    assert grown == windows.SceneWindow(1008, 528, 1200, 720)
+    window = windows.SceneWindow(0, 0, 336, 336)
+    assert mosaic.grow_window(window, bounds, 192) == window
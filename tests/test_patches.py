@@ -86,3 +86,73 @@ def test_get_test_patches_wrong_number():
     assert r_60[0].shape == (16, 4, 192, 192)
     assert r_60[1].shape == (16, 6, 192, 192)
     assert r_60[2].shape == (16, 2, 192, 192)
+
+
+def test_get_test_patches_low_memory():
+    dset_10 = np.random.randint(0, 10000, (240, 240, 4)).astype(np.uint16)
+    dset_20 = np.random.randint(0, 10000, (120, 120, 6)).astype(np.uint16)
+    p10, p20 = patches.get_test_patches(dset_10, dset_20, 128, 8)
+    l10, l20 = patches.get_test_patches(dset_10, dset_20, 128, 8, dtype=None)
+    assert l10.dtype == np.uint16
+    assert l20.dtype == np.float32
+    np.testing.assert_array_equal(l10, p10)
+    np.testing.assert_array_equal(l20, p20)
+
+    h10, h20 = patches.get_test_patches(
+        dset_10, dset_20, 128, 8, dtype=None, interp_dtype=np.float16, interp_scale=2000
+    )
+    assert h10.dtype == np.uint16
+    assert h20.dtype == np.float16
+    # float16 keeps 11 significant bits
+    np.testing.assert_allclose(h20.astype(np.float32) * 2000, p20, rtol=2 ** -11)
+
+
+def _recompose_images_loop(a, border, size):
+    """The patch by patch recomposition that recompose_images replaced."""
+    patch_size = a.shape[2] - border * 2
+    x_tiles = int(np.ceil(size[1] / float(patch_size)))
+    y_tiles = int(np.ceil(size[0] / float(patch_size)))
+    images = np.zeros((a.shape[1], size[0], size[1]), dtype=np.float32)
+    current_patch = 0
+    for y in range(0, y_tiles):
+        ypoint = min(y * patch_size, size[0] - patch_size)
+        for x in range(0, x_tiles):
+            xpoint = min(x * patch_size, size[1] - patch_size)
+            images[:, ypoint : ypoint + patch_size, xpoint : xpoint + patch_size] = a[
+                current_patch, :, border:-border, border:-border
+            ]
+            current_patch += 1
+    return images.transpose((1, 2, 0))
+
+
+@pytest.mark.parametrize("shape", [(230, 230), (250, 346), (400, 130)])
+def test_recompose_images_parity(shape):
+    dset_10 = np.random.rand(*shape, 4).astype(np.float32)
+    dset_20 = np.random.rand(shape[0] // 2, shape[1] // 2, 6).astype(np.float32)
+    p10, _ = patches.get_test_patches(dset_10, dset_20, 128, 8, interp=False)
+    prediction = np.random.rand(*p10.shape).astype(np.float32)
+
+    r_p = patches.recompose_images(prediction, 8, shape)
+    np.testing.assert_array_equal(r_p, _recompose_images_loop(prediction, 8, shape))
+    np.testing.assert_array_equal(patches.recompose_images(p10, 8, shape), dset_10)
+
+
+def test_recompose_images_divisible_size():
+    # A size divisible by the stride makes get_patches add a duplicate last column
+    dset_10 = np.random.rand(224, 336, 4).astype(np.float32)
+    dset_20 = np.random.rand(112, 168, 6).astype(np.float32)
+    p10, _ = patches.get_test_patches(dset_10, dset_20, 128, 8, interp=False)
+    assert p10.shape[0] == 3 * 4
+    np.testing.assert_array_equal(patches.recompose_images(p10, 8, (224, 336)), dset_10)
+
+
+@pytest.mark.parametrize("pad", [2, 8])
+def test_get_patches_virtual_padding(pad):
+    dset = np.random.randint(0, 10000, (150, 97, 3)).astype(np.uint16)
+    padded = np.pad(dset, ((pad, pad), (pad, pad), (0, 0)), mode="symmetric")
+    np.testing.assert_array_equal(
+        patches.get_patches(dset, 32, pad, 5, 3, pad=pad),
+        patches.get_patches(padded, 32, pad, 5, 3),
+    )
+    # Interior windows are views into the image
+    assert np.shares_memory(patches.crop_symmetric(dset, 40, 40, 32, pad), dset)
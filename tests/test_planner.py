@@ -0,0 +1,95 @@
+"""
+This module include test cases for the pre-flight planner.
+"""
+import numpy as np
+import pytest
+
+from context import backends, planner, patches
+
+OPTIONS = {
+    "inference_backend": "keras",
+    "low_memory": False,
+    "half_precision": False,
+    "window_size": None,
+}
+
+
+def test_patch_count():
+    d10 = np.zeros((500, 440, 4), dtype=np.uint16)
+    d20 = np.zeros((250, 220, 6), dtype=np.uint16)
+    d60 = np.zeros((84, 74, 2), dtype=np.uint16)
+    test_20 = patches.get_test_patches(d10, d20, patch_size=128, border=8)
+    assert planner.patch_count(500, 440, 128, 8, 2) == test_20[0].shape[0]
+    test_60 = patches.get_test_patches60(d10, d20, d60, patch_size=192, border=12)
+    assert planner.patch_count(504, 444, 192, 12, 6) == test_60[0].shape[0]
+    assert planner.patch_count(10980, 10980, 128, 8, 2) == 99 ** 2
+
+
+def test_plan_in_memory():
+    plan = planner.plan_request(
+        (0, 0, 10979, 10979), ["20m", "60m"], 8, OPTIONS, True, memory=2 ** 40
+    )
+    assert plan["strategy"] == {"mode": "in_memory", "window_size": None, "workers": 2}
+    assert plan["networks"]["20m"]["patches"] == 99 ** 2
+    assert plan["memory_mb"]["peak"] > plan["memory_mb"]["peak_in_memory"]
+    assert plan["cpu_seconds"] > 0
+
+
+def test_plan_windowed():
+    plan = planner.plan_request(
+        (0, 0, 10979, 10979), ["20m"], 6, OPTIONS, True, memory=2 * 2 ** 30
+    )
+    assert plan["strategy"]["mode"] == "windowed"
+    assert plan["strategy"]["workers"] == 1
+    assert plan["strategy"]["window_size"] % planner.WINDOW_MULTIPLE == 0
+    assert plan["memory_mb"]["peak"] <= 2 * 1024 * planner.MEMORY_BUDGET
+    network = plan["networks"]["20m"]
+    assert network["window_patches"] >= network["patches"]
+
+
+def test_throughput_calibration(tmp_path):
+    assert set(planner.THROUGHPUT) == set(planner.NETWORKS)
+    for throughput in planner.THROUGHPUT.values():
+        assert set(throughput) == set(backends.BACKENDS)
+    assert planner.load_throughput() == planner.THROUGHPUT
+    path = tmp_path / "throughput.json"
+    path.write_text('{"throughput": {"20m": {"keras": 1000.0}}}')
+    assert planner.load_throughput(str(path)) == {"20m": {"keras": 1000.0}}
+    assert planner.backend_throughput("60m", "tflite") == min(
+        planner.THROUGHPUT["60m"].values()
+    )
+    # The CPU time of each network comes from its own calibration
+    plan = planner.plan_request((0, 0, 2015, 2015), ["20m", "60m"], 8, OPTIONS)
+    for network, network_plan in plan["networks"].items():
+        pixels = network_plan["patches"] * network_plan["patch_size"] ** 2
+        assert network_plan["cpu_seconds"] == pytest.approx(
+            pixels / planner.THROUGHPUT[network]["keras"]
+        )
+
+
+@pytest.mark.parametrize(
+    "networks, memory, cpus, workers",
+    [
+        (["20m", "60m"], 2 ** 40, 2, 2),
+        (["20m", "60m"], 2 ** 40, 1, 1),
+        (["20m"], 2 ** 40, 2, 1),
+        (["20m", "60m"], None, 2, 1),
+    ],
+)
+def test_plan_chooses_workers(networks, memory, cpus, workers):
+    aoi = (0, 0, 4000, 4000)
+    if memory is None:
+        # Both networks fit one after the other, but not at once
+        in_memory = [
+            planner.peak_memory(4001, 4001, networks, 8, OPTIONS, parallel)
+            for parallel in (False, True)
+        ]
+        memory = sum(in_memory) / 2 * planner.MB / planner.MEMORY_BUDGET
+    plan = planner.plan_request(
+        aoi, networks, 8, OPTIONS, None, memory=memory, cpus=cpus
+    )
+    assert plan["strategy"] == {
+        "mode": "in_memory",
+        "window_size": None,
+        "workers": workers,
+    }
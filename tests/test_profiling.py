@@ -0,0 +1,70 @@
+"""
+This module include test cases for the stage instrumentation.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import mock
+import numpy as np
+
+from context import profiling, supres
+
+
+def test_stage_profile():
+    profile = profiling.StageProfile()
+    with profile.stage("read", pixels=100):
+        pass
+    with profile.stage("read", pixels=50):
+        pass
+
+    def predict(network):
+        with profile.scope(network):
+            with profile.stage("predict", patches=10):
+                pass
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        list(executor.map(predict, ("20m", "60m")))
+
+    report = profile.report()
+    assert report["stages"]["read"]["calls"] == 2
+    assert report["stages"]["read"]["pixels"] == 150
+    assert report["stages"]["20m/predict"]["patches"] == 10
+    assert "patches_per_second" in report["stages"]["60m/predict"]
+    assert report["peak_rss_mb"] > 0
+    assert report["stages"]["read"]["rss_increase_mb"] >= 0
+    profile.reset()
+    assert not profile.report()["stages"]
+
+
+def test_stage_memory():
+    profile = profiling.StageProfile()
+    with profile.stage("allocate"):
+        data = np.ones(64 * 2 ** 20, dtype=np.uint8)
+        time.sleep(0.05)
+        del data
+    # A later, smaller stage does not repeat the peak of the earlier one
+    with profile.stage("small"):
+        time.sleep(0.05)
+    stages = profile.report()["stages"]
+    assert stages["allocate"]["rss_increase_mb"] > 48
+    assert stages["small"]["rss_increase_mb"] < 16
+    assert stages["small"]["rss_peak_mb"] < stages["allocate"]["rss_peak_mb"]
+
+
+def test_run_models_stages(model_filename):
+    d10 = np.random.randint(0, 10000, (200, 200, 4)).astype(np.uint16)
+    d20 = np.random.randint(0, 10000, (100, 100, 6)).astype(np.uint16)
+    profiling.PROFILE.reset()
+    output = np.zeros((200, 200, 6), dtype=np.uint16)
+    with mock.patch.object(supres, "L1C_MDL_PATH_20M_DSEN2", model_filename):
+        supres.run_models(d10, d20, None, "MSIL1C", output, slice(0, 6), None)
+    stages = profiling.PROFILE.report()["stages"]
+    assert set(stages) == {
+        "20m/patches",
+        "20m/interp",
+        "20m/load_model",
+        "20m/predict",
+        "20m/recompose",
+        "20m/cast",
+    }
+    assert stages["20m/predict"]["patches"] == 4
@@ -0,0 +1,42 @@
+"""
+This module include test cases for the int8 quantization of the ONNX models.
+"""
+import numpy as np
+
+from context import backends, convert_models, quantization
+
+
+def test_representative_patches():
+    d10 = np.random.rand(480, 480, 4)
+    d20 = np.random.rand(240, 240, 6)
+    d60 = np.random.rand(80, 80, 2)
+    calibration, evaluation = quantization.representative_patches(d10, d20, None, 8)
+    assert [p.shape for p in calibration] == [(8, 4, 128, 128), (8, 6, 128, 128)]
+    assert [p.shape for p in evaluation] == [(8, 4, 128, 128), (8, 6, 128, 128)]
+    assert calibration[0].dtype == np.float32
+
+    calibration, evaluation = quantization.representative_patches(d10, d20, d60, 100)
+    assert calibration[0].shape[0] == evaluation[0].shape[0] == 4
+    assert len(calibration) == 3
+
+
+def test_quantize_model(model_filename):
+    d10 = np.random.randint(0, 10000, (480, 480, 4))
+    d20 = np.random.randint(0, 10000, (240, 240, 6))
+    calibration, evaluation = quantization.representative_patches(d10, d20, None, 8)
+    convert_models.export_onnx(model_filename)
+
+    artifact = quantization.quantize_model(model_filename, calibration)
+    assert artifact == backends.quantized_model_path(model_filename)
+    model = backends.get_backend("onnx_int8").load_model(model_filename)
+    assert model.predict(evaluation).shape == evaluation[1].shape
+
+    report = quantization.compare_models(
+        model_filename, evaluation, quantization.BANDS_20M
+    )
+    assert report["evaluation_patches"] == 8
+    assert list(report["rmse"]) == quantization.BANDS_20M
+    # Reflectances go up to 10000, the int8 error has to stay small
+    assert max(report["rmse"].values()) < 100
+    assert report["int8_patches_per_second"] > 0
+    assert report["float_patches_per_second"] > 0
@@ -1,16 +1,20 @@
 """
 This module include multiple test cases to check the performance of the s2_tiles_supres script.
 """
+import json
 from pathlib import Path
 import tempfile
 
+import mock
+import pytest
 import rasterio
 from rasterio.transform import from_origin
 
 from fake_geo_images.fakegeoimages import FakeGeoImage
 from blockutils.logging import get_logger
+from blockutils.exceptions import UP42Error
 
-from context import Superresolution
+from context import Superresolution, inference, synthetic_product
 
 logger = get_logger(__name__)
 
@@ -263,3 +267,80 @@ def test_from_dict():
     }
     supres = Superresolution.from_dict(params)
     assert isinstance(supres, Superresolution)
+
+
+def test_selected_bands():
+    s_2 = Superresolution({"bands": ["B5", "B11", "B9"]})
+    assert s_2.selected_bands(["B5", "B6", "B7", "B8A", "B11", "B12"]) == ["B5", "B11"]
+    assert s_2.selected_bands(["B1", "B9"]) == ["B9"]
+    assert Superresolution({}).selected_bands(["B1", "B9"]) == ["B1", "B9"]
+
+
+@pytest.mark.parametrize("bands", [["B5", "B13"], ["B2", "B8"], "B5"])
+def test_assert_input_params_bands(bands):
+    s_2 = Superresolution({"bands": bands})
+    with pytest.raises(UP42Error):
+        s_2.assert_input_params()
+
+
+def test_ignored_10m_bands(tmp_path):
+    with mock.patch("s2_tiles_supres.LOGGER") as log:
+        Superresolution({"bands": ["B2", "B5"]}).assert_input_params()
+        assert "B2" in log.warning.call_args[0][0]
+        log.reset_mock()
+        Superresolution(
+            {"bands": ["B2", "B5"], "copy_original_bands": True}
+        ).assert_input_params()
+        log.warning.assert_not_called()
+
+    # Without the validation of the params, e.g. in inference.py
+    synthetic_product.create_product(str(tmp_path), "product", size=216)
+    process = inference.SuperresolutionProcess(
+        {"bands": ["B2", "B8"], "clip_to_aoi": False, "preview": True},
+        input_dir=str(tmp_path),
+        output_dir=str(tmp_path) + "/",
+    )
+    with pytest.raises(SystemExit) as exit_info:
+        process.start("product", "product.tif")
+    assert exit_info.value.code == 2
+
+
+def test_add_output_properties(tmp_path):
+    image_path = str(tmp_path / "out_superresolution.tif")
+    Superresolution.add_output_properties(image_path, {"a": 1, "b": {"c": 2}})
+    Superresolution.add_output_properties(image_path, {"b": 3})
+    with open(image_path + ".properties.json") as f_p:
+        assert json.load(f_p) == {"a": 1, "b": 3}
+
+
+def test_output_filename():
+    assert (
+        Superresolution({}).output_filename("/tmp/input/S2A_product")
+        == "S2A_product_superresolution.tif"
+    )
+    s_2 = Superresolution({"output_format": "zarr"})
+    assert s_2.output_filename("S2A_product") == "S2A_product_superresolution.zarr"
+
+
+@pytest.mark.parametrize(
+    "params", [{"output_format": "nc"}, {"output_format": "npy", "cache_dir": "c"}]
+)
+def test_assert_input_params_output_format(params):
+    with pytest.raises(UP42Error):
+        Superresolution(params).assert_input_params()
+
+
+def test_output_groups():
+    features = [
+        {"properties": {"up42.data_path": "a.SAFE"}},
+        {"properties": {"up42.data_path": "b.SAFE"}},
+    ]
+    groups = Superresolution({}).output_groups(features)
+    assert [(len(g), name) for g, name in groups] == [
+        (1, "a_superresolution.tif"),
+        (1, "b_superresolution.tif"),
+    ]
+    groups = Superresolution({"mosaic": True}).output_groups(features)
+    assert [(len(g), name) for g, name in groups] == [
+        (2, "a_mosaic_superresolution.tif")
+    ]
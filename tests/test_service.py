@@ -0,0 +1,132 @@
+"""
+This module include test cases for the inference service.
+"""
+import os
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import mock
+import pytest
+from blockutils.exceptions import UP42Error
+
+from context import backends, service, stand_in, synthetic_product
+
+
+@pytest.fixture()
+def server():
+    server = service.create_server(port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    server.queue.shutdown()
+
+
+def test_keep_models_loaded(model_filename):
+    backend = backends.get_backend("keras")
+    with mock.patch.object(backends, "_MODELS", None):
+        assert backend.load_model(model_filename) is not backend.load_model(
+            model_filename
+        )
+        backends.keep_models_loaded()
+        model = backend.load_model(model_filename)
+        assert backend.load_model(model_filename) is model
+        assert backends.loaded_models() == [("keras", model_filename)]
+
+
+def test_service_jobs(server, tmp_path):
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    synthetic_product.create_product(str(tmp_path), "product", size=216)
+    request = {
+        "image_id": "product",
+        "output": "product_superresolution.tif",
+        "params": {"clip_to_aoi": False},
+        "input_dir": str(tmp_path),
+        "output_dir": str(tmp_path) + "/",
+    }
+    with mock.patch.dict(os.environ, {stand_in.STAND_IN_ENV: "0"}):
+        job = service.submit_job(url, request, poll_interval=0.05, timeout=60)
+    assert job["state"] == "finished" and job["exit_code"] == 0
+    assert os.path.exists(tmp_path / "product_superresolution.tif")
+    assert job["run_seconds"] > 0 and job["queued_seconds"] >= 0
+    assert job["profile"]["stages"]["20m/predict"]["patches"] > 0
+
+    failed = service.submit_job(url, dict(request, image_id="missing"), 0.05, 60)
+    assert failed["state"] == "failed" and failed["exit_code"] != 0
+
+    invalid = service.submit_job(
+        url, dict(request, params={"clip_to_aoi": False, "window_size": 5}), 0.05, 60
+    )
+    assert invalid["state"] == "failed" and invalid["exit_code"] == 2
+    for params in ({"time": 5}, ["not", "a", "dict"]):
+        invalid = service.submit_job(url, dict(request, params=params), 0.05, 60)
+        assert invalid["state"] == "failed" and invalid["exit_code"] != 0
+
+    with pytest.raises(RuntimeError, match="image_id"):
+        service.submit_job(url, {"output": "x.tif"})
+    with urllib.request.urlopen(url + "/health") as response:
+        assert b'"queued": 0' in response.read()
+    with pytest.raises(urllib.error.HTTPError):
+        urllib.request.urlopen(url + "/jobs/unknown")
+
+
+def test_submit_job_timeout(server, tmp_path):
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    request = {"image_id": "missing", "output": "x.tif", "input_dir": str(tmp_path)}
+    with mock.patch.object(service.JobQueue, "run_request", lambda *_: time.sleep(1)):
+        with pytest.raises(UP42Error, match="did not finish"):
+            service.submit_job(url, request, poll_interval=0.05, timeout=0.2)
+
+
+def test_concurrent_job_profiles(tmp_path):
+    synthetic_product.create_product(str(tmp_path), "product", size=216)
+    queue = service.JobQueue(workers=2)
+    requests = [
+        {
+            "image_id": "product",
+            "output": f"product_{k}.tif",
+            "params": {"clip_to_aoi": False},
+            "input_dir": str(tmp_path),
+            "output_dir": str(tmp_path) + "/",
+        }
+        for k in range(2)
+    ]
+    # The sleeping stand-ins make the jobs overlap
+    with mock.patch.dict(os.environ, {stand_in.STAND_IN_ENV: "20"}):
+        jobs = [queue.submit(request) for request in requests]
+        queue.shutdown()
+    assert all(job.state == "finished" for job in jobs)
+    assert jobs[0].started < jobs[1].finished and jobs[1].started < jobs[0].finished
+    # Each job reports its own stages only
+    for job in jobs:
+        assert job.profile["stages"]["20m/predict"]["calls"] == 1
+    assert (
+        jobs[0].profile["stages"]["20m/predict"]["patches"]
+        == jobs[1].profile["stages"]["20m/predict"]["patches"]
+    )
+
+
+def test_finished_jobs_expire():
+    queue = service.JobQueue(finished_ttl=10)
+    finished, running = service.Job({}), service.Job({})
+    finished.finished = time.time() - 11
+    queue.jobs = {finished.id: finished, running.id: running}
+    assert queue.get(finished.id) is None
+    assert queue.get(running.id) is running
+    queue.shutdown()
+
+
+def test_request_timeout():
+    # The service accepts the connection but never responds
+    with socket.socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        listener.listen()
+        url = f"http://127.0.0.1:{listener.getsockname()[1]}/health"
+        with pytest.raises(UP42Error, match="did not respond"):
+            service._request(url, timeout=0.2)  # pylint: disable=protected-access
+    with pytest.raises(UP42Error, match="did not respond"):
+        service.submit_job(url, {"image_id": "a", "output": "a.tif"})
@@ -0,0 +1,112 @@
+"""
+This module include test cases for the time stack of several dates of a tile.
+"""
+import json
+
+import mock
+import numpy as np
+import pytest
+import rasterio
+from geojson import FeatureCollection
+from blockutils.exceptions import UP42Error
+
+from context import Superresolution, inference, synthetic_product
+
+DATES = {"a": "20200101T100031", "b": "20200111T100031"}
+
+
+@pytest.fixture(name="dates")
+def fixture_dates(tmp_path):
+    for seed, (image_id, sensing_time) in enumerate(DATES.items()):
+        synthetic_product.create_product(
+            str(tmp_path), image_id, size=360, seed=seed, sensing_time=sensing_time
+        )
+    return tmp_path
+
+
+@pytest.mark.parametrize("params", [{}, {"checkpoint_size": 336}])
+@pytest.mark.parametrize("stand_in", [False, True])
+def test_start_stack(dates, monkeypatch, params, stand_in):
+    params = {"clip_to_aoi": False, **params}
+    if stand_in:
+        monkeypatch.setenv("DSEN2_STAND_IN", "0")
+    else:
+        params["preview"] = True
+    process = inference.SuperresolutionProcess(
+        params, input_dir=str(dates), output_dir=str(dates) + "/"
+    )
+    process.start_stack(["b", "a"], "stack.tif")
+    for image_id in DATES:
+        process.start(image_id, f"{image_id}.tif")
+
+    with rasterio.open(dates / "stack.tif") as d_s:
+        stack = d_s.read()
+        descriptions = d_s.descriptions
+    # The dates are ordered by the sensing time
+    for d_i, image_id in enumerate(DATES):
+        with rasterio.open(dates / f"{image_id}.tif") as d_s:
+            n_bands = d_s.count
+            np.testing.assert_array_equal(
+                stack[d_i * n_bands : (d_i + 1) * n_bands], d_s.read()
+            )
+    assert descriptions[0] == "SR B5 (705 nm) 2020-01-01T10:00:31"
+    assert descriptions[n_bands] == "SR B5 (705 nm) 2020-01-11T10:00:31"
+    with open(dates / "stack.tif.properties.json") as f_p:
+        properties = json.load(f_p)
+    assert properties["superresolution_stack"] == {
+        "images": ["a", "b"],
+        "sensing_times": list(DATES.values()),
+    }
+    assert properties["raster:bands"][n_bands]["name"] == "B5_20200111T100031"
+
+
+def test_start_stack_array_output(dates):
+    process = inference.SuperresolutionProcess(
+        {"preview": True, "clip_to_aoi": False, "output_format": "npy"},
+        input_dir=str(dates),
+        output_dir=str(dates) + "/",
+    )
+    process.start_stack(["a", "b"], "stack.npy")
+    process.start("b", "b.npy")
+    stack = np.load(dates / "stack.npy")
+    reference = np.load(dates / "b.npy")
+    np.testing.assert_array_equal(stack[:, :, reference.shape[2] :], reference)
+
+
+def test_output_groups_stack(dates):
+    synthetic_product.create_product(str(dates), "c", size=360, offset=(0, 6))
+    features = [synthetic_product.product_feature(image_id, 360) for image_id in "abc"]
+    process = Superresolution({"time_stack": True}, input_dir=str(dates))
+    groups = process.output_groups(features)
+    assert [(len(g), name) for g, name in groups] == [
+        (2, "a_stack_superresolution.tif"),
+        (1, "c_stack_superresolution.tif"),
+    ]
+
+
+def test_process_groups_once(dates):
+    features = [synthetic_product.product_feature(image_id, 360) for image_id in "ab"]
+    process = Superresolution(
+        {"time_stack": True}, input_dir=str(dates), output_dir=str(dates)
+    )
+    grid_key = mock.Mock(wraps=process.grid_key)
+    with mock.patch.object(process, "grid_key", grid_key), mock.patch(
+        "subprocess.run"
+    ) as run:
+        output = process.process(FeatureCollection(features))
+    assert grid_key.call_count == 2
+    assert run.call_count == 1
+    assert [f["properties"]["up42.data_path"] for f in output.features] == [
+        "a_stack_superresolution.tif"
+    ]
+    assert features[0]["properties"]["up42.data_path"] == "a"
+
+
+def test_stack_params():
+    with pytest.raises(UP42Error):
+        Superresolution({"time_stack": True, "mosaic": True}).assert_input_params()
+    data_list = [
+        "SENTINEL2_L1C:/tmp/input/a/S2A_MSIL1C_20200101T100031_N0214_R022_T33UUU"
+        "_20200101T120000.SAFE/MTD_MSIL1C.xml:10m:EPSG_32633"
+    ]
+    assert Superresolution.sensing_time(data_list[0]) == "20200101T100031"
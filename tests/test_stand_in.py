@@ -0,0 +1,53 @@
+"""
+This module include test cases for the stand-in DSen2 models.
+"""
+import os
+import time
+
+import mock
+import numpy as np
+import pytest
+
+from context import backends, stand_in, supres
+
+
+def test_load_stand_in():
+    assert stand_in.stand_in_path("60m", 5) == "stand-in:60m:sleep=5"
+    model = backends.get_backend("onnx").load_model(stand_in.stand_in_path("60m", 5))
+    assert (model.network, model.sleep_ms) == ("60m", 5)
+    with pytest.raises(ValueError):
+        stand_in.load_stand_in("stand-in:10m")
+
+
+def test_stand_in_sleep():
+    patches = [np.zeros((4, 4, 128, 128)), np.ones((4, 6, 128, 128))]
+    start = time.perf_counter()
+    prediction = stand_in.StandInModel("20m", sleep_ms=50).predict(patches)
+    assert time.perf_counter() - start >= 0.2
+    np.testing.assert_array_equal(prediction, patches[1])
+
+
+def test_run_models_stand_in():
+    d10 = np.random.randint(1, 10000, (240, 240, 4)).astype(np.uint16)
+    d20 = np.random.randint(1, 10000, (120, 120, 6)).astype(np.uint16)
+    d60 = np.random.randint(1, 10000, (40, 40, 2)).astype(np.uint16)
+    output = np.zeros((240, 240, 8), dtype=np.uint16)
+    with mock.patch.dict(os.environ, {stand_in.STAND_IN_ENV: "0"}):
+        assert supres.model_filenames("MSIL2A")[1] == "stand-in:60m"
+        supres.run_models(d10, d20, d60, "MSIL2A", output, slice(0, 6), slice(6, 8))
+    # The stand-ins upsample the 20m and 60m bands
+    preview = supres.run_preview(
+        d10, d20, d60, np.zeros_like(output), slice(0, 6), slice(6, 8)
+    )
+    assert np.median(np.abs(output.astype(int) - preview)) <= 1
+
+
+def test_create_keras_model_60m(tmp_path):
+    filename = stand_in.create_keras_model("60m", str(tmp_path / "stand_in_60m.hdf5"))
+    model = backends.get_backend("keras").load_model(filename)
+    patches = [
+        np.zeros((2, 4, 192, 192), np.float32),
+        np.zeros((2, 6, 192, 192), np.float32),
+        np.ones((2, 2, 192, 192), np.float32),
+    ]
+    assert model.predict(patches).shape == (2, 2, 192, 192)
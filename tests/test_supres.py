@@ -1,10 +1,20 @@
 """
 This module include multiple test cases to check the performance of the s2_tiles_supres script.
 """
+import os
+import subprocess
+import sys
+
 import tensorflow as tf
 import numpy as np
 import pytest
-from context import dsen2_60, dsen2_20, BatchGenerator, patches
+import mock
+import rasterio
+from context import dsen2_60, dsen2_20, BatchGenerator, patches, supres
+from context import inference, synthetic_product
+
+# Maximum difference in DN of half_precision to the default mode, measured 3 DN
+HALF_PRECISION_TOLERANCE = 4
 
 DISABLE_NO_GPU = pytest.mark.skipif(
     len(tf.config.list_physical_devices("GPU")) == 0,
@@ -65,3 +75,130 @@ def test_batch_generator(d10, d20):
     assert len(a_one) == 2
     assert a_one[0].shape == (625, 4, 128, 128)
     assert a_one[1].shape == (625, 6, 128, 128)
+
+
+@pytest.mark.parametrize("parallel", [False, True])
+def test_run_models(parallel):
+    d10 = np.ones((60, 48, 4), dtype=np.uint16)
+    d20 = np.ones((30, 24, 6), dtype=np.uint16)
+    d60 = np.ones((10, 8, 2), dtype=np.uint16)
+    output = np.zeros((60, 48, 12), dtype=np.uint16)
+
+    def fake_dsen2_20(d10, d20, *_, **__):
+        return np.full(d10.shape[:2] + (d20.shape[2],), 20.6, dtype=np.float32)
+
+    def fake_dsen2_60(d10, _, d60, *__, **___):
+        return np.full(d10.shape[:2] + (d60.shape[2],), 60.6, dtype=np.float32)
+
+    with mock.patch.object(supres, "dsen2_20", fake_dsen2_20), mock.patch.object(
+        supres, "dsen2_60", fake_dsen2_60
+    ):
+        res = supres.run_models(
+            d10, d20, d60, "MSIL1C", output, slice(4, 10), slice(10, 12), parallel
+        )
+    assert res is output
+    assert (output[:, :, :4] == 0).all()
+    assert (output[:, :, 4:10] == 20).all()
+    assert (output[:, :, 10:12] == 60).all()
+
+
+def test_run_models_selected_bands():
+    d10 = np.ones((60, 48, 4), dtype=np.uint16)
+    d20 = np.ones((30, 24, 6), dtype=np.uint16)
+    output = np.zeros((60, 48, 2), dtype=np.uint16)
+
+    def fake_dsen2_20(d10, d20, *_, **__):
+        return np.arange(d20.shape[2], dtype=np.float32) * np.ones(d10.shape[:2] + (1,))
+
+    with mock.patch.object(supres, "dsen2_20", fake_dsen2_20), mock.patch.object(
+        supres, "dsen2_60", side_effect=AssertionError
+    ):
+        supres.run_models(
+            d10, d20, None, "MSIL1C", output, slice(0, 2), None, channels_20=[1, 4]
+        )
+    assert (output[:, :, 0] == 1).all()
+    assert (output[:, :, 1] == 4).all()
+
+
+def test_run_preview():
+    d10 = np.ones((60, 48, 4), dtype=np.uint16)
+    d20 = np.random.randint(0, 10000, (30, 24, 6)).astype(np.uint16)
+    d60 = np.full((10, 8, 2), 600, dtype=np.uint16)
+    output = np.zeros((60, 48, 3), dtype=np.uint16)
+
+    supres.run_preview(
+        d10, d20, d60, output, slice(0, 2), slice(2, 3), [1, 4], channels_60=[1]
+    )
+    expected = patches.interp_patches(
+        np.rollaxis(d20[:, :, [1, 4]], 2)[np.newaxis], (1, 2, 60, 48)
+    )
+    np.testing.assert_array_equal(
+        output[:, :, :2], np.rollaxis(expected[0], 0, 3).astype(np.uint16)
+    )
+    assert (output[:, :, 2] == 600).all()
+
+
+def test_tensorflow_import_is_deferred():
+    src_dir = os.path.join(os.path.dirname(__file__), "..", "src")
+    code = (
+        "import sys; import inference, supres; " "sys.exit('tensorflow' in sys.modules)"
+    )
+    subprocess.run([sys.executable, "-c", code], cwd=src_dir, check=True)
+
+
+def test_dsen2_20_low_memory(model_filename, level1):
+    d10 = np.random.randint(0, 10000, (240, 240, 4)).astype(np.uint16)
+    d20 = np.random.randint(0, 10000, (120, 120, 6)).astype(np.uint16)
+    with mock.patch.object(supres, "L1C_MDL_PATH_20M_DSEN2", model_filename):
+        res = dsen2_20(d10, d20, level1)
+        res_low = dsen2_20(d10, d20, level1, low_memory=True)
+        res_half = dsen2_20(d10, d20, level1, half_precision=True)
+    np.testing.assert_array_equal(res_low, res)
+    assert np.abs(res_half - res).max() < 10
+
+
+def test_half_precision_synthetic_product(tmp_path, dsen2_model_filenames):
+    # The measurement documented in the README, see "Optional: low-memory modes",
+    # on a smaller product
+    synthetic_product.create_product(
+        str(tmp_path), "synthetic", size=216, nodata_fraction=0
+    )
+    model_20m, model_60m = dsen2_model_filenames
+    outputs = {}
+    with mock.patch.object(
+        supres, "L1C_MDL_PATH_20M_DSEN2", model_20m
+    ), mock.patch.object(supres, "L1C_MDL_PATH_60M_DSEN2", model_60m):
+        for name, params in [("default", {}), ("half", {"half_precision": True})]:
+            inference.SuperresolutionProcess(
+                {"clip_to_aoi": False, **params},
+                input_dir=str(tmp_path),
+                output_dir=str(tmp_path) + "/",
+            ).start("synthetic", f"{name}.tif")
+            with rasterio.open(tmp_path / f"{name}.tif") as d_s:
+                outputs[name] = d_s.read().astype(np.int32)
+    difference = np.abs(outputs["half"] - outputs["default"])
+    assert difference.max() <= HALF_PRECISION_TOLERANCE
+    assert difference.mean() < 1
+
+
+def test_window_patch_size():
+    assert supres.window_patch_size(None, 192, 12, 6, (600, 600)) == 192
+    assert supres.window_patch_size(100, 192, 12, 6, (600, 600)) == 192
+    assert supres.window_patch_size(1024, 128, 8, 2, (2000, 3000)) == 1024
+    assert supres.window_patch_size(1025, 192, 12, 6, (2000, 3000)) == 1020
+    assert supres.window_patch_size(2048, 192, 12, 6, (600, 900)) == 624
+    assert supres.predict_batch_size(None, 192) is None
+    assert supres.predict_batch_size(256, 256) == 8
+    assert supres.predict_batch_size(2048, 2048) == 1
+
+
+def test_dsen2_20_large_windows(model_filename, level1):
+    d10 = np.random.randint(0, 10000, (600, 540, 4)).astype(np.uint16)
+    d20 = np.random.randint(0, 10000, (300, 270, 6)).astype(np.uint16)
+    with mock.patch.object(supres, "L1C_MDL_PATH_20M_DSEN2", model_filename):
+        res = dsen2_20(d10, d20, level1)
+        res_window = dsen2_20(d10, d20, level1, window_size=384)
+    assert res_window.shape == res.shape
+    # The stand-in model only looks at direct neighbours, so the discarded
+    # borders hide all differences between the patch geometries.
+    np.testing.assert_allclose(res_window, res, rtol=1e-4, atol=0.5)
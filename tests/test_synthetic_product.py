@@ -0,0 +1,60 @@
+"""
+This module include test cases for the synthetic Sentinel-2 products.
+"""
+import json
+
+import pytest
+import rasterio
+
+from context import synthetic_product, inference, Superresolution
+
+
+@pytest.mark.parametrize("level", ["MSIL1C", "MSIL2A"])
+def test_create_product(tmp_path, level):
+    synthetic_product.create_product(str(tmp_path), "product", level, size=360)
+    s_2 = Superresolution({}, input_dir=str(tmp_path))
+    data_list, image_level = s_2.get_data("product")
+    assert image_level == level
+    expected = (
+        ["B4", "B3", "B2", "B8"],
+        ["B5", "B6", "B7", "B8A", "B11", "B12"],
+        ["B1", "B9"],
+    )
+    for dsdesc, bands, scale in zip(data_list, expected, (1, 2, 6)):
+        validated_bands, indices, _ = s_2.validate(dsdesc)
+        assert validated_bands == bands
+        data = s_2.data_final(dsdesc, indices, 0, 0, 359, 359, 1, scale)
+        assert data.shape == (360 // scale, 360 // scale, len(bands))
+        # Valid reflectances in the upper left, the swath edge in the lower right
+        assert data[0, 0].min() > 0
+        assert data[-1, -1].max() == 0
+
+
+def test_valid_mask():
+    mask = synthetic_product.valid_mask(600, 0.2)
+    assert abs(1 - mask.mean() - 0.2) < 0.01
+    assert synthetic_product.valid_mask(60, 0).all()
+
+
+def test_start_synthetic_product(tmp_path):
+    synthetic_product.create_product(str(tmp_path), "product", size=360)
+    process = inference.SuperresolutionProcess(
+        {"preview": True, "clip_to_aoi": False},
+        input_dir=str(tmp_path),
+        output_dir=str(tmp_path) + "/",
+    )
+    process.start("product", "product_superresolution.tif")
+    with rasterio.open(tmp_path / "product_superresolution.tif") as d_s:
+        assert d_s.shape == (360, 360)
+        assert d_s.descriptions[0] == "SR B5 (705 nm)"
+        assert d_s.crs.to_epsg() == synthetic_product.EPSG
+        band = d_s.read(1)
+        tags = d_s.tags(1)
+    assert int(tags["STATISTICS_MAXIMUM"]) == band.max()
+    assert float(tags["STATISTICS_VALID_PERCENT"]) == pytest.approx(
+        100 * (band > 0).mean()
+    )
+    with open(tmp_path / "product_superresolution.tif.properties.json") as f_p:
+        raster_bands = json.load(f_p)["raster:bands"]
+    assert raster_bands[0]["name"] == "B5"
+    assert sum(raster_bands[0]["histogram"]["buckets"]) == (band > 0).sum()
@@ -0,0 +1,230 @@
+"""
+Tests of the windowed and resumable processing.
+"""
+import os
+
+import numpy as np
+import pytest
+import mock
+import rasterio
+from rasterio.transform import from_origin
+from fake_geo_images.fakegeoimages import FakeGeoImage
+
+from context import supres, synthetic_product, windows, inference
+
+
+def test_window_ranges():
+    assert windows.window_ranges(0, 1000, 336) == [(0, 336), (336, 672), (672, 1000)]
+    # The short last range is merged
+    assert windows.window_ranges(0, 700, 336) == [(0, 336), (336, 700)]
+    # Windows start at multiples of the size in the product, not in the AOI
+    assert windows.window_ranges(300, 1000, 336) == [(300, 672), (672, 1000)]
+    assert windows.window_ranges(120, 312, 336) == [(120, 312)]
+
+
+def test_scene_windows():
+    aoi = (6, 0, 701, 335)
+    res = windows.scene_windows(aoi, 336)
+    assert res == [
+        windows.SceneWindow(0, 6, 336, 336),
+        windows.SceneWindow(0, 336, 336, 702),
+    ]
+    assert windows.window_context(res[0], aoi) == windows.SceneWindow(0, 6, 336, 348)
+    assert windows.window_context(res[1], aoi) == windows.SceneWindow(0, 324, 336, 702)
+
+
+def test_windows_match_full_scene(model_filename):
+    d10 = np.random.randint(0, 10000, (700, 706, 4)).astype(np.uint16)
+    d20 = np.random.randint(0, 10000, (350, 353, 6)).astype(np.uint16)
+    aoi = (0, 0, 705, 699)
+    with mock.patch.object(supres, "L1C_MDL_PATH_20M_DSEN2", model_filename):
+        full = np.zeros((700, 706, 6), dtype=np.uint16)
+        supres.run_models(d10, d20, None, "MSIL1C", full, slice(0, 6), None)
+        for window in windows.scene_windows(aoi, 336):
+            context = windows.window_context(window, aoi)
+            inputs = [
+                windows.mirror_halo(
+                    d[
+                        context.top // scale : context.bottom // scale,
+                        context.left // scale : context.right // scale,
+                    ],
+                    window,
+                    context,
+                    scale,
+                )
+                for d, scale in ((d10, 1), (d20, 2))
+            ]
+            output = np.zeros((window.height, window.width, 6), dtype=np.uint16)
+            supres.run_models(
+                *inputs, None, "MSIL1C", output, slice(0, 6), None, halo=windows.HALO
+            )
+            np.testing.assert_array_equal(
+                output, full[window.top : window.bottom, window.left : window.right]
+            )
+
+
+def test_checkpoint(tmp_path):
+    path = str(tmp_path / "out.tif.checkpoint.json")
+    window = windows.SceneWindow(0, 0, 336, 336)
+    checkpoint = windows.Checkpoint(path, {"aoi": [0, 0, 699, 699]})
+    assert not checkpoint.load()
+    checkpoint.start()
+    checkpoint.add(window, windows.SceneWindow(0, 0, 348, 348))
+
+    resumed = windows.Checkpoint(path, {"aoi": [0, 0, 699, 699]})
+    assert resumed.load()
+    assert window in resumed
+    assert not windows.Checkpoint(path, {"aoi": [0, 0, 1019, 699]}).load()
+    resumed.remove()
+    assert not os.path.exists(path)
+
+
+@pytest.fixture()
+def product(tmp_path):
+    inputs = []
+    for size, bands, scale in (
+        (720, ["B4", "B3", "B2", "B8"], 1),
+        (360, ["B5", "B6", "B7", "B8A", "B11", "B12"], 2),
+        (120, ["B1", "B9"], 6),
+    ):
+        image, _ = FakeGeoImage(size, size, len(bands), "uint16", tmp_path).create(
+            seed=scale,
+            transform=from_origin(1470996, 6914001, 10.0 * scale, 10.0 * scale),
+            file_name=f"{scale}.tif",
+            band_desc=[f"{b}, central wavelength 500 nm" for b in bands],
+        )
+        inputs.append((str(image), list(range(len(bands))), scale))
+    descriptions = {f"B{b}": f"B{b} (500 nm)" for b in "123456789"}
+    descriptions.update({b: f"{b} (500 nm)" for b in ("B8A", "B11", "B12")})
+    return inputs, descriptions
+
+
+def test_process_windows_resume(product, tmp_path):
+    inputs, descriptions = product
+    bands = ["B5", "B6", "B7", "B8A", "B11", "B12", "B1", "B9"]
+    selection = ([], (slice(0, 6), slice(6, 8)), {})
+    process = inference.SuperresolutionProcess(
+        {"preview": True, "checkpoint_size": 336}, output_dir=str(tmp_path)
+    )
+
+    def process_windows(filename):
+        process.process_windows(
+            "product",
+            filename,
+            "MSIL1C",
+            (0, 0, 719, 719),
+            inputs,
+            (bands, descriptions),
+            selection,
+            {},
+            336,
+        )
+        with rasterio.open(filename) as d_s:
+            return d_s.read(), d_s.descriptions, d_s.tags(1)
+
+    reference, reference_desc, reference_tags = process_windows(
+        str(tmp_path / "reference.tif")
+    )
+    assert reference_desc[0] == "SR B5 (500 nm)"
+    valid = reference[0][reference[0] > 0]
+    assert float(reference_tags["STATISTICS_MEAN"]) == pytest.approx(valid.mean())
+
+    filename = str(tmp_path / "resumed.tif")
+    write_result_window = inference.write_result_window
+    written = []
+
+    def preempted(*args):
+        if len(written) == 2:
+            raise KeyboardInterrupt
+        written.append(args[1:3])
+        write_result_window(*args)
+
+    with mock.patch.object(inference, "write_result_window", preempted):
+        with pytest.raises(KeyboardInterrupt):
+            process_windows(filename)
+    assert os.path.exists(filename + windows.CHECKPOINT_SUFFIX)
+
+    with mock.patch.object(inference, "write_result_window") as write:
+        write.side_effect = write_result_window
+        resumed, _, resumed_tags = process_windows(filename)
+    # Only the two remaining of the four windows are processed
+    assert write.call_count == 2
+    np.testing.assert_array_equal(resumed, reference)
+    # The statistics include the windows written before the interruption
+    assert resumed_tags == reference_tags
+    assert not os.path.exists(filename + windows.CHECKPOINT_SUFFIX)
+
+
+def test_process_windows_cache(product, tmp_path):
+    inputs, descriptions = product
+    bands = ["B5", "B6", "B7", "B8A", "B11", "B12"]
+    selection = ([], (slice(0, 6), None), {})
+    process = inference.SuperresolutionProcess(
+        {"preview": True, "checkpoint_size": 336, "cache_dir": str(tmp_path / "c")},
+        output_dir=str(tmp_path),
+    )
+
+    def process_windows(filename, aoi):
+        with mock.patch.object(
+            process, "super_resolve", wraps=process.super_resolve
+        ) as super_resolve:
+            process.process_windows(
+                "product",
+                filename,
+                "MSIL1C",
+                aoi,
+                inputs[:2] + [None],
+                (bands, descriptions),
+                selection,
+                {},
+                336,
+            )
+        with rasterio.open(filename) as d_s:
+            return d_s.read(), super_resolve.call_count
+
+    _, calls = process_windows(str(tmp_path / "small.tif"), (0, 0, 695, 719))
+    assert calls == 4
+    # The windows of the left column keep their extent and halo
+    extended, calls = process_windows(str(tmp_path / "large.tif"), (0, 0, 719, 719))
+    assert calls == 2
+
+    process.params.cache_dir = None
+    reference, calls = process_windows(str(tmp_path / "full.tif"), (0, 0, 719, 719))
+    assert calls == 4
+    np.testing.assert_array_equal(extended, reference)
+
+
+def test_start_resume_stand_in(tmp_path, monkeypatch):
+    monkeypatch.setenv("DSEN2_STAND_IN", "0")
+    synthetic_product.create_product(str(tmp_path), "product", size=720)
+
+    def start(filename, params):
+        inference.SuperresolutionProcess(
+            {"clip_to_aoi": False, **params},
+            input_dir=str(tmp_path),
+            output_dir=str(tmp_path) + "/",
+        ).start("product", filename)
+        with rasterio.open(tmp_path / filename) as d_s:
+            return d_s.read()
+
+    reference = start("full.tif", {})
+    write_result_window = inference.write_result_window
+    written = []
+
+    def preempted(*args):
+        if len(written) == 2:
+            raise KeyboardInterrupt
+        written.append(args[1:3])
+        write_result_window(*args)
+
+    with mock.patch.object(inference, "write_result_window", preempted):
+        with pytest.raises(KeyboardInterrupt):
+            start("resumed.tif", {"checkpoint_size": 336})
+    with mock.patch.object(inference, "write_result_window") as write:
+        write.side_effect = write_result_window
+        resumed = start("resumed.tif", {"checkpoint_size": 336})
+    # Only the remaining windows run the networks, the result is that of the
+    # scene in one piece
+    assert write.call_count == 4 - 2
+    assert reference.any()
+    np.testing.assert_array_equal(resumed, reference)